@@ -2,7 +2,9 @@
 Version: 0.3
 Date: 2022-06-03
 Authors: Steffen Pielström
-Dependencies: config.py v0.2, random, math
+Dependencies: config.py v0.2, sys, tracemalloc, array, struct, random, math, 
+time, hashlib, statistics, itertools, heapq, concurrent.futures, numpy 
+(optional), numba (optional)
 
 AttritionSim is a module for agent-based simulations of attrition warfare. 
 It is inspired by the classical Lanchester Laws of attrition, but follows
@@ -15,16 +17,54 @@ class objects. Furthermore there are functions that to create two opposing
 forces, have them fight each other and print the results.
 
 The module requires a configuration file config.py that contains default
-values.
+values. If numpy is installed, an alternative 'numpy' engine is available 
+that stores each force as a set of arrays and processes all units of a 
+force in vectorized batches. If numba is installed as well, the parts of 
+its steps that need a loop over the units run as compiled kernels.
 '''
 
 # Imports
 # --------------------------------------------------------------------
 
+import os
+import sys
+import pickle
+import zlib
+import tracemalloc
+from copy import copy
+from array import array
+from struct import Struct
 from random import random
+from random import getrandbits
+from random import Random
+from hashlib import sha256
+from statistics import NormalDist
+from statistics import fmean
+from statistics import stdev
 from math import atan
 from math import sin
 from math import cos
+from math import floor
+from math import inf
+from time import perf_counter
+from itertools import product
+from heapq import nsmallest
+from heapq import heappush
+from heapq import heapreplace
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from concurrent.futures import wait
+from concurrent.futures import FIRST_COMPLETED
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
 
 
 # Variables
@@ -32,8 +72,16 @@ from math import cos
 
 
 from config import max_steps
+from config import field_size
 from config import dist_border_init
 from config import firing_distance
+from config import unit_radius
+from config import chunk_size
+from config import ensemble_bins
+from config import sight_candidates
+from config import check_targeting
+from config import jit_kernels
+from config import checkpoint_every
 
 from config import Faction
 from config import Name
@@ -44,6 +92,19 @@ from config import Speed
 from config import Accuracy
 from config import Formation
 
+# Largest rounding error of distances between float32 positions on the 
+# battlefield, with a safety factor, see array_force.find_targets()
+compact_tolerance: float = 16*2.0**-23*field_size
+
+# Format of simulation snapshots, see simulation.snapshot()
+snapshot_format: int = 2
+
+# Arguments of run_simulation() and of the functions passing scenarios on
+# that do not change the results of a scenario, see canonical()
+run_options: list = ['output', 'faction', 'name', 'color', 'targeting', 'seed', 
+    'replicate', 'fast_forward', 'record', 'trajectory', 'metrics', 'checkpoint', 
+    'writer', 'workers']
+
 
 # Classes and methods
 # --------------------------------------------------------------------
@@ -63,13 +124,18 @@ class unit:
     - target_pos: list of two floats; x and y position of the current target
     - target_index: int, the index of the target in the opposing force's units list
     - target_dist: distance to target
+    - target_bound: float, lower bound for the distance to every enemy unit
+      other than the target, None if unknown
     - is_hit: boolean, indicates if the unit has been hit in the current time step
     - has_hit: boolean, indicates if the unit has hit its target in the current time step
+    - alive: boolean, set to False when the unit is removed from its force
+    - number: int, the unit's index in its force at the start of the simulation
+    - step_length: float, the distance the unit moved in the last time step
     '''
     
     def __init__(self, faction, pos=None, range=Range[0], speed=Speed[0], accuracy=Accuracy[0], 
-        target_pos=None, target_index=None, target_dist=None, is_hit=False, 
-        has_hit=False):
+        target_pos=None, target_index=None, target_dist=None, target_bound=None, 
+        is_hit=False, has_hit=False, alive=True, number=None, step_length=0.0):
         '''
         Test:
         >>> test_unit = unit(0, speed=5)
@@ -84,17 +150,21 @@ class unit:
         self.target_pos = target_pos
         self.target_index = target_index
         self.target_dist = target_dist 
+        self.target_bound = target_bound
         self.is_hit = is_hit
         self.has_hit = has_hit
+        self.alive = alive
+        self.number = number
+        self.step_length = step_length
 
 
     def move(self):
         '''
-        Version: 0.1
+        Version: 0.2
         Authors: Steffen Pielström
 
         Method to move a unit each time step. Updates the global pos attributes
-        for the unit in question.
+        for the unit in question, and step_length with the distance moved.
         Dependencies: math
 
         Test:
@@ -103,6 +173,7 @@ class unit:
         >>> [test_unit.pos[0], test_unit.pos[1]]
         [10.0, 0]
         '''
+        self.step_length = 0.0
         
         # Check if target exits
         if self.target_dist == None:
@@ -125,12 +196,14 @@ class unit:
 
             # Avoid division by zero when claculating target angle
             if self.pos[0] == self.target_pos[0]:
+                self.step_length = abs(speed)
                 if self.target_pos[1] < self.pos[1]:
                     self.pos[1] -= speed
                 else:
                     self.pos[1] += speed
 
             elif self.target_dist > speed:
+                self.step_length = abs(speed)
                 alpha = atan(abs(self.pos[1] - self.target_pos[1]) / abs(self.pos[0] - self.target_pos[0]))
                 if self.target_pos[0] < self.pos[0]:
                     self.pos[0] -= cos(alpha)*speed
@@ -169,16 +242,21 @@ class unit:
         return distance
 
 
-    def find_target(self, units):
+    def find_target(self, units, index=None):
         '''
-        Version: 0.2
+        Version: 0.4
         Authors: Steffen Pielström
 
-        Finds the closest enemy unit in a list of units.
+        Finds the closest enemy unit in a list of units. If a spatial_grid 
+        built over the positions of these units is passed as index, the 
+        closest unit is looked up in the grid instead of computing the 
+        distance to every unit. Both ways pick the same target, ties are
+        resolved in favour of the unit with the lowest index. The distance 
+        to the second closest unit is kept as target_bound, see keep_target().
 
-        Arguments: a list of units
+        Arguments: a list of units, optionally a spatial_grid over them
         Returns: the index of the closest unit in that list
-        Uses: calculate_distance()
+        Uses: calculate_distance(), spatial_grid.nearest()
 
         Test:
         >>> test_unit = unit(0, pos=[0, 0])
@@ -186,23 +264,133 @@ class unit:
         >>> test_unit.find_target(enemy_units)
         >>> test_unit.target_index
         0
+        >>> test_unit.find_target(enemy_units, spatial_grid([[10, 10], [10, 20]]))
+        >>> test_unit.target_index
+        0
         '''
+        if index is not None:
+            self.target_index, self.target_dist, self.target_bound = index.nearest(
+                self.pos, second=True)
+            self.target_pos = units[self.target_index].pos
+            return
+
         distances = []
         for element in units:
             distances.append(self.calculate_distance(element))
         self.target_index = distances.index(min(distances))
         self.target_pos = units[self.target_index].pos
         self.target_dist = min(distances)
- 
+        self.target_bound = nsmallest(2, distances)[-1] if len(distances) > 1 else inf
+
+
+    def keep_target(self, units, enemy_step):
+        '''
+        Version: 0.3
+
+        Checks if the current target is still the closest enemy unit without
+        searching all units. In the last step, the distance between the unit 
+        and any other enemy unit shrank by at most the distance the unit 
+        moved plus the longest distance moved by an enemy unit, so 
+        target_bound is lowered by this amount. As long as the distance to 
+        the target stays below that bound, the target is strictly the 
+        closest enemy, just as find_target() would decide. Once both forces
+        hold their positions, targets are kept until they are eliminated.
 
-    def fire(self, enemy_units):
+        Arguments: the list of enemy units, the longest step length among them
+        Returns: True if the target is kept, with target_pos, target_dist 
+        and target_bound updated, or False if recheck_target() or 
+        find_target() has to be called, with target_bound unchanged
+
+        Test:
+        >>> test_unit = unit(0, pos=[0, 0], speed=1)
+        >>> enemy_units = [unit(1, pos=[10, 0]), unit(1, pos=[20, 0])]
+        >>> test_unit.find_target(enemy_units)
+        >>> test_unit.target_bound
+        20.0
+        >>> test_unit.step_length = 1
+        >>> test_unit.keep_target(enemy_units, 1), test_unit.target_bound
+        (True, 18.0)
+        >>> enemy_units[0].pos = [17, 0]
+        >>> test_unit.keep_target(enemy_units, 1)
+        False
+        '''
+        if self.target_index is None or self.target_bound is None:
+            return False
+        bound = self.target_bound - self.step_length - enemy_step
+        target = units[self.target_index]
+        distance = self.calculate_distance(target)
+        # Small margin against rounding in the bound
+        if distance + 1e-9*max(1.0, distance) >= bound:
+            return False
+        self.target_pos = target.pos
+        self.target_dist = distance
+        self.target_bound = bound
+        return True
+
+
+    def recheck_target(self, units, moved):
         '''
         Version: 0.1
+
+        Finds the closest enemy unit for a unit that did not move in the 
+        last step and whose target is still alive, evaluating only the 
+        target and the enemy units that moved. The distances to all other
+        enemy units are unchanged, so they are still at least target_bound.
+        If the closest of the evaluated units is strictly closer than that,
+        it is the closest enemy, just as find_target() would decide.
+
+        Arguments: the list of enemy units, the indices of those that moved
+        in the last step
+        Returns: True if the closest enemy was found, with the target 
+        attributes updated, or False if find_target() has to be called
+
+        Test:
+        >>> test_unit = unit(0, pos=[0, 0])
+        >>> enemy_units = [unit(1, pos=[10, 0]), unit(1, pos=[20, 0]), unit(1, pos=[30, 0])]
+        >>> test_unit.find_target(enemy_units)
+        >>> enemy_units[2].pos = [5, 0]
+        >>> test_unit.recheck_target(enemy_units, [2]), test_unit.target_index, test_unit.target_bound
+        (True, 2, 10.0)
+        >>> enemy_units[1].pos = [5, 0]
+        >>> test_unit.recheck_target(enemy_units, [1])
+        False
+        '''
+        best_index = self.target_index
+        best_dist = self.calculate_distance(units[best_index])
+        second_dist = self.target_bound
+        for k in moved:
+            if k == self.target_index:
+                continue
+            distance = self.calculate_distance(units[k])
+            if distance < best_dist or (distance == best_dist and k < best_index):
+                second_dist = min(second_dist, best_dist)
+                best_index = k
+                best_dist = distance
+            elif distance < second_dist:
+                second_dist = distance
+        # Small margin against rounding in the bound
+        if best_dist + 1e-9*max(1.0, best_dist) >= second_dist:
+            return False
+        self.target_index = best_index
+        self.target_pos = units[best_index].pos
+        self.target_dist = best_dist
+        self.target_bound = second_dist
+        return True
+
+ 
+
+    def fire(self, enemy_units, rng=None):
+        '''
+        Version: 0.2
         Authors: Steffen Pielström
 
         Applies a random number generator to check if the unit hits its target.
+        By default, the random module is used. If an rng_stream is passed, 
+        the unit draws one number from it in every call, whether its target
+        is in range or not, which keeps the draws of different simulations 
+        on the same stream aligned.
         
-        Arguments: a list of units
+        Arguments: a list of units, optionally an rng_stream
         Returns: nothing, changes the is_hit attribute of a hit target to True
         Uses: random
 
@@ -214,11 +402,459 @@ class unit:
         True
         '''
         # Check if target got hit
-        if self.target_dist <= self.range and random() < self.accuracy:
+        self.has_hit = False
+        if self.target_dist is None:
+            # No enemy left, draws like a unit out of range
+            if rng is not None:
+                rng.random()
+        elif rng is not None:
+            draw = rng.random()
+            if self.target_dist <= self.range and draw < self.accuracy:
+                self.has_hit = True
+                enemy_units[self.target_index].is_hit = True
+        elif self.target_dist <= self.range and random() < self.accuracy:
             self.has_hit = True
             enemy_units[self.target_index].is_hit = True
 
 
+class rng_stream:
+    '''
+    Version: 0.1
+
+    A stream of random numbers owned by a single simulation. The stream is
+    derived from a root seed and a replicate index, so that every replicate 
+    of an experiment gets its own reproducible stream, independent of the
+    streams of other replicates and of the process it runs in. 
+    - seed: int, the root seed
+    - replicate: int, the index of the replicate
+    - antithetic: boolean, if True, replicates 2k and 2k+1 form an 
+      antithetic pair: they share one stream, and the second one uses 1 - u
+      for every number u drawn by the first one
+
+    Two simulations with the same seed and replicate index draw the same 
+    numbers, which gives common random numbers for comparing scenarios.
+    '''
+
+    def __init__(self, seed=None, replicate=0, antithetic=False):
+        '''
+        Test:
+        >>> first = rng_stream(1, replicate=0, antithetic=True)
+        >>> second = rng_stream(1, replicate=1, antithetic=True)
+        >>> first.random() + second.random()
+        1.0
+        >>> rng_stream(1, 3).random() == rng_stream(1, 3).random()
+        True
+        '''
+        if seed is None:
+            seed = getrandbits(64)
+        self.seed = seed
+        self.replicate = replicate
+        self.antithetic = antithetic
+        self.flip = antithetic and replicate % 2 == 1
+
+        base = replicate // 2 if antithetic else replicate
+        key = sha256((str(seed)+':'+str(base)).encode()).digest()
+        state = int.from_bytes(key[:16], 'big')
+        self.python = Random(state)
+        if np is not None:
+            self.numpy = np.random.default_rng(state)
+        else:
+            self.numpy = None
+
+
+    def random(self, size=None):
+        '''
+        Draws uniform random numbers from [0, 1).
+
+        Arguments: optionally the shape of a numpy array of numbers to draw
+        Returns: a float, or a numpy array if size is given
+        '''
+        if size is None:
+            value = self.python.random()
+        else:
+            value = self.numpy.random(size)
+        if self.flip:
+            return 1 - value
+        return value
+
+
+    def derive_seed(self, label):
+        '''
+        Derives a seed for another random process of the simulation, e.g.
+        the positions of a scattered formation, from the root seed, the 
+        replicate (shared by an antithetic pair) and a label, without 
+        drawing from the stream.
+
+        Arguments: a string
+        Returns: an int
+
+        Test:
+        >>> rng_stream(1, 2).derive_seed('blue') == rng_stream(1, 2).derive_seed('blue')
+        True
+        '''
+        base = self.replicate // 2 if self.antithetic else self.replicate
+        key = sha256((str(self.seed)+':'+str(base)+':'+label).encode()).digest()
+        return int.from_bytes(key[:8], 'big')
+
+
+    def skip(self, count, array=False):
+        '''
+        Discards count numbers, as if drawn one by one with random() or, 
+        with array=True, in arrays with random(size).
+
+        Test:
+        >>> first = rng_stream(1)
+        >>> second = rng_stream(1)
+        >>> first.skip(3)
+        >>> _ = [second.random() for i in range(3)]
+        >>> first.random() == second.random()
+        True
+        '''
+        if not array:
+            for i in range(count):
+                self.python.random()
+            return
+        while count > 0:
+            self.numpy.random(min(count, chunk_size))
+            count -= chunk_size
+
+
+class spatial_grid:
+    '''
+    Version: 0.1
+
+    A uniform grid over a set of positions, used as a spatial index to look
+    up the position closest to a query point without computing the distance
+    to every position. The grid is built once per time step from the
+    current positions of a force and is not updated when units move.
+    - positions: list of [x, y] positions, the index of a position in this
+      list is what nearest() returns
+    - cell_size: float, edge length of the square grid cells
+    - cells: dict mapping (column, row) to a list of position indices
+    - evaluations: int, number of distances computed by nearest() so far
+    '''
+
+    def __init__(self, positions, cell_size=None):
+        '''
+        Builds the grid. Without a given cell_size, it is chosen so that on
+        average about one position falls into each cell.
+
+        Test:
+        >>> index = spatial_grid([[0, 0], [10, 0], [10, 10]], cell_size=5)
+        >>> index.cells[(2, 0)]
+        [1]
+        '''
+        self.positions = [(float(x), float(y)) for x, y in positions]
+        self.evaluations = 0
+        n = len(self.positions)
+        if n == 0:
+            self.xmin = self.ymin = self.xmax = self.ymax = 0.0
+            self.columns = self.rows = 0
+            self.cell_size = 1.0 if cell_size is None else cell_size
+            self.cells = {}
+            return
+
+        xs = [element[0] for element in self.positions]
+        ys = [element[1] for element in self.positions]
+        self.xmin = min(xs)
+        self.ymin = min(ys)
+        self.xmax = max(xs)
+        self.ymax = max(ys)
+        width = self.xmax - self.xmin
+        height = self.ymax - self.ymin
+        if cell_size is None:
+            cell_size = max((width*height/n)**0.5, max(width, height)/n)
+            if cell_size == 0:
+                cell_size = 1.0
+        self.cell_size = cell_size
+
+        self.cells = {}
+        for i, (x, y) in enumerate(self.positions):
+            self.cells.setdefault(self.cell(x, y), []).append(i)
+        self.columns, self.rows = self.cell(self.xmax, self.ymax)
+
+
+    def cell(self, x, y):
+        '''
+        Returns the (column, row) of the cell containing the point x, y.
+        '''
+        return (floor((x - self.xmin) / self.cell_size), 
+            floor((y - self.ymin) / self.cell_size))
+
+
+    def nearest(self, pos, second=False):
+        '''
+        Version: 0.2
+
+        Finds the position closest to pos by searching the grid in square 
+        rings of cells around the cell closest to pos. Sides of a ring that
+        are farther away than the best distance found so far are skipped, 
+        and the search ends with the first ring that is skipped entirely. 
+        Distances are computed like in unit.calculate_distance(), and ties
+        are resolved in favour of the lowest index, so the result is the 
+        same as from a search over all positions. With second=True, the 
+        search continues until the second closest position is known, too.
+
+        Arguments: list of two floats, x and y position, optionally second
+        Returns: a tuple of the index of the closest position and its 
+        distance, with second=True also the distance of the second closest
+        position (inf if there is none)
+
+        Test:
+        >>> index = spatial_grid([[10, 10], [0, 10], [10, 0]])
+        >>> index.nearest([5, 5])
+        (0, 7.0710678118654755)
+        >>> index.nearest([0, 0])
+        (1, 10.0)
+        >>> index.nearest([0, 0], second=True)
+        (1, 10.0, 10.0)
+        '''
+        x, y = pos
+        column, row = self.cell(x, y)
+        column = min(max(column, 0), self.columns)
+        row = min(max(row, 0), self.rows)
+        best_index = None
+        best_dist = inf
+        second_dist = inf
+        limit = inf
+
+        ring = 0
+        searched = True
+        while searched:
+            searched = False
+            for gap, left, right, bottom, top in self.ring_sides(x, y, column, row, ring):
+                # Small margin against rounding in the gap calculation
+                if gap - limit > 1e-9*max(1.0, limit):
+                    continue
+                searched = True
+                for i in range(left, right + 1):
+                    for j in range(bottom, top + 1):
+                        candidates = self.cells.get((i, j), ())
+                        self.evaluations += len(candidates)
+                        for k in candidates:
+                            other = self.positions[k]
+                            xdist = abs(x - other[0])
+                            ydist = abs(y - other[1])
+                            distance = (xdist**2+ydist**2)**0.5
+                            if distance < best_dist or (distance == best_dist and k < best_index):
+                                second_dist = best_dist
+                                best_index = k
+                                best_dist = distance
+                            elif distance < second_dist:
+                                second_dist = distance
+                limit = second_dist if second else best_dist
+            ring += 1
+
+        if second:
+            return best_index, best_dist, second_dist
+        return best_index, best_dist
+
+
+    def nearest_many(self, pos, count, max_distance=inf):
+        '''
+        Finds the count positions closest to pos within max_distance, with
+        the same search in rings of cells as nearest().
+
+        Arguments: list of two floats, x and y position, the number of
+        positions to find, optionally the largest distance
+        Returns: a list of (distance, index) tuples, closest first, ties in
+        favour of the lowest index
+
+        Test:
+        >>> index = spatial_grid([[10, 10], [0, 10], [10, 0], [3, 3]])
+        >>> index.nearest_many([0, 0], 3)
+        [(4.242640687119285, 3), (10.0, 1), (10.0, 2)]
+        >>> index.nearest_many([0, 0], 3, max_distance=5)
+        [(4.242640687119285, 3)]
+        '''
+        x, y = pos
+        column, row = self.cell(x, y)
+        column = min(max(column, 0), self.columns)
+        row = min(max(row, 0), self.rows)
+        # Max-heap of the best positions so far, as (-distance, -index)
+        best = []
+        limit = max_distance
+
+        ring = 0
+        searched = True
+        while searched:
+            searched = False
+            for gap, left, right, bottom, top in self.ring_sides(x, y, column, row, ring):
+                # Small margin against rounding in the gap calculation
+                if gap - limit > 1e-9*max(1.0, limit):
+                    continue
+                searched = True
+                for i in range(left, right + 1):
+                    for j in range(bottom, top + 1):
+                        candidates = self.cells.get((i, j), ())
+                        self.evaluations += len(candidates)
+                        for k in candidates:
+                            other = self.positions[k]
+                            xdist = abs(x - other[0])
+                            ydist = abs(y - other[1])
+                            distance = (xdist**2+ydist**2)**0.5
+                            if distance > max_distance:
+                                continue
+                            if len(best) < count:
+                                heappush(best, (-distance, -k))
+                            elif (-distance, -k) > best[0]:
+                                heapreplace(best, (-distance, -k))
+                if len(best) == count:
+                    limit = -best[0][0]
+            ring += 1
+
+        return sorted((-distance, -k) for distance, k in best)
+
+
+    def ring_sides(self, x, y, column, row, ring):
+        '''
+        Splits the ring of cells at exactly the given Chebyshev distance 
+        (in cells) from column, row into up to four straight sides, 
+        clipped to the grid. 
+
+        Returns: a list of tuples (gap, left, right, bottom, top) with the
+        smallest distance from x, y to the side and its first and last 
+        column and row
+        '''
+        left = max(column - ring, 0)
+        right = min(column + ring, self.columns)
+        bottom = max(row - ring + 1, 0)
+        top = min(row + ring - 1, self.rows)
+
+        sides = []
+        for j in sorted({row - ring, row + ring}):
+            if 0 <= j <= self.rows:
+                sides.append((self.gap(x, y, left, right, j, j), left, right, j, j))
+        if bottom <= top:
+            for i in (column - ring, column + ring):
+                if 0 <= i <= self.columns:
+                    sides.append((self.gap(x, y, i, i, bottom, top), i, i, bottom, top))
+        return sides
+
+
+    def gap(self, x, y, left, right, bottom, top):
+        '''
+        Returns the distance from x, y to the rectangle covered by the cells
+        from column left to right and row bottom to top, clipped to the 
+        bounding box of all positions.
+        '''
+        xgap = max(self.xmin + left*self.cell_size - x, 
+            x - min(self.xmin + (right + 1)*self.cell_size, self.xmax), 0)
+        ygap = max(self.ymin + bottom*self.cell_size - y, 
+            y - min(self.ymin + (top + 1)*self.cell_size, self.ymax), 0)
+        return (xgap**2 + ygap**2)**0.5
+
+
+class sight_grid:
+    '''
+    Version: 0.1
+
+    A uniform grid over the positions of the units of both forces, used to
+    check if another unit blocks the line of sight of a shot. Every unit 
+    blocks a disk of the given radius around its position and is entered 
+    in all cells this disk overlaps, so the units that may block a shot 
+    are found in the cells the shot line passes through. These cells are
+    visited in order along the line (Amanatides and Woo), and the check 
+    stops at the first blocking unit. The cost of a check grows with the 
+    length of the shot in cells, not with the number of units.
+    - positions: list of (x, y) positions of all units
+    - radius: float, the radius of the disk a unit blocks
+    - cell_size: float, edge length of the square grid cells, at least 
+      twice the radius
+    - cells: dict mapping (column, row) to a list of position indices
+    '''
+
+    def __init__(self, positions, radius=unit_radius):
+        '''
+        Test:
+        >>> sight = sight_grid([[0, 0], [5, 0.1], [10, 0]], radius=0.25)
+        >>> sight.blocked([0, 0], [10, 0], ignore=(0, 2))
+        True
+        >>> sight.blocked([0, 0], [5, 5], ignore=(0,))
+        False
+        '''
+        self.positions = [(float(x), float(y)) for x, y in positions]
+        self.radius = radius
+        n = max(len(self.positions), 1)
+        xs = [element[0] for element in self.positions] or [0.0]
+        ys = [element[1] for element in self.positions] or [0.0]
+        self.xmin = min(xs) - radius
+        self.ymin = min(ys) - radius
+        area = (max(xs) - min(xs))*(max(ys) - min(ys))
+        self.cell_size = max(2*radius, (area/n)**0.5) or 1.0
+
+        self.cells = {}
+        for i, (x, y) in enumerate(self.positions):
+            left, bottom = self.cell(x - radius, y - radius)
+            right, top = self.cell(x + radius, y + radius)
+            for column in range(left, right + 1):
+                for row in range(bottom, top + 1):
+                    self.cells.setdefault((column, row), []).append(i)
+
+
+    def cell(self, x, y):
+        '''
+        Returns the (column, row) of the cell containing the point x, y.
+        '''
+        return (floor((x - self.xmin) / self.cell_size), 
+            floor((y - self.ymin) / self.cell_size))
+
+
+    def blocked(self, start, end, ignore=()):
+        '''
+        Checks if a unit other than those in ignore, usually the shooter 
+        and its target, lies within radius of the line from start to end, 
+        somewhere between both ends.
+
+        Arguments: the start and end point, indices of units to ignore
+        Returns: True if the line of sight is blocked
+        '''
+        x0, y0 = start
+        x1, y1 = end
+        dx = x1 - x0
+        dy = y1 - y0
+        length = dx*dx + dy*dy
+        if length == 0:
+            return False
+        limit = self.radius*self.radius
+
+        column, row = self.cell(x0, y0)
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        if dx != 0:
+            border = self.xmin + (column + (dx > 0))*self.cell_size
+            next_x = (border - x0)/dx
+            delta_x = self.cell_size/abs(dx)
+        else:
+            next_x = delta_x = inf
+        if dy != 0:
+            border = self.ymin + (row + (dy > 0))*self.cell_size
+            next_y = (border - y0)/dy
+            delta_y = self.cell_size/abs(dy)
+        else:
+            next_y = delta_y = inf
+
+        while True:
+            for k in self.cells.get((column, row), ()):
+                if k in ignore:
+                    continue
+                x, y = self.positions[k]
+                t = ((x - x0)*dx + (y - y0)*dy)/length
+                if 0 < t < 1:
+                    xdist = x0 + t*dx - x
+                    ydist = y0 + t*dy - y
+                    if xdist*xdist + ydist*ydist < limit:
+                        return True
+            if min(next_x, next_y) > 1:
+                return False
+            if next_x < next_y:
+                next_x += delta_x
+                column += step_x
+            else:
+                next_y += delta_y
+                row += step_y
+
+
 class force():
     '''
     Version: 0.1
@@ -232,8 +868,11 @@ class force():
     - range: float, units' maximum firing range
     - speed: float, moving distance per time step
     - accuracy: float between 0 and 1; prob of each unit per time step to hit its target
-    - formation: string, either 'one line', 'two lines' or 'scattered'
+    - formation: string, 'one line', 'two lines', 'scattered', 'grid' or 
+      'column', see formation_positions()
     - units: a list of objects of class 'unit'
+    - index_map: list mapping the units' indices before the last call of 
+      kill_hit_units() to their new indices, None for removed units
     '''
 
     def __init__(self, index, name, color=Color[0], strength=Strength[0], range=Range[0], 
@@ -254,17 +893,18 @@ class force():
         self.accuracy = accuracy
         self.formation = formation
         self.units = units
+        self.index_map = None
 
 
-    def generate_positions(self):
+    def generate_positions(self, seed=None):
         '''
-        Version: 0.1
+        Version: 0.2
         Authors: Steffen Pielström
 
         Generates initial x and y coordinates for all units in a force depending on
-        the force's formation parameter. Currently, only a one line formation is
-        implemented.
+        the force's formation parameter, see formation_positions().
 
+        Arguments: optionally a seed for the 'scattered' formation
         Returns: a list of two lists of float, [[x1, x2, ...], [y1, y2, ...]]
 
         Test:
@@ -272,31 +912,20 @@ class force():
         >>> blue_force.generate_positions()[1][0]
         10.0
         '''
+        positions = formation_positions(self.formation, self.index, self.strength, seed=seed)
+        if np is not None:
+            return [positions[:, 0].tolist(), positions[:, 1].tolist()]
+        return [[x for x, y in positions], [y for x, y in positions]]
 
-        # Generate list of coordinates
-        xpos = []
-        ypos = []
         
-        # Single line formation 
-        if self.formation == 'one line':
-            dist = 100/(self.strength+1)
-            for i in range(self.strength):
-                if self.index == 0:
-                    xpos.append(0+dist_border_init)
-                elif self.index == 1:
-                    xpos.append(100-dist_border_init)   
-                else:
-                    print('Error in initialize_postions(): faction unknown')   
-                ypos.append((1+i)*dist)
-        return([xpos, ypos])
-
-        
-    def initialize_units(self):
+    def initialize_units(self, seed=None):
         '''
         Version: 0.1
         Authors: Steffen Pielström
 
         Method to initialize unit attributes within a force. 
+
+        Arguments: optionally a seed for the 'scattered' formation
         
         Test:
         >>> blue_force = force(0, 'blue', strength=9)
@@ -305,20 +934,24 @@ class force():
         10.0
         '''
 
-        positions = self.generate_positions()
+        positions = self.generate_positions(seed)
         self.units = []
         for i in range(self.strength):
             self.units.append(
                 unit(self.index, [positions[0][i], positions[1][i]], 
-                self.range, self.speed, self.accuracy)
+                self.range, self.speed, self.accuracy, number=i)
                 )
 
     def kill_hit_units(self):
         '''
-        Version: 0.1
+        Version: 0.2
         Authors: Steffen Pielström
 
-        Removes all units hit at the end of a time step.
+        Removes all units hit at the end of a time step. Hit units are 
+        marked as dead and the list of units is compacted in a single pass,
+        so all hits of a time step are applied and the cost is linear in 
+        the number of units. The mapping from old to new indices is stored
+        in index_map, to be passed to remap_targets() of the enemy force.
 
         Test:
         >>> blue_force = force(0, 'blue', strength=9)
@@ -329,185 +962,3487 @@ class force():
         >>> blue_force.kill_hit_units()
         >>> len(blue_force.units)
         8
+        >>> blue_force.units[0].is_hit = True
+        >>> blue_force.units[1].is_hit = True
+        >>> blue_force.kill_hit_units()
+        >>> len(blue_force.units), blue_force.index_map[:4]
+        (6, [None, None, 0, 1])
         '''
+        survivors = []
+        self.index_map = []
         for element in self.units:
             if element.is_hit == True:
-                self.units.remove(element)
-
+                element.alive = False
+                self.index_map.append(None)
+            else:
+                self.index_map.append(len(survivors))
+                survivors.append(element)
+        self.units = survivors
 
-class experiment():
-    '''
-    Version: 0.1
-    Authors: Steffen Pielström
 
-    The experiment class object stores all information that may be returned 
-    as output after a simulation.
-    '''
-    def __init__(self, name=Name, strength=Strength, range=Range, 
-                speed=Speed, accuracy=Accuracy, formation=Formation):
+    def check_sight(self, enemy, radius=unit_radius):
+        '''
+        Version: 0.1
 
-        self.name = name
-        self.strength = strength
-        self.range = range
-        self.speed = speed
-        self.accuracy = accuracy
-        self.formation = formation
-        self.steps = 0
-        self.blue = []
-        self.red = []
+        Checks the line of sight of all units that hit their target in the
+        current step, after fire(). A unit whose shot is blocked by another
+        unit hits the nearest visible enemy unit in range instead, which 
+        becomes its target, or nothing if there is none, see 
+        visible_targets(). Only hits are checked, which gives the same 
+        result as checking every shot, since the unit would have hit any
+        other target with the same random number.
 
+        Arguments: the opposing force, optionally the radius of a unit
 
-    def update(self):
-        '''
-        Track the strength development in each step of the simulation.
+        Test:
+        >>> blue_force = force(0, 'blue', strength=2, accuracy=1, range=100)
+        >>> red_force = force(1, 'red', strength=2)
+        >>> blue_force.initialize_units()
+        >>> red_force.initialize_units()
+        >>> blue_force.units[1].pos = [50, 50]
+        >>> blue_force.units[0].target_index = blue_force.units[1].target_index = 1
+        >>> blue_force.units[0].target_dist = blue_force.units[1].target_dist = 50
+        >>> blue_force.units[0].fire(red_force.units)
+        >>> blue_force.check_sight(red_force, radius=1)
+        >>> blue_force.units[0].target_index, red_force.units[0].is_hit
+        (0, True)
         '''
-        self.steps += 1
-        self.blue.append(len(blue_force.units))
-        self.red.append(len(red_force.units))
+        shooters = [i for i, element in enumerate(self.units) if element.has_hit]
+        if not shooters:
+            return
+        targets = [self.units[i].target_index for i in shooters]
+        for target in targets:
+            enemy.units[target].is_hit = False
+        visible = visible_targets([element.pos for element in self.units], 
+            [element.pos for element in enemy.units], shooters, targets, 
+            [self.units[i].range for i in shooters], radius)
 
+        for i, target in zip(shooters, visible):
+            element = self.units[i]
+            if target is None:
+                element.has_hit = False
+                continue
+            if target != element.target_index:
+                element.target_index = target
+                element.target_pos = enemy.units[target].pos
+                element.target_dist = element.calculate_distance(enemy.units[target])
+                element.target_bound = None
+            enemy.units[target].is_hit = True
 
-    def print(self, type='result'):
-        '''
-        Print formatted output.
+
+    def remap_targets(self, index_map):
         '''
+        Version: 0.1
 
-        if type == 'result':
-            steps = 'steps: '+str(self.steps)
-            if self.blue[-1] == 0 and self.red[-1] > 0:
-                result = 'result: '+Name[1]+' victory'
-            elif self.blue[-1] > 0 and self.red[-1] == 0:
-                result = 'result: '+Name[0]+' victory'
-            elif self.blue[-1] == 0 and self.red[-1] == 0:
-                result = 'result: both forces down'
-            else:
-                result = 'result: no winner yet'
-            blue = self.name[0]+' force strength: '+str(self.blue[-1])
-            red = self.name[1]+' force strength: '+str(self.red[-1])
-            print(steps+'\n'+result+'\n'+blue+'\n'+red)
+        Updates the units' target indices after the enemy force has removed
+        its hit units. Units whose target was removed get None as 
+        target_index, but keep target_pos and target_dist until they find 
+        a new target.
 
-        elif type == 'full':
-            values = ''
-            for i in range(len(self.blue)):
-                values += '\n' + str(self.blue[i]) + ',' + str(self.red[i])
-            print(self.name[0]+','+self.name[1]+ values)
+        Arguments: the index_map of the enemy force
 
-        else:
-            print('Warning: Output format unknown.')
-            print('Specify as either \'result\' or \'full\'')
+        Test:
+        >>> blue_force = force(0, 'blue', strength=2)
+        >>> blue_force.initialize_units()
+        >>> blue_force.units[0].target_index = 1
+        >>> blue_force.units[1].target_index = 0
+        >>> blue_force.remap_targets([None, 0])
+        >>> [element.target_index for element in blue_force.units]
+        [0, None]
+        '''
+        for element in self.units:
+            if element.target_index is not None:
+                element.target_index = index_map[element.target_index]
 
 
+    def __len__(self):
+        '''
+        Returns the number of units currently in the force.
 
-# Functions
-# --------------------------------------------------------------------
+        Test:
+        >>> blue_force = force(0, 'blue', strength=9)
+        >>> blue_force.initialize_units()
+        >>> len(blue_force)
+        9
+        '''
+        return len(self.units)
 
-def initialize(faction=Faction, name=Name, color=Color, strength=Strength, 
-    range=Range, speed=Speed, accuracy=Accuracy, formation=Formation):
+
+class array_force(force):
     '''
     Version: 0.1
-    Authors: Steffen Pielström
-
-    Initializes two forces to start a simulation.
 
-    Test:
-    ##>>> blue_force = force(0, 'blue')
-    ##>>> initialize()
-    ##>>> blue_force.units[0].pos
-    ##[10, 9.090909090909092]
+    A force that does not store its units as a list of 'unit' objects but 
+    as a set of contiguous numpy arrays with one entry per unit. It is used 
+    by the 'numpy' engine, which processes targeting, movement and fire for
+    all units of a force in vectorized batches. On top of the attributes of
+    'force', it holds:
+    - pos: float array of shape (n, 2), x and y positions of the units
+    - ranges: float array, each unit's maximum firing range
+    - speeds: float array, each unit's moving distance per time step
+    - accuracies: float array, each unit's probability to hit per time step
+    - target_index: int array, index of each unit's target in the enemy 
+      arrays, -1 if the unit has no target
+    - target_dist: float array, distance to the target
+    - target_bound: float array, lower bound for the distance to every 
+      enemy unit other than the target, see unit.keep_target()
+    - alive: boolean array, False for units eliminated in the current step
+    - is_hit: boolean array, units hit in the current time step
+    - has_hit: boolean array, units that hit their target in the current 
+      time step
+    - numbers: int array, each unit's index in the force at the start of 
+      the simulation
+    - step_length: float array, the distance each unit moved in the last 
+      time step
+    - evaluations: int, number of distances computed in the last call of
+      find_targets()
+    - compact: boolean, if True, positions and distances are stored as 
+      float32 and indices as int32, see set_size()
+    - near_ties: int, number of target choices between enemy units whose 
+      distances differ by less than the float32 precision, see find_targets()
     '''
-    global blue_force
-    blue_force = force(faction[0], name[0], color[0], strength[0], range[0], speed[0], 
-    accuracy[0], formation[0])
-    blue_force.initialize_units()
 
-    global red_force
-    red_force = force(faction[1], name[1], color[1], strength[1], range[1], speed[1], 
-    accuracy[1], formation[1])
-    red_force.initialize_units()
+    arrays = ['pos', 'ranges', 'speeds', 'accuracies', 'target_index', 
+        'target_dist', 'target_bound', 'alive', 'is_hit', 'has_hit', 'numbers', 
+        'step_length']
 
-    global results
-    results = experiment()
+    def __init__(self, index, name, color=Color[0], strength=Strength[0], range=Range[0], 
+        speed=Speed[0], accuracy=Accuracy[0], formation=Formation[0], compact=False):
+        '''
+        Test:
+        >>> blue_force = array_force(0, 'blue', strength=10)
+        >>> blue_force.strength
+        10
+        '''
+        if np is None:
+            raise ImportError('The numpy engine requires numpy to be installed.')
+        force.__init__(self, index, name, color, strength, range, speed, accuracy, 
+            formation, units=None)
+        self.evaluations = 0
+        self.compact = compact
+        self.near_ties = 0
+        self.set_size(0)
 
 
-def update_forces(blue_force, red_force):
-    '''
-    Version: 0.2
-    Authors: Steffen Pielström
+    def set_size(self, n):
+        '''
+        Version: 0.2
 
-    Performs a single complete simulation step for all forces/units
-    involved. 
-    
-    Test:
-    To be done...
-    '''
-    # First set of loops: identify targets
-    for element in blue_force.units:
-        element.find_target(red_force.units)
-    for element in red_force.units:
-        element.find_target(blue_force.units)
-
-    # Second set of loops: move and fire
-    for element in blue_force.units:
-        element.move()
-        element.fire(red_force.units)
-    for element in red_force.units:
-        element.move()
-        element.fire(blue_force.units) 
-    blue_force.kill_hit_units()
-    red_force.kill_hit_units()
+        Allocates empty arrays for n units. The boolean flags take one byte
+        per unit. Other values take eight bytes, or four with compact=True:
+        float32 positions, distances and unit attributes, int32 indices.
+        This halves the memory per unit, see memory_estimate().
 
+        Test:
+        >>> array_force(0, 'blue', compact=True).pos.dtype
+        dtype('float32')
+        '''
+        real = np.float32 if self.compact else np.float64
+        integer = np.int32 if self.compact else np.intp
+        self.pos = np.zeros((n, 2), dtype=real)
+        self.ranges = np.zeros(n, dtype=real)
+        self.speeds = np.zeros(n, dtype=real)
+        self.accuracies = np.zeros(n, dtype=real)
+        self.target_index = np.full(n, -1, dtype=integer)
+        self.target_dist = np.full(n, np.inf, dtype=real)
+        self.target_bound = np.full(n, -np.inf, dtype=real)
+        self.alive = np.ones(n, dtype=bool)
+        self.is_hit = np.zeros(n, dtype=bool)
+        self.has_hit = np.zeros(n, dtype=bool)
+        self.numbers = np.arange(n, dtype=integer)
+        self.step_length = np.zeros(n, dtype=real)
 
-def run_simulation(max_steps=max_steps, output='return', faction=Faction, name=Name,
-    color=Color, strength=Strength, range=Range, speed=Speed, accuracy=Accuracy,
-    formation=Formation):
-    '''
-    Version: 0.3
-    Authors: Steffen Pielström
-    
-    This is the main function calling all methods and functions in the
-    module and runnning an antire simulation from initialization to 
-    returning the final result.
-    '''
-    initialize(faction=faction, name=name, color=color, strength=strength, range=range, 
-        speed=speed, accuracy=accuracy,formation=formation)
-    
-    # Initialize loop conditions
-    conditions = True
 
-    # Main loop
-    while conditions == True:        
-        update_forces(blue_force, red_force)        
-        results.update()
+    def initialize_units(self, seed=None):
+        '''
+        Version: 0.2
 
-        conditions = (
-            len(blue_force.units) > 0 
-            and len(red_force.units) > 0 
-            and results.steps < max_steps
-            )
+        Fills the unit arrays with the initial positions and the force's 
+        attributes.
 
-    # Handle results
-    if output == 'return':
-        return results
-    else:
-        results.print(output)
+        Arguments: optionally a seed for the 'scattered' formation
 
-def run_lanchester(max_steps=max_steps, strength=Strength, value=Accuracy, 
-                type='square', output='return'):
+        Test:
+        >>> blue_force = array_force(0, 'blue', strength=9)
+        >>> blue_force.initialize_units()
+        >>> float(blue_force.pos[0, 1])
+        10.0
+        '''
+        self.set_size(self.strength)
+        self.pos[:] = formation_positions(self.formation, self.index, self.strength, 
+            seed=seed)
+        self.ranges[:] = self.range
+        self.speeds[:] = self.speed
+        self.accuracies[:] = self.accuracy
+
+
+    def target_distances(self, enemy, units=slice(None)):
+        '''
+        Computes the distances of units to their targets like 
+        nearest_enemies(), so that they do not depend on how the targets 
+        were found.
+
+        Arguments: the opposing array_force, optionally the indices of the
+        units, else all units, which must all have a target
+        Returns: a float array of the distances
+
+        Test:
+        >>> blue_force = array_force(0, 'blue', strength=1)
+        >>> red_force = array_force(1, 'red', strength=1)
+        >>> blue_force.initialize_units()
+        >>> red_force.initialize_units()
+        >>> blue_force.target_index[:] = 0
+        >>> blue_force.target_distances(red_force).tolist()
+        [80.0]
+        '''
+        target_pos = enemy.pos[self.target_index[units]]
+        return np.sqrt((self.pos[units, 0] - target_pos[:, 0])**2 
+            + (self.pos[units, 1] - target_pos[:, 1])**2)
+
+
+    def find_targets(self, enemy, targeting='brute'):
+        '''
+        Version: 0.4
+
+        Vectorized version of unit.keep_target(), unit.recheck_target() and
+        unit.find_target() for all units of the force: units keep their 
+        target while it is provably still the closest enemy, units that did
+        not move evaluate only the enemy units that moved, see 
+        recheck_targets(), and all others search the enemy force. With 
+        targeting='brute', distances to all enemy units are evaluated in 
+        blocks of at most chunk_size unit pairs. With targeting='grid', each
+        searching unit looks up its target in a spatial_grid over the enemy
+        positions. If the step kernels are compiled, brute targeting runs in
+        nearest_kernel() instead, see compile_kernels(). Like in 
+        find_target(), ties are resolved in favour of the enemy unit with 
+        the lowest index. The distances to the targets are the same with 
+        every method, see target_distances().
+
+        With compact storage, the bounds are lowered by compact_tolerance in
+        every step to make up for the rounding of float32 positions. Units
+        whose closest and second closest enemy are closer than that to 
+        each other may pick another target than with float64 storage; they
+        are counted in near_ties, and a warning is printed once per force.
+
+        Returns: the number of units that searched the enemy force
+
+        Arguments: the opposing array_force, optionally the targeting method
+
+        Test:
+        >>> blue_force = array_force(0, 'blue', strength=2)
+        >>> red_force = array_force(1, 'red', strength=2)
+        >>> blue_force.initialize_units()
+        >>> red_force.initialize_units()
+        >>> red_force.pos[0, 1] = 100
+        >>> blue_force.find_targets(red_force)
+        2
+        >>> blue_force.target_index.tolist()
+        [1, 1]
+        >>> blue_force.find_targets(red_force)
+        0
+        '''
+        m = len(enemy)
+        if m == 0:
+            self.target_index[:] = -1
+            self.target_dist[:] = np.inf
+            self.target_bound[:] = -np.inf
+            self.evaluations = 0
+            return 0
+
+        # Keep targets that are still closer than the lowered bound
+        kept = np.flatnonzero(self.target_index >= 0)
+        distance = self.target_distances(enemy, kept)
+        previous = self.target_bound[kept]
+        if self.compact:
+            previous = previous - compact_tolerance
+        bound = previous - (self.step_length[kept] + enemy.step_length.max())
+        # Small margin against rounding in the bound
+        margin = 1e-6 if self.compact else 1e-9
+        keep = distance + margin*np.maximum(1.0, distance) < bound
+        self.target_dist[kept[keep]] = distance[keep]
+        self.target_bound[kept[keep]] = bound[keep]
+        self.evaluations = len(kept)
+
+        # Units that did not move only evaluate the enemy units that moved
+        moved = np.flatnonzero(enemy.step_length > 0)
+        still = np.flatnonzero(~keep & (self.step_length[kept] == 0))
+        if len(moved) > 0 and len(still) > 0:
+            keep[still] = self.recheck_targets(enemy, kept[still], distance[still], 
+                previous[still], moved, margin)
+
+        search = np.ones(len(self), dtype=bool)
+        search[kept[keep]] = False
+        search = np.flatnonzero(search)
+        if len(search) == 0:
+            return 0
+
+        if targeting == 'grid':
+            index = spatial_grid(enemy.pos.tolist())
+            for i, pos in zip(search.tolist(), self.pos[search].tolist()):
+                self.target_index[i], self.target_dist[i], self.target_bound[i] = (
+                    index.nearest(pos, second=True))
+            self.target_dist[search] = self.target_distances(enemy, search)
+            self.evaluations += index.evaluations
+        elif 'nearest_kernel' in kernels:
+            self.evaluations += len(search)*m
+            kernels['nearest_kernel'](self.pos, enemy.pos, search, self.target_index, 
+                self.target_dist, self.target_bound)
+        else:
+            self.evaluations += len(search)*m
+            (self.target_index[search], self.target_dist[search], 
+                self.target_bound[search]) = nearest_enemies(self.pos[search], enemy.pos, 
+                second=True)
+
+        if self.compact:
+            self.count_near_ties(search)
+        return len(search)
+
+
+    def recheck_targets(self, enemy, units, distance, bound, moved, margin):
+        '''
+        Vectorized version of unit.recheck_target() for units that did not
+        move in the last step and whose target is still alive: the closest
+        of the target and the enemy units that moved is the closest enemy 
+        if it is strictly closer than the previous bound.
+
+        Arguments: the opposing array_force, the indices of the units, the 
+        distances to their targets, their previous bounds, the indices of 
+        the enemy units that moved and the margin against rounding
+        Returns: a boolean array, True for the units whose closest enemy 
+        was found, with their target arrays updated
+        '''
+        self.evaluations += len(units)*len(moved)
+        target = self.target_index[units]
+        index, best, second = nearest_enemies(self.pos[units], enemy.pos[moved], 
+            second=True)
+        index = moved[index]
+        # A target that moved is among the evaluated units already
+        apart = enemy.step_length[target] == 0
+        first = apart & ((distance < best) | ((distance == best) & (target < index)))
+        second = np.where(first, best, np.where(apart, np.minimum(second, distance), second))
+        second = np.minimum(second, bound)
+        index = np.where(first, target, index)
+        best = np.where(first, distance, best)
+        found = best + margin*np.maximum(1.0, best) < second
+        units = units[found]
+        self.target_index[units] = index[found]
+        self.target_dist[units] = best[found]
+        self.target_bound[units] = second[found]
+        if self.compact:
+            self.count_near_ties(units)
+        return found
+
+
+    def count_near_ties(self, search):
+        '''
+        Counts the units that just searched a target and whose second 
+        closest enemy is farther away than their target, but by at most 
+        compact_tolerance, so that float32 rounding may have decided 
+        between the two.
+        Prints a warning to stderr the first time such units occur, so that
+        it does not mix with results written to stdout; near_ties is the
+        count to check programmatically.
+
+        Arguments: int array, indices of the units that searched a target
+
+        Test:
+        >>> blue_force = array_force(0, 'blue', strength=1, compact=True)
+        >>> red_force = array_force(1, 'red', strength=2, compact=True)
+        >>> blue_force.initialize_units()
+        >>> red_force.initialize_units()
+        >>> red_force.pos[:] = [[50, 40], [50, 60.00001]]
+        >>> import io, contextlib
+        >>> log = io.StringIO()
+        >>> with contextlib.redirect_stderr(log):
+        ...     _ = blue_force.find_targets(red_force)
+        >>> print(log.getvalue(), end='')
+        Warning: 1 units of blue chose between enemy units at distances within float32 precision; their targets may differ with compact=False.
+        >>> blue_force.near_ties
+        1
+        '''
+        gap = self.target_bound[search] - self.target_dist[search]
+        # Exact ties come from enemy units at the same position, e.g. units
+        # that stopped at firing range of the same target, and are resolved
+        # by index with either precision
+        ties = int(np.count_nonzero((gap > 0) & (gap <= compact_tolerance)))
+        if ties > 0 and self.near_ties == 0:
+            print('Warning: '+str(ties)+' units of '+self.name+' chose between enemy '
+                'units at distances within float32 precision; their targets may differ '
+                'with compact=False.', file=sys.stderr)
+        self.near_ties += ties
+
+
+    def move(self, enemy):
+        '''
+        Version: 0.1
+
+        Vectorized version of unit.move() for all units of the force. Units
+        move towards the current position of their target in the enemy force.
+
+        Arguments: the opposing array_force
+
+        Test:
+        >>> blue_force = array_force(0, 'blue', strength=1, speed=10, range=1)
+        >>> red_force = array_force(1, 'red', strength=1)
+        >>> blue_force.initialize_units()
+        >>> red_force.initialize_units()
+        >>> _ = blue_force.find_targets(red_force)
+        >>> blue_force.move(red_force)
+        >>> blue_force.pos[0].tolist()
+        [20.0, 50.0]
+        '''
+        if len(self) == 0 or len(enemy) == 0:
+            self.step_length[:] = 0
+            return
+        if 'move_kernel' in kernels:
+            kernels['move_kernel'](self.pos, enemy.pos, self.target_index, self.target_dist, 
+                self.ranges, self.speeds, self.step_length)
+            return
+
+        xstep, ystep, moving = move_steps(self.pos, enemy.pos[self.target_index], 
+            self.target_dist, self.ranges, self.speeds)
+        moving &= self.target_index >= 0
+        self.pos[moving, 0] += xstep[moving]
+        self.pos[moving, 1] += ystep[moving]
+        self.step_length = np.where(moving, np.hypot(xstep, ystep), 0.0)
+
+
+    def fire(self, enemy, rng):
+        '''
+        Version: 0.1
+
+        Vectorized version of unit.fire() for all units of the force.
+
+        Arguments: the opposing array_force, a numpy random Generator or an 
+        rng_stream
+        Returns: nothing, sets is_hit for all enemy units that were hit
+
+        Test:
+        >>> blue_force = array_force(0, 'blue', strength=2, accuracy=1, range=100)
+        >>> red_force = array_force(1, 'red', strength=2)
+        >>> blue_force.initialize_units()
+        >>> red_force.initialize_units()
+        >>> _ = blue_force.find_targets(red_force)
+        >>> blue_force.fire(red_force, np.random.default_rng(0))
+        >>> red_force.is_hit.tolist()
+        [True, True]
+        '''
+        if 'fire_kernel' in kernels:
+            kernels['fire_kernel'](self.target_index, self.target_dist, self.ranges, 
+                self.accuracies, rng.random(len(self)), self.has_hit, enemy.is_hit)
+            return
+        in_range = (self.target_index >= 0) & (self.target_dist <= self.ranges)
+        self.has_hit = in_range & (rng.random(len(self)) < self.accuracies)
+        enemy.is_hit[self.target_index[self.has_hit]] = True
+
+
+    def kill_hit_units(self):
+        '''
+        Version: 0.1
+
+        Removes all units hit at the end of a time step by compacting the
+        unit arrays in one pass. The mapping from old to new indices, -1 for
+        removed units, is stored in index_map.
+
+        Test:
+        >>> blue_force = array_force(0, 'blue', strength=9)
+        >>> blue_force.initialize_units()
+        >>> blue_force.is_hit[[0, 1]] = True
+        >>> blue_force.kill_hit_units()
+        >>> len(blue_force), blue_force.index_map[:4].tolist()
+        (7, [-1, -1, 0, 1])
+        '''
+        self.alive &= ~self.is_hit
+        keep = self.alive
+        self.index_map = np.where(keep, np.cumsum(keep, dtype=self.target_index.dtype) - 1, 
+            -1)
+        for name in self.arrays:
+            setattr(self, name, getattr(self, name)[keep])
+
+
+    def check_sight(self, enemy, radius=unit_radius):
+        '''
+        Version: 0.1
+
+        Vectorized version of force.check_sight(): units that hit a target
+        behind another unit hit the nearest visible enemy unit in range 
+        instead, or nothing.
+
+        Arguments: the opposing array_force, optionally the radius of a unit
+        '''
+        shooters = np.flatnonzero(self.has_hit)
+        if len(shooters) == 0:
+            return
+        targets = self.target_index[shooters]
+        enemy.is_hit[targets] = False
+        visible = visible_targets(self.pos.tolist(), enemy.pos.tolist(), shooters.tolist(), 
+            targets.tolist(), self.ranges[shooters].tolist(), radius)
+
+        for i, old, target in zip(shooters.tolist(), targets.tolist(), visible):
+            if target is None:
+                self.has_hit[i] = False
+                continue
+            if target != old:
+                self.target_index[i] = target
+                self.target_dist[i] = np.hypot(*(self.pos[i] - enemy.pos[target]))
+                self.target_bound[i] = -np.inf
+            enemy.is_hit[target] = True
+
+
+    def remap_targets(self, index_map):
+        '''
+        Updates the target indices after the enemy force has removed its 
+        hit units; units whose target was removed get -1.
+
+        Arguments: the index_map of the enemy force
+        '''
+        valid = self.target_index >= 0
+        self.target_index[valid] = index_map[self.target_index[valid]]
+
+
+    def __len__(self):
+        '''
+        Returns the number of units currently in the force.
+        '''
+        return len(self.alive)
+
+
+class batch_force(force):
+    '''
+    Version: 0.1
+
+    Many replicates of the same force, stored together as numpy arrays with
+    the replicate as first and the unit as second dimension. Used by 
+    run_ensemble() to advance many replicates of a scenario at once. 
+    Eliminated units are not removed but flagged in the alive array, so all
+    replicates keep the same shape. On top of the attributes of 'force', it
+    holds:
+    - replicates: int, number of replicates
+    - pos: float array of shape (replicates, n, 2), x and y positions
+    - target_index: int array of shape (replicates, n), -1 for no target
+    - target_dist: float array of shape (replicates, n)
+    - alive, is_hit, has_hit: boolean arrays of shape (replicates, n)
+    '''
+
+    arrays = ['pos', 'target_index', 'target_dist', 'alive', 'is_hit', 'has_hit']
+
+    def __init__(self, index, name, color=Color[0], strength=Strength[0], range=Range[0], 
+        speed=Speed[0], accuracy=Accuracy[0], formation=Formation[0], replicates=1):
+        '''
+        Test:
+        >>> blue_force = batch_force(0, 'blue', strength=10, replicates=100)
+        >>> blue_force.replicates
+        100
+        '''
+        if np is None:
+            raise ImportError('Ensembles require numpy to be installed.')
+        force.__init__(self, index, name, color, strength, range, speed, accuracy, 
+            formation, units=None)
+        self.replicates = replicates
+
+
+    def initialize_units(self, seed=None):
+        '''
+        Version: 0.2
+
+        Places the units of all replicates at their initial positions. All
+        replicates of a batch share the same positions.
+
+        Arguments: optionally a seed for the 'scattered' formation
+
+        Test:
+        >>> blue_force = batch_force(0, 'blue', strength=9, replicates=3)
+        >>> blue_force.initialize_units()
+        >>> blue_force.pos.shape
+        (3, 9, 2)
+        '''
+        positions = formation_positions(self.formation, self.index, self.strength, seed=seed)
+        shape = (self.replicates, len(positions))
+        self.pos = np.repeat(positions[None, :, :], self.replicates, axis=0)
+        self.target_index = np.full(shape, -1, dtype=np.intp)
+        self.target_dist = np.full(shape, np.inf)
+        self.alive = np.ones(shape, dtype=bool)
+        self.is_hit = np.zeros(shape, dtype=bool)
+        self.has_hit = np.zeros(shape, dtype=bool)
+
+
+    def find_targets(self, enemy):
+        '''
+        Version: 0.1
+
+        Finds the closest living enemy unit for every unit in every replicate.
+        Ties are resolved in favour of the enemy unit with the lowest index, 
+        like in unit.find_target(). Replicates are processed in blocks of at
+        most chunk_size unit pairs; if a single replicate has more, its 
+        targets are found with nearest_enemies(), which splits it into 
+        blocks of units.
+
+        Arguments: the opposing batch_force
+
+        Test:
+        >>> blue_force = batch_force(0, 'blue', strength=2, replicates=2)
+        >>> red_force = batch_force(1, 'red', strength=2, replicates=2)
+        >>> blue_force.initialize_units()
+        >>> red_force.initialize_units()
+        >>> red_force.is_hit[1, 0] = True
+        >>> red_force.kill_hit_units()
+        >>> blue_force.find_targets(red_force)
+        >>> blue_force.target_index.tolist()
+        [[0, 1], [1, 1]]
+        '''
+        # Eliminated units are placed at infinity, so they are never closest
+        replicates, n = self.alive.shape
+        m = enemy.alive.shape[1]
+        self.target_index = np.zeros((replicates, n), dtype=np.intp)
+        self.target_dist = np.zeros((replicates, n))
+        block = max(1, chunk_size // max(1, n*m))
+        for start in range(0, replicates, block):
+            stop = min(start + block, replicates)
+            if block == 1:
+                self.target_index[start], self.target_dist[start] = nearest_enemies(
+                    self.pos[start], enemy.pos[start])
+                continue
+            distances = self.pos[start:stop, :, None, 0] - enemy.pos[start:stop, None, :, 0]
+            np.square(distances, out=distances)
+            ydist = self.pos[start:stop, :, None, 1] - enemy.pos[start:stop, None, :, 1]
+            np.square(ydist, out=ydist)
+            distances += ydist
+            np.sqrt(distances, out=distances)
+            index = distances.argmin(axis=2)
+            self.target_index[start:stop] = index
+            self.target_dist[start:stop] = np.take_along_axis(distances, 
+                index[:, :, None], axis=2)[:, :, 0]
+        self.target_index[~np.isfinite(self.target_dist)] = -1
+
+
+    def move(self, enemy):
+        '''
+        Version: 0.1
+
+        Moves all living units of all replicates towards the current 
+        position of their target, see unit.move().
+
+        Arguments: the opposing batch_force
+        '''
+        index = np.maximum(self.target_index, 0) + enemy.pos.shape[1]*np.arange(
+            self.replicates)[:, None]
+        target_pos = enemy.pos.reshape(-1, 2)[index]
+        xstep, ystep, moving = move_steps(self.pos, target_pos, self.target_dist, 
+            self.range, self.speed)
+        moving &= self.alive & (self.target_index >= 0)
+        self.pos[moving, 0] += xstep[moving]
+        self.pos[moving, 1] += ystep[moving]
+
+
+    def fire(self, enemy, rng):
+        '''
+        Version: 0.1
+
+        Lets all living units of all replicates fire at their target, see 
+        unit.fire().
+
+        Arguments: the opposing batch_force, a numpy random Generator
+        '''
+        in_range = self.alive & (self.target_index >= 0) & (self.target_dist <= self.range)
+        self.has_hit = in_range & (rng.random(self.alive.shape) < self.accuracy)
+        replicate, shooter = np.nonzero(self.has_hit)
+        enemy.is_hit[replicate, self.target_index[replicate, shooter]] = True
+
+
+    def kill_hit_units(self):
+        '''
+        Flags all units hit in the current time step as eliminated and moves
+        them to infinity.
+        '''
+        self.alive &= ~self.is_hit
+        self.pos[self.is_hit] = np.inf
+        self.is_hit[:] = False
+
+
+    def select(self, replicates):
+        '''
+        Keeps only the given replicates, e.g. to drop finished ones.
+
+        Arguments: a boolean or index array over the replicates
+        '''
+        for name in self.arrays:
+            setattr(self, name, getattr(self, name)[replicates])
+        self.replicates = len(self.alive)
+
+
+    def strengths(self):
+        '''
+        Returns: int array with the number of living units in each replicate
+        '''
+        return self.alive.sum(axis=1)
+
+
+class history_writer():
+    '''
+    Version: 0.1
+
+    Writes strength histories to an open file step by step, so that the 
+    output never has to be built in memory. Formats:
+    - 'csv': a header line with the force names and one line per step with
+      the strength of both forces, with sampled histories preceded by the
+      step number
+    - 'binary': one little-endian record per step, an 8 byte integer step 
+      number followed by the strengths as 8 byte floats, see read_history()
+    '''
+
+    record = Struct('<qdd')
+
+    def __init__(self, file, format='csv', name=Name, steps=False):
+        '''
+        Arguments: a file opened for writing, in binary mode for the binary
+        format, the format, the force names and whether to write the step
+        numbers to csv files
+
+        Test:
+        >>> writer = history_writer(sys.stdout, steps=True)
+        step,Blue,Red
+        >>> writer.write(1, 10, 9)
+        1,10,9
+        '''
+        if format not in ('csv', 'binary'):
+            raise ValueError('Unknown history format: '+str(format)+
+                ', specify as either \'csv\' or \'binary\'')
+        self.file = file
+        self.format = format
+        self.steps = steps
+        if format == 'csv':
+            header = name[0]+','+name[1]+'\n'
+            if steps:
+                header = 'step,'+header
+            file.write(header)
+
+
+    def write(self, step, blue, red):
+        '''
+        Writes the strengths of both forces after the given step.
+        '''
+        if self.format == 'binary':
+            self.file.write(self.record.pack(step, blue, red))
+        elif self.steps:
+            self.file.write(str(step)+','+str(blue)+','+str(red)+'\n')
+        else:
+            self.file.write(str(blue)+','+str(red)+'\n')
+
+
+class experiment():
+    '''
+    Version: 0.2
+    Authors: Steffen Pielström
+
+    The experiment class object stores all information that may be returned 
+    as output after a simulation. The strength histories blue and red are 
+    returned as lists, but kept in compact typed arrays, so that long runs
+    need a fraction of the memory. How much of them is kept is set by 
+    record:
+    - 'full': the strengths after every step
+    - an int k: the strengths after every k-th step and after the last step
+    - 'summary': only the strengths after the last step, so the memory 
+      needed does not grow with the number of steps
+    Independent of record, a history_writer passed as writer receives the 
+    strengths after every step as soon as they are known. If the steps 
+    were measured, metrics holds the step_metrics object, else None.
+    '''
+    def __init__(self, name=Name, strength=Strength, range=Range, 
+                speed=Speed, accuracy=Accuracy, formation=Formation, seed=None, 
+                replicate=0, record='full', writer=None):
+        '''
+        Test:
+        >>> results = experiment(record=3)
+        >>> for i in range(7):
+        ...     results.update(range(10 - i), range(10))
+        >>> results.blue, results.recorded_steps()
+        ([8, 5, 4], [3, 6, 7])
+        '''
+        if record == 'full':
+            every = 1
+        elif record == 'summary':
+            every = 0
+        elif isinstance(record, int) and record > 0:
+            every = record
+        else:
+            raise ValueError('Unknown recording level: '+str(record)+
+                ', specify as either \'full\', \'summary\' or a positive int')
+
+        self.name = name
+        self.strength = strength
+        self.range = range
+        self.speed = speed
+        self.accuracy = accuracy
+        self.formation = formation
+        self.seed = seed
+        self.replicate = replicate
+        self.record = record
+        self.every = every
+        self.writer = writer
+        self.stalemate = False
+        self.metrics = None
+        self.steps = 0
+        self.blue_history = array('l')
+        self.red_history = array('l')
+        # The last entry is only kept until the next step
+        self.provisional = False
+
+
+    def update(self, blue_force, red_force):
+        '''
+        Track the strength development in each step of the simulation.
+
+        Arguments: the two forces of the simulation
+        '''
+        self.steps += 1
+        blue = len(blue_force)
+        red = len(red_force)
+        if self.provisional:
+            self.blue_history[-1] = blue
+            self.red_history[-1] = red
+        else:
+            self.blue_history.append(blue)
+            self.red_history.append(red)
+        self.provisional = self.every == 0 or self.steps % self.every != 0
+        if self.writer is not None:
+            self.writer.write(self.steps, blue, red)
+
+
+    @property
+    def blue(self):
+        '''
+        Returns: a list of the recorded strengths of the first force
+        '''
+        return self.blue_history.tolist()
+
+
+    @blue.setter
+    def blue(self, values):
+        self.blue_history = history_array(values)
+
+
+    @property
+    def red(self):
+        '''
+        Returns: a list of the recorded strengths of the second force
+        '''
+        return self.red_history.tolist()
+
+
+    @red.setter
+    def red(self, values):
+        self.red_history = history_array(values)
+
+
+    def recorded_steps(self):
+        '''
+        Returns: a list of the step numbers of the recorded strengths
+        '''
+        if self.every == 0:
+            return [self.steps][:len(self.blue_history)]
+        if self.every == 1:
+            # Histories may start with the initial strengths, like in 
+            # run_lanchester()
+            return list(range(self.steps + 1 - len(self.blue_history), self.steps + 1))
+        steps = list(range(self.every, self.steps + 1, self.every))
+        if self.provisional:
+            steps.append(self.steps)
+        return steps
+
+
+    def write(self, file, format='csv'):
+        '''
+        Writes the recorded strength histories to an open file, one step at 
+        a time, see history_writer. Step numbers are written to csv files 
+        only if not all steps were recorded.
+
+        Arguments: a file opened for writing, the format
+        '''
+        writer = history_writer(file, format, self.name, steps=self.every != 1)
+        for step, blue, red in zip(self.recorded_steps(), self.blue_history, 
+                self.red_history):
+            writer.write(step, blue, red)
+
+
+    def outcome(self):
+        '''
+        Returns: a string describing the result of the simulation
+
+        Test:
+        >>> results = experiment()
+        >>> results.blue, results.red = [10, 8], [10, 0]
+        >>> results.outcome()
+        'Blue victory'
+        '''
+        blue = self.blue_history[-1]
+        red = self.red_history[-1]
+        if blue == 0 and red > 0:
+            return self.name[1]+' victory'
+        elif blue > 0 and red == 0:
+            return self.name[0]+' victory'
+        elif blue == 0 and red == 0:
+            return 'both forces down'
+        elif self.stalemate:
+            return 'stalemate'
+        else:
+            return 'no winner yet'
+
+
+    def print(self, type='result'):
+        '''
+        Print formatted output.
+        '''
+
+        if type == 'result':
+            steps = 'steps: '+str(self.steps)
+            result = 'result: '+self.outcome()
+            blue = self.name[0]+' force strength: '+str(self.blue_history[-1])
+            red = self.name[1]+' force strength: '+str(self.red_history[-1])
+            print(steps+'\n'+result+'\n'+blue+'\n'+red)
+
+        elif type == 'full':
+            self.write(sys.stdout)
+
+        else:
+            print('Warning: Output format unknown.')
+            print('Specify as either \'result\' or \'full\'')
+
+
+class step_metrics():
+    '''
+    Version: 0.1
+
+    Collects timings and counters of simulation steps, passed as metrics
+    to update_forces() or update_array_forces(). For each step, it 
+    measures the wall time of the phases
+    - 'targeting': keeping or searching targets
+    - 'movement': moving the units
+    - 'fire': firing
+    - 'removal': removing the hit units and remapping targets
+    and counts
+    - 'distance_evaluations': distances computed to check or find targets
+    - 'retargets': units that searched the enemy force for a target
+    - 'shots': units with a target in range
+    - 'hits': units that hit their target
+    - 'allocated', 'peak_allocated': with allocations=True, the bytes 
+      allocated in the step, net and at the peak, traced with tracemalloc
+    Attributes:
+    - step: int, number of the last step, see simulation.fast_forward()
+    - steps: int, number of steps measured
+    - last: dict of the values of the last step, with its 'step' number
+    - totals: dict of the sums over all steps, and the maximum of 
+      'peak_allocated'
+    - callback: function called with last after each step, e.g. to 
+      stream the values to a monitoring system
+    - allocations: boolean, whether allocations are traced, which slows
+      the simulation down considerably
+    '''
+
+    phases = ['targeting', 'movement', 'fire', 'removal']
+    counters = ['distance_evaluations', 'retargets', 'shots', 'hits']
+
+    def __init__(self, callback=None, allocations=False):
+        '''
+        Test:
+        >>> metrics = step_metrics()
+        >>> blue_force = force(0, 'blue', strength=5, accuracy=1, range=100)
+        >>> red_force = force(1, 'red', strength=5, accuracy=0)
+        >>> blue_force.initialize_units()
+        >>> red_force.initialize_units()
+        >>> update_forces(blue_force, red_force, metrics=metrics)
+        >>> metrics.steps, metrics.totals['retargets'], metrics.totals['hits']
+        (1, 10, 5)
+        >>> metrics.totals['distance_evaluations']
+        50
+        '''
+        self.callback = callback
+        self.allocations = allocations
+        self.step = 0
+        self.steps = 0
+        self.totals = dict.fromkeys(self.phases, 0.0)
+        self.totals.update(dict.fromkeys(self.counters, 0))
+        if allocations:
+            self.totals.update(allocated=0, peak_allocated=0)
+        self.last = None
+        self.started_tracing = False
+        self.mark = 0.0
+        self.memory = 0
+
+
+    def start(self):
+        '''
+        Starts measuring a step.
+        '''
+        self.last = dict.fromkeys(self.phases, 0.0)
+        self.last.update(dict.fromkeys(self.counters, 0))
+        if self.allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            self.memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.mark = perf_counter()
+
+
+    def lap(self, phase=None):
+        '''
+        Adds the time since the last call, or since start(), to a phase. 
+        Without a phase, the time is not counted, e.g. the time spent on 
+        counting.
+        '''
+        now = perf_counter()
+        if phase is not None:
+            self.last[phase] += now - self.mark
+        self.mark = now
+
+
+    def count(self, counter, value):
+        '''
+        Adds a value to a counter of the current step.
+        '''
+        self.last[counter] += value
+
+
+    def finish(self):
+        '''
+        Ends measuring a step, adds its values to the totals and calls the
+        callback.
+        '''
+        if self.allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            self.last['allocated'] = current - self.memory
+            self.last['peak_allocated'] = peak - self.memory
+        self.step += 1
+        self.steps += 1
+        for name, value in self.last.items():
+            if name == 'peak_allocated':
+                self.totals[name] = max(self.totals[name], value)
+            else:
+                self.totals[name] += value
+        self.last['step'] = self.step
+        if self.callback is not None:
+            self.callback(self.last)
+
+
+    def stop(self):
+        '''
+        Stops tracing allocations, if it was started for these metrics.
+        '''
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+
+    def print(self):
+        '''
+        Print the time spent in each phase, with its share of the total, 
+        and the counters per step.
+        '''
+        total = sum(self.totals[phase] for phase in self.phases)
+        print('steps measured: '+str(self.steps))
+        for phase in self.phases:
+            share = self.totals[phase]/total if total > 0 else 0
+            print(phase+': '+'{:.6f}'.format(self.totals[phase])+' s ('+
+                '{:.1%}'.format(share)+')')
+        for name in self.totals:
+            if name in self.phases:
+                continue
+            if name == 'peak_allocated':
+                print(name+': '+str(self.totals[name])+' bytes at most')
+            else:
+                print(name+': '+str(self.totals[name])+' ('+
+                    '{:.1f}'.format(self.totals[name]/max(self.steps, 1))+' per step)')
+
+
+class simulation():
+    '''
+    Version: 0.1
+
+    A self-contained simulation that owns its two forces and the experiment
+    recording its results. Any number of simulation objects can exist side
+    by side in one interpreter, and each can be advanced step by step or 
+    run to its end. Attributes:
+    - max_steps: int, the maximum number of simulation steps
+    - scenario: dict, the parameters of the scenario, see canonical()
+    - engine: string, either 'python' or 'numpy', see run_simulation()
+    - targeting: string, either 'brute' or 'grid', see update_forces()
+    - line_of_sight: boolean, if True, units cannot hit through other 
+      units, see force.check_sight()
+    - compact: boolean, if True, the numpy engine stores units in float32
+      and int32 arrays, see array_force.set_size()
+    - fast_forward: boolean, if True, the approach phase is skipped 
+      analytically where possible, see fast_forward()
+    - recorder: a trajectory_recorder if a trajectory file was given, 
+      else None
+    - metrics: a step_metrics object measuring the steps, or None
+    - blue_force, red_force: the two forces, force or array_force objects
+    - rng: the simulation's rng_stream, derived from seed and replicate
+    - results: the experiment object, recording the strength histories as 
+      set by record and passing them on to writer, see experiment
+    '''
+
+    def __init__(self, max_steps=max_steps, faction=Faction, name=Name, color=Color, 
+        strength=Strength, range=Range, speed=Speed, accuracy=Accuracy, 
+        formation=Formation, engine='python', targeting='brute', seed=None, 
+        replicate=0, antithetic=False, fast_forward=False, record='full', 
+        trajectory=None, metrics=None, line_of_sight=False, compact=False, writer=None):
+        '''
+        Test:
+        >>> battle = simulation(strength=[10, 5])
+        >>> len(battle.blue_force), len(battle.red_force)
+        (10, 5)
+        '''
+        options = {}
+        if engine == 'python':
+            force_class = force
+        elif engine == 'numpy':
+            force_class = array_force
+            options['compact'] = compact
+        else:
+            raise ValueError('Unknown engine: '+str(engine)+
+                ', specify as either \'python\' or \'numpy\'')
+        if compact and engine != 'numpy':
+            raise ValueError('Compact storage requires the numpy engine.')
+        if targeting not in ('brute', 'grid'):
+            raise ValueError('Unknown targeting method: '+str(targeting)+
+                ', specify as either \'brute\' or \'grid\'')
+        if fast_forward and np is None:
+            raise ImportError('Fast-forwarding requires numpy to be installed.')
+        if fast_forward and trajectory is not None:
+            raise ValueError('Trajectories cannot be recorded with fast-forwarding.')
+
+        self.max_steps = max_steps
+        self.scenario = canonical(max_steps, strength, range, speed, accuracy, formation, 
+            engine, line_of_sight, antithetic, compact)
+        self.engine = engine
+        self.targeting = targeting
+        self.line_of_sight = line_of_sight
+        self.compact = compact
+        self.fast_forward_enabled = fast_forward
+        self.fast_forward_blocked = 0
+        self.fast_forward_backoff = 1
+
+        self.rng = rng_stream(seed, replicate, antithetic)
+        self.blue_force = force_class(faction[0], name[0], color[0], strength[0], range[0], 
+            speed[0], accuracy[0], formation[0], **options)
+        self.blue_force.initialize_units(self.rng.derive_seed('blue formation'))
+        self.red_force = force_class(faction[1], name[1], color[1], strength[1], range[1], 
+            speed[1], accuracy[1], formation[1], **options)
+        self.red_force.initialize_units(self.rng.derive_seed('red formation'))
+        self.results = experiment(name=name, strength=strength, range=range, speed=speed,
+            accuracy=accuracy, formation=formation, seed=self.rng.seed, replicate=replicate,
+            record=record, writer=writer)
+        self.recorder = None
+        if trajectory is not None:
+            self.recorder = trajectory_recorder(trajectory, self.blue_force, 
+                self.red_force, max_steps)
+        if metrics is True:
+            metrics = step_metrics()
+        self.metrics = metrics
+        self.results.metrics = metrics
+
+
+    def step(self):
+        '''
+        Performs a single simulation step and records the forces' strengths.
+        With fast_forward enabled, this may advance the simulation by 
+        several steps at once, see fast_forward().
+
+        Test:
+        >>> battle = simulation(strength=[10, 5])
+        >>> battle.step()
+        >>> battle.results.steps
+        1
+        '''
+        if self.fast_forward_enabled and self.fast_forward() > 0:
+            return
+
+        if self.engine == 'numpy':
+            update_array_forces(self.blue_force, self.red_force, self.rng, self.targeting, 
+                self.recorder, self.metrics, self.line_of_sight)
+        else:
+            update_forces(self.blue_force, self.red_force, self.targeting, self.rng, 
+                self.recorder, self.metrics, self.line_of_sight)
+        self.results.update(self.blue_force, self.red_force)
+
+
+    def fast_forward(self):
+        '''
+        Version: 0.2
+
+        Skips steps of the approach phase in one update. The number of 
+        steps k in which no unit can get within range of an enemy follows 
+        from the distances to the closest enemies and the closing speeds,
+        see approach_jump(). If the units move in straight lines during 
+        these steps and keep their targets, the units make the k moves of 
+        these steps without searching targets and firing, the strengths 
+        are recorded for the skipped steps and the random numbers the 
+        skipped steps would have drawn are discarded. Since the moves are 
+        computed like in regular steps, positions and random numbers, and 
+        so the rest of the run, are identical to a run without 
+        fast-forwarding. If no unit is in range and no unit can ever move 
+        into range, the simulation is marked as a stalemate and ends after
+        the current step. After an attempt without a jump, the next one is
+        made once the window of k steps has passed, but at the earliest 
+        after twice as many steps as after the previous failed attempt.
+
+        Returns: the number of steps skipped
+
+        Test:
+        >>> battle = simulation(strength=[10, 10], range=[10, 10], fast_forward=True)
+        >>> battle.fast_forward()
+        35
+        >>> battle.blue_force.units[0].pos
+        [45.0, 9.090909090909092]
+        >>> scenario = dict(speed=[0, 1], formation=['one line', 'one line'], seed=148)
+        >>> skipped, stepped = simulation(fast_forward=True, **scenario), simulation(**scenario)
+        >>> skipped.run().blue == stepped.run().blue, skipped.results.red == stepped.results.red
+        (True, True)
+        >>> battle = simulation(strength=[10, 10], speed=[0, 0], fast_forward=True)
+        >>> battle.run().outcome(), battle.results.steps
+        ('stalemate', 1)
+        '''
+        if self.fast_forward_blocked > 0:
+            self.fast_forward_blocked -= 1
+            return 0
+        blue = self.blue_force
+        red = self.red_force
+        if len(blue) == 0 or len(red) == 0:
+            return 0
+
+        if self.engine == 'numpy':
+            blue_pos, blue_range, blue_speed = blue.pos, blue.ranges, blue.speeds
+            red_pos, red_range, red_speed = red.pos, red.ranges, red.speeds
+        else:
+            blue_pos = np.array([element.pos for element in blue.units], dtype=float)
+            blue_range = np.array([element.range for element in blue.units], dtype=float)
+            blue_speed = np.array([element.speed for element in blue.units], dtype=float)
+            red_pos = np.array([element.pos for element in red.units], dtype=float)
+            red_range = np.array([element.range for element in red.units], dtype=float)
+            red_speed = np.array([element.speed for element in red.units], dtype=float)
+
+        steps, blue_target, red_target = approach_jump(blue_pos, blue_range, blue_speed, 
+            red_pos, red_range, red_speed, self.max_steps - self.results.steps)
+
+        if steps == inf:
+            self.results.stalemate = True
+            return 0
+        if blue_target is None:
+            # No straight approach or in contact, back off
+            self.fast_forward_blocked = max(steps, self.fast_forward_backoff)
+            self.fast_forward_backoff *= 2
+            return 0
+        self.fast_forward_backoff = 1
+
+        # Each move starts from the distances to the targets before either
+        # force moves, like in update_forces(). Units search their targets 
+        # again after the jump.
+        if self.engine == 'numpy':
+            blue.target_index[:] = blue_target
+            red.target_index[:] = red_target
+            for i in range(steps):
+                blue.target_dist[:] = blue.target_distances(red)
+                red.target_dist[:] = red.target_distances(blue)
+                blue.move(red)
+                red.move(blue)
+            blue.target_bound[:] = -np.inf
+            red.target_bound[:] = -np.inf
+            self.rng.skip(steps*(len(blue) + len(red)), array=True)
+        else:
+            for own, enemy, target in [(blue, red, blue_target), (red, blue, red_target)]:
+                for element, index in zip(own.units, target.tolist()):
+                    element.target_index = index
+                    element.target_pos = enemy.units[index].pos
+                    element.target_bound = None
+            for i in range(steps):
+                for own, enemy in [(blue, red), (red, blue)]:
+                    for element in own.units:
+                        element.target_dist = element.calculate_distance(
+                            enemy.units[element.target_index])
+                for element in blue.units + red.units:
+                    element.move()
+            self.rng.skip(steps*(len(blue) + len(red)))
+
+        for i in range(steps):
+            self.results.update(blue, red)
+        if self.metrics is not None:
+            self.metrics.step += steps
+        return steps
+
+
+    def running(self):
+        '''
+        Returns: True as long as both forces have units left, max_steps 
+        has not been reached and the simulation is not a stalemate
+        '''
+        return (
+            len(self.blue_force) > 0 
+            and len(self.red_force) > 0 
+            and self.results.steps < self.max_steps
+            and not self.results.stalemate
+            )
+
+
+    def run(self, checkpoint=None, every=checkpoint_every):
+        '''
+        Version: 0.2
+
+        Runs the simulation until one of the forces is down or max_steps 
+        is reached. A trajectory being recorded is closed at the end, and 
+        tracing allocations for the metrics is stopped. If a file path is
+        given as checkpoint, a snapshot is written there about every 
+        'every' steps, so that an interrupted run can be resumed with 
+        restore(), and the file is deleted when the run has ended. A 
+        simulation restored after its end is not advanced.
+
+        Arguments: optionally a checkpoint file path and the number of steps
+        between snapshots
+        Returns: the experiment object
+        '''
+        if checkpoint is not None and self.recorder is not None:
+            raise ValueError('Simulations recording a trajectory cannot be captured in a '
+                'snapshot.')
+
+        # Initialize loop conditions
+        conditions = self.results.steps == 0 or self.running()
+        saved = self.results.steps
+
+        # Main loop
+        while conditions == True:
+            self.step()
+            conditions = self.running()
+            if checkpoint is not None and conditions and self.results.steps >= saved + every:
+                self.snapshot(checkpoint)
+                saved = self.results.steps
+
+        if checkpoint is not None and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.metrics is not None:
+            self.metrics.stop()
+        return self.results
+
+
+    def snapshot(self, file=None):
+        '''
+        Version: 0.1
+
+        Captures the complete state of the simulation: both forces with all
+        their units, the scenario, the step counter, the state of the 
+        rng_stream, the fast-forward state and the experiment with the 
+        histories recorded so far. The snapshot is a compressed pickle, so 
+        only restore snapshots from trusted sources. A history_writer or 
+        step_metrics attached to the simulation is not part of the 
+        snapshot and has to be passed to restore() again, and simulations
+        recording a trajectory cannot be captured.
+
+        Arguments: optionally a file path; the snapshot is written to a 
+        temporary file first and then renamed, so an interrupted write 
+        never replaces a good snapshot with a broken one
+        Returns: the snapshot as bytes
+
+        Test:
+        >>> battle = simulation(strength=[10, 10], seed=1)
+        >>> for i in range(20):
+        ...     battle.step()
+        >>> resumed = restore(battle.snapshot())
+        >>> resumed.results.steps
+        20
+        >>> battle.run().blue == resumed.run().blue
+        True
+        '''
+        if self.recorder is not None:
+            raise ValueError('Simulations recording a trajectory cannot be captured in a '
+                'snapshot.')
+        state = copy(self)
+        state.metrics = None
+        state.results = copy(self.results)
+        state.results.writer = None
+        state.results.metrics = None
+        data = zlib.compress(pickle.dumps((snapshot_format, state), 
+            pickle.HIGHEST_PROTOCOL))
+
+        if file is not None:
+            temporary = str(file)+'.tmp'
+            with open(temporary, 'wb') as out:
+                out.write(data)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(temporary, file)
+        return data
+
+
+    def fork(self, replicate, seed=None):
+        '''
+        Version: 0.1
+
+        Creates an independent copy of the simulation in its current state
+        that continues with its own rng_stream, given by seed and 
+        replicate. Without a seed, it is derived from the simulation's 
+        stream and step counter, so forks of the same state are 
+        reproducible from their replicate index. The experiment of the 
+        fork records the new seed and replicate.
+
+        Arguments: the replicate index of the fork, optionally a root seed
+        Returns: a simulation object
+
+        Test:
+        >>> battle = simulation(strength=[20, 20], range=[200, 200], seed=1)
+        >>> battle.step()
+        >>> first, second = battle.fork(0), battle.fork(1)
+        >>> first.run().blue == battle.fork(0).run().blue, first.results.blue[0] == battle.results.blue[0]
+        (True, True)
+        >>> second.run().blue == first.results.blue
+        False
+        '''
+        battle = restore(self.snapshot())
+        if seed is None:
+            seed = self.rng.derive_seed('fork at step '+str(self.results.steps))
+        battle.rng = rng_stream(seed, replicate, self.rng.antithetic)
+        battle.results.seed = seed
+        battle.results.replicate = replicate
+        return battle
+
+
+class ensemble():
+    '''
+    Version: 0.1
+
+    The ensemble class object stores the aggregated results of many 
+    replicates of the same scenario, as returned by run_ensemble(). Instead
+    of one strength history per replicate, it keeps:
+    - replicates: int, the number of replicates
+    - max_steps: int, the maximum number of steps of each replicate
+    - wins: list of two ints, the number of victories of each force
+    - draws: int, the number of replicates in which both forces went down
+    - undecided: int, the number of replicates without winner at max_steps
+    - duration: int array, histogram of battle durations, duration[k] is 
+      the number of replicates that ended after k steps
+    - bins: list of two ints, the number of bins of the strength histograms
+      of both forces, strength + 1 but at most ensemble_bins
+    - blue_counts, red_counts: int arrays of shape (max_steps, bins), the 
+      number of replicates with a strength in a bin after each step; a 
+      finished replicate keeps its final strength in the following steps.
+      Up to ensemble_bins - 1 units, bin k holds the strength k.
+    - blue_sums, red_sums: int arrays of shape (max_steps,), the sum of the
+      strengths of the replicates after each step, so that the means are 
+      exact with any number of bins
+    '''
+    def __init__(self, name=Name, strength=Strength, range=Range, speed=Speed, 
+                accuracy=Accuracy, formation=Formation, max_steps=max_steps):
+
+        self.name = name
+        self.strength = strength
+        self.range = range
+        self.speed = speed
+        self.accuracy = accuracy
+        self.formation = formation
+        self.max_steps = max_steps
+        self.replicates = 0
+        self.wins = [0, 0]
+        self.draws = 0
+        self.undecided = 0
+        self.duration = np.zeros(max_steps + 1, dtype=np.int64)
+        self.bins = [min(value + 1, ensemble_bins) for value in strength]
+        self.blue_counts = np.zeros((max_steps, self.bins[0]), dtype=np.int64)
+        self.red_counts = np.zeros((max_steps, self.bins[1]), dtype=np.int64)
+        self.blue_final = np.zeros((max_steps, self.bins[0]), dtype=np.int64)
+        self.red_final = np.zeros((max_steps, self.bins[1]), dtype=np.int64)
+        self.blue_sums = np.zeros(max_steps, dtype=np.int64)
+        self.red_sums = np.zeros(max_steps, dtype=np.int64)
+        self.blue_final_sums = np.zeros(max_steps, dtype=np.int64)
+        self.red_final_sums = np.zeros(max_steps, dtype=np.int64)
+
+
+    def update(self, blue_force, red_force, step):
+        '''
+        Tracks the strengths of all replicates still running in a batch 
+        after the given step, and records the outcome of replicates that 
+        have finished.
+
+        Returns: a boolean array flagging the replicates that keep running
+        '''
+        blue = blue_force.strengths()
+        red = red_force.strengths()
+        blue_bin = blue*self.bins[0]//(self.strength[0] + 1)
+        red_bin = red*self.bins[1]//(self.strength[1] + 1)
+        np.add.at(self.blue_counts[step - 1], blue_bin, 1)
+        np.add.at(self.red_counts[step - 1], red_bin, 1)
+        self.blue_sums[step - 1] += blue.sum()
+        self.red_sums[step - 1] += red.sum()
+
+        running = (blue > 0) & (red > 0)
+        if step == self.max_steps:
+            self.undecided += int(running.sum())
+            finished = np.ones(len(blue), dtype=bool)
+        else:
+            finished = ~running
+        self.wins[0] += int(((blue > 0) & (red == 0)).sum())
+        self.wins[1] += int(((blue == 0) & (red > 0)).sum())
+        self.draws += int(((blue == 0) & (red == 0)).sum())
+        self.duration[step] += int(finished.sum())
+        self.replicates += int(finished.sum())
+        np.add.at(self.blue_final[step - 1], blue_bin[finished], 1)
+        np.add.at(self.red_final[step - 1], red_bin[finished], 1)
+        self.blue_final_sums[step - 1] += blue[finished].sum()
+        self.red_final_sums[step - 1] += red[finished].sum()
+        return ~finished
+
+
+    def strength_counts(self):
+        '''
+        Returns: a list of the count arrays of both forces, including the 
+        replicates that finished in earlier steps
+        '''
+        counts = []
+        for running, final in [(self.blue_counts, self.blue_final), 
+            (self.red_counts, self.red_final)]:
+            carried = np.cumsum(final, axis=0)
+            counts.append(running + np.vstack([np.zeros_like(carried[:1]), carried[:-1]]))
+        return counts
+
+
+    def win_probability(self):
+        '''
+        Returns: a list of the victory probabilities of both forces
+        '''
+        return [self.wins[0]/self.replicates, self.wins[1]/self.replicates]
+
+
+    def mean(self):
+        '''
+        Returns: a list of two float arrays with the mean strength of each 
+        force after each step
+        '''
+        means = []
+        for sums, final in [(self.blue_sums, self.blue_final_sums), 
+            (self.red_sums, self.red_final_sums)]:
+            carried = np.concatenate([[0], np.cumsum(final)[:-1]])
+            means.append((sums + carried) / self.replicates)
+        return means
+
+
+    def quantile(self, q):
+        '''
+        Arguments: float between 0 and 1
+        Returns: a list of two int arrays with the q-quantile of the strength
+        of each force after each step; for forces of ensemble_bins units or
+        more, it is interpolated within its bin
+
+        Test:
+        >>> results = ensemble(strength=[5000, 10], max_steps=1)
+        >>> blue_force = batch_force(0, 'blue', strength=5000, replicates=101)
+        >>> red_force = batch_force(1, 'red', strength=10, replicates=101)
+        >>> blue_force.initialize_units()
+        >>> red_force.initialize_units()
+        >>> blue_force.alive[:] = np.arange(5000) < 1000 + 10*np.arange(101)[:, None]
+        >>> _ = results.update(blue_force, red_force, 1)
+        >>> results.bins, float(results.mean()[0][0])
+        ([1024, 11], 1500.0)
+        >>> [int(value[0]) for value in results.quantile(0.5)]
+        [1501, 10]
+        '''
+        quantiles = []
+        for counts, strength in zip(self.strength_counts(), self.strength):
+            cumulative = np.cumsum(counts, axis=1)
+            bins = (cumulative < q*self.replicates).sum(axis=1)
+            if counts.shape[1] == strength + 1:
+                quantiles.append(bins)
+                continue
+            rows = np.arange(len(counts))
+            before = np.where(bins > 0, cumulative[rows, bins - 1], 0)
+            fraction = (q*self.replicates - before) / np.maximum(counts[rows, bins], 1)
+            width = (strength + 1) / counts.shape[1]
+            quantiles.append(np.minimum(np.floor((bins + fraction)*width), 
+                strength).astype(np.int64))
+        return quantiles
+
+
+    def print(self, type='result'):
+        '''
+        Print formatted output.
+        '''
+
+        if type == 'result':
+            probability = self.win_probability()
+            steps = np.arange(len(self.duration))
+            print('replicates: '+str(self.replicates)+'\n'+
+                'mean steps: '+str(float(self.duration @ steps / self.replicates))+'\n'+
+                self.name[0]+' victory: '+str(probability[0])+'\n'+
+                self.name[1]+' victory: '+str(probability[1])+'\n'+
+                'both forces down: '+str(self.draws/self.replicates)+'\n'+
+                'no winner yet: '+str(self.undecided/self.replicates))
+
+        elif type == 'full':
+            mean = self.mean()
+            low = self.quantile(0.05)
+            high = self.quantile(0.95)
+            lines = ['step,'+self.name[0]+' mean,'+self.name[0]+' q05,'+self.name[0]+' q95,'+
+                self.name[1]+' mean,'+self.name[1]+' q05,'+self.name[1]+' q95']
+            for i in range(self.max_steps):
+                lines.append(','.join(str(value) for value in [i + 1, mean[0][i], low[0][i], 
+                    high[0][i], mean[1][i], low[1][i], high[1][i]]))
+            print('\n'.join(lines))
+
+        else:
+            print('Warning: Output format unknown.')
+            print('Specify as either \'result\' or \'full\'')
+
+
+class estimate():
+    '''
+    Version: 0.1
+
+    The estimate class object stores the result of run_adaptive(): an 
+    estimate of a statistic over replicates of a scenario, together with 
+    its confidence interval.
+    - statistic: string, either 'win' or 'strength'
+    - side: int, the index of the force the statistic refers to
+    - confidence: float, the confidence level of the interval
+    - precision: float, the targeted half-width of the interval
+    - value: float, the estimated win probability or mean final strength
+    - interval: list of two floats, lower and upper bound of the interval
+    - halfwidth: float, the half-width of the interval achieved
+    - replicates: int, the number of replicates used
+    - converged: boolean, True if the targeted precision was reached
+    - seed: int, the root seed of the replicates' rng_streams
+    - values: list of the statistic's value in each replicate
+    '''
+    def __init__(self, statistic='win', side=0, confidence=0.95, precision=0.01, seed=None):
+
+        self.statistic = statistic
+        self.side = side
+        self.confidence = confidence
+        self.precision = precision
+        self.seed = seed
+        self.value = None
+        self.interval = [None, None]
+        self.halfwidth = inf
+        self.replicates = 0
+        self.converged = False
+        self.values = []
+
+
+    def update(self, values):
+        '''
+        Adds the values of new replicates and recalculates the estimate and
+        its confidence interval: a Wilson score interval for the win 
+        probability, a normal approximation for the mean strength.
+
+        Test:
+        >>> result = estimate('win', precision=0.1)
+        >>> result.update([1]*50 + [0]*50)
+        >>> result.value, round(result.halfwidth, 3), result.converged
+        (0.5, 0.096, True)
+        '''
+        self.values.extend(values)
+        n = len(self.values)
+        z = NormalDist().inv_cdf(0.5 + self.confidence/2)
+        mean = fmean(self.values)
+
+        if self.statistic == 'win':
+            center = (mean + z**2/(2*n)) / (1 + z**2/n)
+            self.halfwidth = z*(mean*(1 - mean)/n + z**2/(4*n**2))**0.5 / (1 + z**2/n)
+        elif n > 1:
+            center = mean
+            self.halfwidth = z*stdev(self.values)/n**0.5
+        else:
+            center = mean
+            self.halfwidth = inf
+
+        self.value = mean
+        self.interval = [center - self.halfwidth, center + self.halfwidth]
+        self.replicates = n
+        self.converged = self.halfwidth <= self.precision
+
+
+    def print(self, type='result'):
+        '''
+        Print formatted output.
+        '''
+        if type == 'result':
+            print('statistic: '+self.statistic+' of force '+str(self.side)+'\n'+
+                'estimate: '+str(self.value)+'\n'+
+                'interval: '+str(self.interval[0])+' - '+str(self.interval[1])+
+                ' ('+str(self.confidence)+' confidence)\n'+
+                'half-width: '+str(self.halfwidth)+' (target: '+str(self.precision)+')\n'+
+                'replicates: '+str(self.replicates)+'\n'+
+                'converged: '+str(self.converged))
+
+        else:
+            print('Warning: Output format unknown.')
+            print('Specify as \'result\'')
+
+
+class trajectory_recorder():
+    '''
+    Version: 0.1
+
+    Records the state of every unit in every step of a simulation into a 
+    binary file of fixed size, which is allocated in advance for max_steps
+    steps and written through a memory map. The file starts with a header 
+    (see trajectory_dtypes()) holding the force sizes and the number of 
+    steps recorded so far, followed by one frame per step, frame 0 being 
+    the initial state. Frames have one entry per unit, indexed by its 
+    number, for each force:
+    - pos: x and y position after moving in that step
+    - alive: whether the unit is still in its force after that step
+    - target: number of the enemy unit targeted in that step, -1 for none
+    - hit: whether the unit hit its target in that step
+    Eliminated units keep their last position. Files are read with 
+    trajectory. Requires numpy.
+    '''
+
+    def __init__(self, path, blue_force, red_force, max_steps=max_steps):
+        '''
+        Arguments: path of the file to write, the two initialized forces, 
+        either force or array_force objects, the maximum number of steps
+        '''
+        if np is None:
+            raise ImportError('Recording trajectories requires numpy to be installed.')
+        header, frame = trajectory_dtypes(len(blue_force), len(red_force))
+        with open(path, 'wb') as file:
+            file.truncate(header.itemsize + (max_steps + 1)*frame.itemsize)
+        self.path = path
+        self.header = np.memmap(path, dtype=header, mode='r+', shape=(1,))
+        self.frames = np.memmap(path, dtype=frame, mode='r+', offset=header.itemsize, 
+            shape=(max_steps + 1,))
+        self.header['magic'] = trajectory_magic
+        self.header['version'] = 1
+        self.header['capacity'] = max_steps + 1
+        self.header['blue'] = len(blue_force)
+        self.header['red'] = len(red_force)
+        self.header['steps'] = 0
+        self.steps = 0
+
+        initial = self.frames[:1]
+        for side, own in [('blue', blue_force), ('red', red_force)]:
+            numbers, pos = self.force_state(own, None)[:2]
+            initial[side+'_pos'][0, numbers] = pos
+            initial[side+'_alive'] = 1
+            initial[side+'_target'] = -1
+
+
+    def force_state(self, own, enemy):
+        '''
+        Returns: the numbers, positions, target numbers and hit flags of the
+        units of a force, and the flags of the units hit by the enemy
+        '''
+        if isinstance(own, array_force):
+            targets = None
+            if enemy is not None and len(enemy) == 0:
+                targets = np.full(len(own), -1)
+            elif enemy is not None:
+                targets = np.where(own.target_index >= 0, 
+                    enemy.numbers[np.maximum(own.target_index, 0)], -1)
+            return own.numbers, own.pos, targets, own.has_hit, own.is_hit
+
+        numbers = np.array([element.number for element in own.units], dtype=int)
+        pos = np.array([element.pos for element in own.units], dtype=float).reshape(-1, 2)
+        targets = None
+        if enemy is not None:
+            targets = [-1 if element.target_index is None 
+                else enemy.units[element.target_index].number for element in own.units]
+        has_hit = [element.has_hit for element in own.units]
+        is_hit = np.array([element.is_hit for element in own.units], dtype=bool)
+        return numbers, pos, targets, has_hit, is_hit
+
+
+    def record(self, blue_force, red_force):
+        '''
+        Records the next frame. Called by update_forces() and 
+        update_array_forces() after all units have fired, before the hit 
+        units are removed.
+
+        Arguments: the two forces
+        '''
+        if self.steps + 1 >= len(self.frames):
+            raise ValueError('Trajectory file is full after '+str(self.steps)+' steps.')
+        self.steps += 1
+        frame = self.frames[self.steps:self.steps + 1]
+        frame[:] = self.frames[self.steps - 1:self.steps]
+        for side, own, enemy in [('blue', blue_force, red_force), 
+            ('red', red_force, blue_force)]:
+            numbers, pos, targets, has_hit, is_hit = self.force_state(own, enemy)
+            frame[side+'_target'] = -1
+            frame[side+'_hit'] = 0
+            frame[side+'_pos'][0, numbers] = pos
+            frame[side+'_target'][0, numbers] = targets
+            frame[side+'_hit'][0, numbers] = has_hit
+            frame[side+'_alive'][0, numbers[is_hit]] = 0
+        self.header['steps'] = self.steps
+
+
+    def close(self):
+        '''
+        Writes all recorded frames to the file.
+        '''
+        self.frames.flush()
+        self.header.flush()
+
+
+class trajectory():
+    '''
+    Version: 0.1
+
+    Reads a file written by trajectory_recorder. Frames are only loaded 
+    from the file when they are accessed, so any range of steps of a large
+    recording can be read without loading the rest. Attributes:
+    - blue, red: int, the number of units of each force
+    - steps: int, the number of recorded steps; frames 0 to steps exist
+    - frames: the memory-mapped structured array of all recorded frames,
+      with the fields described in trajectory_recorder
+
+    Test:
+    >>> from tempfile import TemporaryDirectory
+    >>> with TemporaryDirectory() as directory:
+    ...     path = directory+'/battle.trj'
+    ...     results = run_simulation(strength=[3, 2], accuracy=[1, 0], range=[200, 200], 
+    ...         trajectory=path)
+    ...     recording = trajectory(path)
+    ...     frame = recording[1]
+    ...     del recording
+    >>> frame['blue_target'].tolist(), frame['blue_hit'].tolist(), frame['red_alive'].tolist()
+    ([0, 0, 1], [1, 1, 1], [0, 0])
+    '''
+
+    def __init__(self, path):
+        '''
+        Arguments: path of a trajectory file
+        '''
+        if np is None:
+            raise ImportError('Reading trajectories requires numpy to be installed.')
+        header = np.fromfile(path, dtype=trajectory_dtypes(0, 0)[0], count=1)
+        if len(header) == 0 or header['magic'][0] != trajectory_magic:
+            raise ValueError('Not a trajectory file: '+str(path))
+        self.path = path
+        self.blue = int(header['blue'][0])
+        self.red = int(header['red'][0])
+        self.steps = int(header['steps'][0])
+        header, frame = trajectory_dtypes(self.blue, self.red)
+        self.frames = np.memmap(path, dtype=frame, mode='r', offset=header.itemsize, 
+            shape=(self.steps + 1,))
+
+
+    def __len__(self):
+        '''
+        Returns: the number of frames, i.e. steps + 1
+        '''
+        return self.steps + 1
+
+
+    def __getitem__(self, step):
+        '''
+        Returns: the frame of a step or, for a slice, an array of frames, 
+        copied from the file
+        '''
+        return np.array(self.frames[step])
+
+
+    def read(self, start=0, stop=None):
+        '''
+        Returns: the frames from step start up to but not including step 
+        stop as a structured array
+        '''
+        if stop is None:
+            stop = len(self)
+        return self[start:stop]
+
+
+# Functions
+# --------------------------------------------------------------------
+
+def formation_positions(formation, side, strength, field=field_size, seed=None):
+    '''
+    Version: 0.1
+
+    Generates the initial positions of all units of a force in one go. 
+    Blue (side 0) deploys at the left edge of the field and red (side 1) 
+    mirrored at the right edge, in a zone 2*dist_border_init deep:
+    - 'one line': a line at dist_border_init from the edge
+    - 'two lines': half of the units, rounded up, in that line and the
+      others in a line behind it, at half that distance from the edge
+    - 'scattered': uniformly random in the deployment zone, reproducible
+      with the seed
+    - 'grid': a block of evenly spaced rows and columns filling the zone
+    - 'column': a block like 'grid' in the middle fifth of the field's 
+      height
+    Units in a line are evenly spaced over the height of the field. The 
+    units are sorted along a Morton curve, see morton_order(), so that 
+    neighbouring units are close to each other in the unit lists and 
+    arrays; in a single line, this is their order from bottom to top.
+
+    Arguments: the formation, the side, the number of units, the size of
+    the field, optionally a seed
+    Returns: a numpy array of shape (strength, 2) with the x and y 
+    positions, or a list of (x, y) tuples if numpy is not installed
+
+    Test:
+    >>> formation_positions('one line', 1, 4)[:, 0].tolist()
+    [90.0, 90.0, 90.0, 90.0]
+    >>> formation_positions('two lines', 0, 3).tolist()
+    [[10.0, 33.333333333333336], [5.0, 50.0], [10.0, 66.66666666666667]]
+    >>> positions = formation_positions('scattered', 0, 100, seed=1)
+    >>> bool((positions == formation_positions('scattered', 0, 100, seed=1)).all())
+    True
+    >>> formation_positions('one line', 2, 4)
+    Traceback (most recent call last):
+    ...
+    ValueError: Unknown faction: 2, specify as either 0 or 1
+    '''
+    if side not in (0, 1):
+        raise ValueError('Unknown faction: '+str(side)+', specify as either 0 or 1')
+    depth = 2*dist_border_init
+
+    if formation == 'one line':
+        xpos, ypos = spaced_line(strength, dist_border_init, field)
+    elif formation == 'two lines':
+        front = (strength + 1)//2
+        front_x, front_y = spaced_line(front, dist_border_init, field)
+        rear_x, rear_y = spaced_line(strength - front, dist_border_init/2, field)
+        if np is not None:
+            xpos, ypos = np.concatenate([front_x, rear_x]), np.concatenate([front_y, rear_y])
+        else:
+            xpos, ypos = front_x + rear_x, front_y + rear_y
+    elif formation == 'scattered':
+        if np is not None:
+            draws = np.random.default_rng(seed).random((strength, 2))
+            xpos, ypos = draws[:, 0]*depth, draws[:, 1]*field
+        else:
+            generator = Random(seed)
+            xpos = [generator.random()*depth for i in range(strength)]
+            ypos = [generator.random()*field for i in range(strength)]
+    elif formation == 'grid':
+        xpos, ypos = spaced_block(strength, depth, 0, field)
+    elif formation == 'column':
+        xpos, ypos = spaced_block(strength, depth, 0.4*field, 0.6*field)
+    else:
+        raise ValueError('Unknown formation: '+str(formation)+', specify as either '
+            '\'one line\', \'two lines\', \'scattered\', \'grid\' or \'column\'')
+
+    if np is not None:
+        positions = np.empty((strength, 2))
+        positions[:, 0] = xpos
+        positions[:, 1] = ypos
+        if side == 1:
+            positions[:, 0] = field - positions[:, 0]
+        return positions[morton_order(positions[:, 0], positions[:, 1], field)]
+    if side == 1:
+        xpos = [field - x for x in xpos]
+    return [(xpos[i], ypos[i]) for i in morton_order(xpos, ypos, field)]
+
+
+def spaced_line(count, x, field):
+    '''
+    Returns: the x and y positions of count units in a line at x, evenly
+    spaced over the height of the field, as numpy arrays, or lists without
+    numpy
+    '''
+    dist = field/(count + 1)
+    if np is not None:
+        return np.full(count, float(x)), (1 + np.arange(count))*dist
+    return [x]*count, [(1 + i)*dist for i in range(count)]
+
+
+def spaced_block(count, depth, bottom, top):
+    '''
+    Returns: the x and y positions of count units in a block of evenly 
+    spaced rows and columns, between 0 and depth and between bottom and
+    top, filled row by row, as numpy arrays, or lists without numpy
+    '''
+    if count == 0:
+        return [], []
+    columns = min(count, max(1, round((count*depth/(top - bottom))**0.5)))
+    rows = -(-count//columns)
+    if np is not None:
+        k = np.arange(count)
+        return ((k % columns + 1)*depth/(columns + 1), 
+            bottom + (k//columns + 1)*(top - bottom)/(rows + 1))
+    return ([(k % columns + 1)*depth/(columns + 1) for k in range(count)], 
+        [bottom + (k//columns + 1)*(top - bottom)/(rows + 1) for k in range(count)])
+
+
+def morton_order(xpos, ypos, field=field_size):
+    '''
+    Version: 0.1
+
+    Orders positions along a Morton (Z-order) curve: both coordinates are
+    quantized to 16 bits over the field and their bits interleaved into 
+    one key. Positions close to each other on the field mostly get close
+    keys. Positions with equal keys keep their order.
+
+    Arguments: x and y positions, as numpy arrays or lists, the field size
+    Returns: the indices of the positions in curve order, as a numpy 
+    array, or a list without numpy
+
+    Test:
+    >>> [int(i) for i in morton_order([0, 60, 10, 60], [0, 60, 10, 0])]
+    [0, 2, 3, 1]
+    '''
+    if np is not None:
+        keys = np.zeros(len(xpos), dtype=np.uint64)
+        for shift, values in [(0, xpos), (1, ypos)]:
+            bits = np.clip(np.asarray(values, dtype=float)/field*65536, 0, 65535)
+            bits = bits.astype(np.uint64)
+            bits = (bits | (bits << np.uint64(8))) & np.uint64(0x00FF00FF)
+            bits = (bits | (bits << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+            bits = (bits | (bits << np.uint64(2))) & np.uint64(0x33333333)
+            bits = (bits | (bits << np.uint64(1))) & np.uint64(0x55555555)
+            keys |= bits << np.uint64(shift)
+        return np.argsort(keys, kind='stable')
+
+    keys = []
+    for x, y in zip(xpos, ypos):
+        key = 0
+        for shift, value in [(0, x), (1, y)]:
+            bits = int(min(max(value/field*65536, 0), 65535))
+            bits = (bits | (bits << 8)) & 0x00FF00FF
+            bits = (bits | (bits << 4)) & 0x0F0F0F0F
+            bits = (bits | (bits << 2)) & 0x33333333
+            bits = (bits | (bits << 1)) & 0x55555555
+            key |= bits << shift
+        keys.append(key)
+    return sorted(range(len(keys)), key=keys.__getitem__)
+
+
+def move_steps(pos, target_pos, dist, range, speed):
+    '''
+    Version: 0.1
+
+    Vectorized movement rule of unit.move(), shared by the numpy based 
+    forces. Works on arrays of any shape with x and y in the last dimension
+    of pos and target_pos.
+
+    Arguments: positions, target positions, target distances, ranges and 
+    speeds
+    Returns: x and y steps, and a boolean array flagging the moving units
+
+    Test:
+    >>> xstep, ystep, moving = move_steps(np.array([[0., 0.]]), np.array([[0., -50.]]), 
+    ...     np.array([50.]), 1, 10)
+    >>> xstep.tolist(), ystep.tolist(), moving.tolist()
+    ([0.0], [-10.0], [True])
+    '''
+    xdist = target_pos[..., 0] - pos[..., 0]
+    ydist = target_pos[..., 1] - pos[..., 1]
+
+    # Adjust speed if too close to target
+    speed = np.where(dist <= speed, dist - range*firing_distance, speed)
+
+    # Units with a target out of firing range move, units at the same
+    # x position as their target move along the y axis only
+    vertical = xdist == 0
+    moving = (dist > range) & (dist != 0) & (vertical | (dist > speed))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alpha = np.arctan(np.abs(ydist) / np.abs(xdist))
+    xstep = np.where(vertical, 0, np.sign(xdist)*np.cos(alpha)*speed)
+    ystep = np.where(vertical, np.where(ydist < 0, -speed, speed), 
+        np.sign(ydist)*np.sin(alpha)*speed)
+    return xstep, ystep, moving
+
+
+def visible_targets(own_pos, enemy_pos, shooters, targets, ranges, radius=unit_radius):
+    '''
+    Version: 0.1
+
+    Finds the enemy unit each shooter can hit, given the line of sight 
+    through the units of both forces, see sight_grid. If the line to the 
+    target is blocked, the closest sight_candidates other enemy units 
+    within the shooter's range are tried in the order of their distance, 
+    ties in favour of the lowest index, until one is visible; they are 
+    looked up in a spatial_grid over the enemy units, so the cost of a 
+    blocked shot does not grow with the size of the enemy force.
+
+    Arguments: lists of the (x, y) positions of the own and the enemy 
+    units, lists of the shooters' indices, their targets' indices and 
+    their ranges, optionally the radius of a unit
+    Returns: a list with the index of the enemy unit each shooter hits, or 
+    None if none of the tried enemy units is visible
+
+    Test:
+    >>> own = [[0, 0], [0, 10]]
+    >>> enemy = [[10, 0], [5, 0], [10, 10]]
+    >>> visible_targets(own, enemy, [0, 1], [0, 2], [20, 20])
+    [1, 2]
+    >>> visible_targets(own, enemy, [0], [0], [8])
+    [1]
+    '''
+    sight = sight_grid(list(own_pos) + list(enemy_pos), radius)
+    index = None
+    offset = len(own_pos)
+    visible = []
+    for shooter, target, range in zip(shooters, targets, ranges):
+        x, y = own_pos[shooter]
+        if not sight.blocked((x, y), enemy_pos[target], (shooter, offset + target)):
+            visible.append(target)
+            continue
+
+        if index is None:
+            index = spatial_grid(enemy_pos)
+        found = None
+        for distance, k in index.nearest_many((x, y), sight_candidates + 1, range):
+            if k != target and not sight.blocked((x, y), enemy_pos[k], (shooter, offset + k)):
+                found = k
+                break
+        visible.append(found)
+    return visible
+
+
+def nearest_enemies(pos, enemy_pos, second=False):
+    '''
+    Version: 0.2
+
+    Finds the closest enemy position for each position, evaluating the 
+    distances in blocks of at most chunk_size pairs. Distances are computed
+    like in unit.calculate_distance(), and ties are resolved in favour of 
+    the lowest index.
+
+    Arguments: float arrays of shape (n, 2) and (m, 2), m > 0, optionally 
+    second
+    Returns: an int array with the index and a float array with the 
+    distance of the closest enemy position, with second=True also a float
+    array with the distance of the second closest one (inf if m == 1)
+
+    Test:
+    >>> index, dist = nearest_enemies(np.array([[0., 0.]]), np.array([[3., 4.], [4., 3.]]))
+    >>> index.tolist(), dist.tolist()
+    ([0], [5.0])
+    '''
+    n = len(pos)
+    index = np.zeros(n, dtype=np.intp)
+    dist = np.zeros(n, dtype=pos.dtype)
+    second_dist = np.full(n, np.inf, dtype=pos.dtype)
+    rows = max(1, chunk_size // len(enemy_pos))
+    for start in range(0, n, rows):
+        stop = min(start + rows, n)
+        xdist = pos[start:stop, 0, None] - enemy_pos[None, :, 0]
+        ydist = pos[start:stop, 1, None] - enemy_pos[None, :, 1]
+        distances = np.sqrt(xdist**2 + ydist**2)
+        chosen = np.arange(stop - start), distances.argmin(axis=1)
+        index[start:stop] = chosen[1]
+        dist[start:stop] = distances[chosen]
+        if second and len(enemy_pos) > 1:
+            distances[chosen] = np.inf
+            second_dist[start:stop] = distances.min(axis=1)
+    if second:
+        return index, dist, second_dist
+    return index, dist
+
+
+def nearest_kernel(pos, enemy_pos, search, target_index, target_dist, target_bound):
+    '''
+    Version: 0.1
+
+    Step kernel of array_force.find_targets() for brute targeting: finds
+    the closest and second closest enemy position for the units in search
+    with a loop over the enemy positions, without a matrix of distances.
+    Distances and ties are handled like in nearest_enemies(), so the 
+    results are the same. Compiled with numba if available, see 
+    compile_kernels().
+
+    Arguments: float arrays of shape (n, 2) and (m, 2), m > 0, an int 
+    array of the indices of the searching units, and the arrays for their
+    target index, distance and bound, which are updated
+
+    Test:
+    >>> index, dist, bound = np.full(1, -1), np.zeros(1), np.zeros(1)
+    >>> nearest_kernel(np.array([[0., 0.]]), np.array([[3., 4.], [4., 3.]]), 
+    ...     np.array([0]), index, dist, bound)
+    >>> index.tolist(), dist.tolist(), bound.tolist()
+    ([0], [5.0], [5.0])
+    '''
+    for i in search:
+        x = pos[i, 0]
+        y = pos[i, 1]
+        best_index = 0
+        best_dist = np.inf
+        second_dist = np.inf
+        for k in range(len(enemy_pos)):
+            xdist = x - enemy_pos[k, 0]
+            ydist = y - enemy_pos[k, 1]
+            distance = np.sqrt(xdist**2 + ydist**2)
+            if distance < best_dist:
+                second_dist = best_dist
+                best_index = k
+                best_dist = distance
+            elif distance < second_dist:
+                second_dist = distance
+        target_index[i] = best_index
+        target_dist[i] = best_dist
+        target_bound[i] = second_dist
+
+
+def move_kernel(pos, enemy_pos, target_index, target_dist, ranges, speeds, step_length):
+    '''
+    Version: 0.1
+
+    Step kernel of array_force.move(): applies the movement rule of 
+    unit.move(), with its clamping of the speed close to the target, to 
+    one unit after the other, with the same arithmetic as move_steps().
+    Compiled with numba if available, see compile_kernels().
+
+    Arguments: the force's positions, the enemy positions, the force's 
+    target indices and distances, ranges and speeds, and the array of 
+    step lengths; positions and step lengths are updated
+
+    Test:
+    >>> pos, step_length = np.array([[0., 0.]]), np.zeros(1)
+    >>> move_kernel(pos, np.array([[0., -50.]]), np.array([0]), np.array([50.]), 
+    ...     np.array([1.]), np.array([10.]), step_length)
+    >>> pos.tolist(), step_length.tolist()
+    ([[0.0, -10.0]], [10.0])
+    '''
+    for i in range(len(pos)):
+        target = target_index[i]
+        step_length[i] = 0.0
+        if target < 0:
+            continue
+        xdist = enemy_pos[target, 0] - pos[i, 0]
+        ydist = enemy_pos[target, 1] - pos[i, 1]
+        dist = target_dist[i]
+        speed = speeds[i]
+
+        # Adjust speed if too close to target
+        if dist <= speed:
+            speed = dist - ranges[i]*firing_distance
+        vertical = xdist == 0
+        if not (dist > ranges[i] and dist != 0 and (vertical or dist > speed)):
+            continue
+
+        if vertical:
+            xstep = 0.0
+            ystep = -speed if ydist < 0 else speed
+        else:
+            alpha = np.arctan(abs(ydist) / abs(xdist))
+            xstep = np.sign(xdist)*np.cos(alpha)*speed
+            ystep = np.sign(ydist)*np.sin(alpha)*speed
+        pos[i, 0] += xstep
+        pos[i, 1] += ystep
+        step_length[i] = np.hypot(xstep, ystep)
+
+
+def fire_kernel(target_index, target_dist, ranges, accuracies, draws, has_hit, enemy_is_hit):
+    '''
+    Version: 0.1
+
+    Step kernel of array_force.fire(): resolves the shots of all units in
+    one pass, given one random number per unit. Compiled with numba if 
+    available, see compile_kernels().
+
+    Arguments: the force's target indices and distances, ranges, 
+    accuracies, random numbers, and the arrays has_hit of the force and
+    is_hit of the enemy force, which are updated
+
+    Test:
+    >>> has_hit, is_hit = np.zeros(2, dtype=bool), np.zeros(2, dtype=bool)
+    >>> fire_kernel(np.array([1, 1]), np.array([5., 50.]), np.array([10., 10.]), 
+    ...     np.array([0.5, 0.5]), np.array([0.1, 0.1]), has_hit, is_hit)
+    >>> has_hit.tolist(), is_hit.tolist()
+    ([True, False], [False, True])
+    '''
+    for i in range(len(target_index)):
+        hit = (target_index[i] >= 0 and target_dist[i] <= ranges[i] 
+            and draws[i] < accuracies[i])
+        has_hit[i] = hit
+        if hit:
+            enemy_is_hit[target_index[i]] = True
+
+
+def compile_kernels():
+    '''
+    Version: 0.1
+
+    Compiles the step kernels of the numpy engine with numba, if numba is 
+    installed and jit_kernels is set in the config. Kernels are compiled 
+    on their first call and the machine code is cached on disk next to 
+    the module, so later processes load it instead of compiling again. 
+    Without numba, the engine uses its vectorized numpy code, with the 
+    same results.
+
+    Returns: a dict mapping the names of the kernels to the compiled 
+    functions, empty without numba
+
+    Test: the kernels, here not compiled, give the same histories as the 
+    vectorized code
+    >>> compiled = dict(kernels)
+    >>> scenario = dict(engine='numpy', strength=[40, 30], range=[20, 30], 
+    ...     formation=['two lines', 'scattered'], seed=5)
+    >>> kernels.clear()
+    >>> vectorized = [run_simulation(**scenario), run_simulation(compact=True, **scenario)]
+    >>> kernels.update((function.__name__, function) 
+    ...     for function in (nearest_kernel, move_kernel, fire_kernel))
+    >>> looped = [run_simulation(**scenario), run_simulation(compact=True, **scenario)]
+    >>> kernels.clear()
+    >>> kernels.update(compiled)
+    >>> [(a.blue, a.red) == (b.blue, b.red) for a, b in zip(looped, vectorized)]
+    [True, True]
+    >>> vectorized[0].steps, vectorized[0].outcome()
+    (59, 'Red victory')
+    '''
+    if numba is None or np is None or not jit_kernels:
+        return {}
+    return {function.__name__: numba.njit(cache=True)(function) 
+        for function in (nearest_kernel, move_kernel, fire_kernel)}
+
+
+kernels = compile_kernels()
+
+
+def approach_jump(blue_pos, blue_range, blue_speed, red_pos, red_range, red_speed, 
+    max_jump):
+    '''
+    Version: 0.1
+
+    Analyses the approach phase of two forces for fast-forwarding. In each
+    step, the distance between two units shrinks by at most the sum of 
+    their speeds, so from the distance of each unit to its closest enemy, 
+    its range and the enemy force's highest speed follows a number of steps
+    k in which no unit can fire. In these steps, units also move with their
+    full speed. If, in addition, the target of every unit moves along the 
+    line between the two (or does not move at all), all units move in 
+    straight lines with constant steps. Then, their target choice can only
+    change if the squared distance to another enemy, a quadratic function 
+    of time, falls below that to the target within the k steps, which is 
+    checked for all pairs.
+
+    Arguments: positions, ranges and speeds of the units of both forces as
+    numpy arrays, the maximum number of steps to skip
+    Returns: a tuple of k and the indices of the targets, i.e. the closest
+    enemies, of the blue and red units. The targets are None if the units
+    do not move straight or change targets within the k steps, or if 
+    k < 2. k is inf if no unit is in range and no unit can ever move into
+    range.
+
+    Test:
+    >>> pos = np.array([[0., 0.]])
+    >>> steps, blue_target, red_target = approach_jump(pos, np.array([10.]), np.array([1.]), 
+    ...     pos + [100, 0], np.array([10.]), np.array([1.]), 100)
+    >>> steps, blue_target.tolist(), red_target.tolist()
+    (45, [0], [0])
+    '''
+    blue_target, blue_dist = nearest_enemies(blue_pos, red_pos)
+    red_target, red_dist = nearest_enemies(red_pos, blue_pos)
+
+    # Number of steps without fire, and with units moving at full speed and
+    # not passing their target
+    steps = inf
+    for dist, reach, speed, enemy_speed in [
+        (blue_dist, blue_range, blue_speed, red_speed.max()), 
+        (red_dist, red_range, red_speed, blue_speed.max())]:
+        closing = speed + enemy_speed
+        margin = dist - np.maximum(reach, closing)
+        if (margin <= 0).any():
+            return 0, None, None
+        approaching = closing > 0
+        if approaching.any():
+            steps = min(steps, int(np.ceil(margin[approaching] / closing[approaching]).min()))
+    if steps == inf:
+        return inf, None, None
+    steps = min(steps, max_jump)
+    if steps < 2:
+        return steps, None, None
+
+    # Step vectors, the red units moving towards the blue units' new positions
+    xstep, ystep, moving = move_steps(blue_pos, red_pos[blue_target], blue_dist, 
+        blue_range, blue_speed)
+    blue_step = np.column_stack([xstep, ystep])
+    xstep, ystep, moving = move_steps(red_pos, (blue_pos + blue_step)[red_target], 
+        red_dist, red_range, red_speed)
+    red_step = np.column_stack([xstep, ystep])
+
+    # Targets have to move along the line of fire
+    for pos, target, enemy_pos, enemy_step in [(blue_pos, blue_target, red_pos, red_step),
+        (red_pos, red_target, blue_pos, blue_step)]:
+        line = enemy_pos[target] - pos
+        velocity = enemy_step[target]
+        cross = line[:, 0]*velocity[:, 1] - line[:, 1]*velocity[:, 0]
+        scale = np.hypot(line[:, 0], line[:, 1])*np.hypot(velocity[:, 0], velocity[:, 1])
+        if (np.abs(cross) > 1e-9*scale).any():
+            return steps, None, None
+
+    # Targets must remain the strictly closest enemies in steps 0 to k - 1
+    last = steps - 1
+    for pos, step, target, enemy_pos, enemy_step in [
+        (blue_pos, blue_step, blue_target, red_pos, red_step),
+        (red_pos, red_step, red_target, blue_pos, blue_step)]:
+        rows = max(1, chunk_size // len(enemy_pos))
+        for start in range(0, len(pos), rows):
+            stop = min(start + rows, len(pos))
+            offset = pos[start:stop, None, :] - enemy_pos[None, :, :]
+            drift = step[start:stop, None, :] - enemy_step[None, :, :]
+            a = (drift**2).sum(axis=2)
+            b = 2*(offset*drift).sum(axis=2)
+            c = (offset**2).sum(axis=2)
+            chosen = np.arange(stop - start), target[start:stop]
+            a = a - a[chosen][:, None]
+            b = b - b[chosen][:, None]
+            c_target = c[chosen][:, None]
+            c = c - c_target
+            lowest = np.minimum(c, a*last**2 + b*last + c)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                vertex = -b / (2*a)
+            inside = (a > 0) & (vertex > 0) & (vertex < last)
+            lowest = np.where(inside, np.minimum(lowest, c - b**2/(4*np.where(inside, a, 1))), 
+                lowest)
+            lowest[chosen] = inf
+            if (lowest <= 1e-9*c_target).any():
+                return steps, None, None
+
+    return steps, blue_target, red_target
+
+
+# Identifies files written by trajectory_recorder
+trajectory_magic = b'ATSIMTRJ'
+
+
+def trajectory_dtypes(blue, red):
+    '''
+    Version: 0.1
+
+    Arguments: the number of units of both forces
+    Returns: the numpy data types of the header and of one frame of a 
+    trajectory file, see trajectory_recorder
+    '''
+    header = np.dtype([('magic', 'S8'), ('version', '<u8'), ('capacity', '<u8'), 
+        ('blue', '<u8'), ('red', '<u8'), ('steps', '<u8')])
+    fields = []
+    for side, n in [('blue', blue), ('red', red)]:
+        fields += [(side+'_pos', '<f8', (n, 2)), (side+'_alive', 'u1', (n,)), 
+            (side+'_target', '<i4', (n,)), (side+'_hit', 'u1', (n,))]
+    return header, np.dtype(fields)
+
+
+def read_history(file):
+    '''
+    Version: 0.1
+
+    Reads a strength history written in the binary format of 
+    history_writer.
+
+    Arguments: a file opened for reading in binary mode
+    Returns: a tuple of an int array with the step numbers and two float 
+    arrays with the strengths of both forces
+
+    Test:
+    >>> from io import BytesIO
+    >>> file = BytesIO()
+    >>> run_simulation(strength=[10, 1], accuracy=[1, 0], range=[200, 200]).write(file, 'binary')
+    >>> _ = file.seek(0)
+    >>> read_history(file)
+    (array('q', [1]), array('d', [10.0]), array('d', [0.0]))
+    '''
+    steps = array('q')
+    blue = array('d')
+    red = array('d')
+    for step, blue_strength, red_strength in history_writer.record.iter_unpack(file.read()):
+        steps.append(step)
+        blue.append(blue_strength)
+        red.append(red_strength)
+    return steps, blue, red
+
+
+def history_array(values):
+    '''
+    Returns: the strengths as a typed array, of ints if all of them are 
+    ints, e.g. numbers of units, else of floats, e.g. the strengths of 
+    run_lanchester()
+
+    Test:
+    >>> history_array([10, 9]), history_array([10, 8.5])
+    (array('l', [10, 9]), array('d', [10.0, 8.5]))
+    '''
+    try:
+        return array('l', values)
+    except TypeError:
+        return array('d', values)
+
+
+def initialize(faction=Faction, name=Name, color=Color, strength=Strength, 
+    range=Range, speed=Speed, accuracy=Accuracy, formation=Formation, engine='python'):
     '''
-    Version 0.1
+    Version: 0.2
     Authors: Steffen Pielström
 
-    Returns results of a simple Lanchester-law calculation.
+    Initializes two forces to start a simulation. With engine='numpy', the
+    forces are created as array_force objects. This is a convenience for 
+    interactive use: it creates a simulation object and stores its forces
+    and experiment in the module variables blue_force, red_force and 
+    results. To run several simulations side by side, use simulation 
+    objects directly.
+
+    Test:
+    ##>>> blue_force = force(0, 'blue')
+    ##>>> initialize()
+    ##>>> blue_force.units[0].pos
+    ##[10, 9.090909090909092]
     '''
+    battle = simulation(faction=faction, name=name, color=color, strength=strength, 
+        range=range, speed=speed, accuracy=accuracy, formation=formation, engine=engine)
+
+    global blue_force
+    blue_force = battle.blue_force
+
+    global red_force
+    red_force = battle.red_force
 
     global results
+    results = battle.results
+
+
+def verify_targets(own_force, enemy_force):
+    '''
+    Version: 0.1
+
+    Debugging aid for incremental targeting: checks the targets of all 
+    units of a force against a search of the whole enemy force, see 
+    check_targeting in config.py.
+
+    Arguments: the force whose targets are checked and the enemy force, 
+    either both force or both array_force objects
+    Raises: RuntimeError if a unit's target is not the closest enemy unit
+
+    Test:
+    >>> blue_force = force(0, 'blue', strength=2)
+    >>> red_force = force(1, 'red', strength=2)
+    >>> blue_force.initialize_units()
+    >>> red_force.initialize_units()
+    >>> for element in blue_force.units:
+    ...     element.find_target(red_force.units)
+    >>> verify_targets(blue_force, red_force)
+    >>> blue_force.units[0].target_index = 1
+    >>> verify_targets(blue_force, red_force)
+    Traceback (most recent call last):
+    ...
+    RuntimeError: Unit 0 of blue targets enemy 1, the closest enemy is 0
+    '''
+    if isinstance(own_force, array_force):
+        if len(own_force) == 0 or len(enemy_force) == 0:
+            return
+        targets = nearest_enemies(own_force.pos, enemy_force.pos)[0]
+        actual = own_force.target_index
+    else:
+        targets = []
+        for element in own_force.units:
+            distances = [element.calculate_distance(other) for other in enemy_force.units]
+            targets.append(distances.index(min(distances)))
+        actual = [element.target_index for element in own_force.units]
+
+    for i, (target, closest) in enumerate(zip(actual, targets)):
+        if target != closest:
+            raise RuntimeError('Unit '+str(i)+' of '+own_force.name+' targets enemy '+
+                str(target)+', the closest enemy is '+str(closest))
+
+
+def update_forces(blue_force, red_force, targeting='brute', rng=None, recorder=None,
+    metrics=None, line_of_sight=False):
+    '''
+    Version: 0.8
+    Authors: Steffen Pielström
+
+    Performs a single complete simulation step for all forces/units
+    involved. 
+
+    Units keep their target as long as it is provably still the closest 
+    enemy, see unit.keep_target(). Units that did not move in the last 
+    step only evaluate the enemy units that moved, see 
+    unit.recheck_target(). Units search the enemy force only if their 
+    target was eliminated or another enemy may have come closer.
+    The targeting argument selects how units search: 'brute' computes the
+    distances to all enemy units, 'grid' builds a spatial_grid over the 
+    enemy force at the start of the step, i.e. after the movement and 
+    casualties of the previous step, and looks targets up there. Both 
+    methods pick the same targets. If check_targeting is set, all targets
+    are verified against a search of the whole enemy force. If an 
+    rng_stream is passed as rng, all units draw their random numbers from 
+    it, see unit.fire(). If a trajectory_recorder is passed as recorder, 
+    the state of all units is recorded before the hit units are removed.
+    If a step_metrics object is passed as metrics, the time of each phase
+    of the step and the work done in it are measured; without, the step 
+    does not pay for any measurement. With line_of_sight=True, units 
+    cannot hit through other units, see force.check_sight().
+    
+    Test:
+    >>> blue_force = force(0, 'blue', strength=5, accuracy=1, range=100)
+    >>> red_force = force(1, 'red', strength=5, accuracy=0)
+    >>> blue_force.initialize_units()
+    >>> red_force.initialize_units()
+    >>> update_forces(blue_force, red_force)
+    >>> len(blue_force), len(red_force)
+    (5, 0)
+    >>> update_forces(blue_force, red_force)
+    >>> blue_force.units[0].target_index is None
+    True
+    '''
+    # First set of loops: identify targets
+    if targeting not in ('brute', 'grid'):
+        raise ValueError('Unknown targeting method: '+str(targeting)+
+            ', specify as either \'brute\' or \'grid\'')
+    if metrics is not None:
+        metrics.start()
+
+    for own, enemy in [(blue_force, red_force), (red_force, blue_force)]:
+        if len(enemy) == 0:
+            for element in own.units:
+                element.target_index = None
+                element.target_dist = None
+                element.target_bound = None
+            continue
+        moved = [k for k, element in enumerate(enemy.units) if element.step_length > 0]
+        enemy_step = max((enemy.units[k].step_length for k in moved), default=0.0)
+        if metrics is not None:
+            checks = sum(1 for element in own.units 
+                if element.target_index is not None and element.target_bound is not None)
+        searching = []
+        rechecks = 0
+        for element in own.units:
+            if element.keep_target(enemy.units, enemy_step):
+                continue
+            if (element.step_length == 0 and element.target_index is not None 
+                and element.target_bound is not None):
+                rechecks += 1
+                if element.recheck_target(enemy.units, moved):
+                    continue
+            searching.append(element)
+        index = None
+        if targeting == 'grid' and searching:
+            index = spatial_grid([element.pos for element in enemy.units])
+        for element in searching:
+            element.find_target(enemy.units, index)
+        if metrics is not None:
+            checks += rechecks*len(moved)
+            if index is not None:
+                checks += index.evaluations
+            elif targeting == 'brute':
+                checks += len(searching)*len(enemy.units)
+            metrics.count('distance_evaluations', checks)
+            metrics.count('retargets', len(searching))
+        if check_targeting:
+            verify_targets(own, enemy)
+    if metrics is not None:
+        metrics.lap('targeting')
+
+    # Second set of loops: move and fire. Units fire at the distance of 
+    # their target before the move, so a force can move before it fires.
+    for own, enemy in [(blue_force, red_force), (red_force, blue_force)]:
+        for element in own.units:
+            element.move()
+        if metrics is not None:
+            metrics.lap('movement')
+        for element in own.units:
+            element.fire(enemy.units, rng)
+        if line_of_sight:
+            own.check_sight(enemy)
+        if metrics is not None:
+            metrics.lap('fire')
+            metrics.count('shots', sum(1 for element in own.units 
+                if element.target_dist is not None and element.target_dist <= element.range))
+            metrics.count('hits', sum(1 for element in own.units if element.has_hit))
+            metrics.lap()
+    if recorder is not None:
+        recorder.record(blue_force, red_force)
+        if metrics is not None:
+            metrics.lap()
+    blue_force.kill_hit_units()
+    red_force.kill_hit_units()
+    blue_force.remap_targets(red_force.index_map)
+    red_force.remap_targets(blue_force.index_map)
+    if metrics is not None:
+        metrics.lap('removal')
+        metrics.finish()
+
+
+def update_array_forces(blue_force, red_force, rng=None, targeting='brute', recorder=None,
+    metrics=None, line_of_sight=False):
+    '''
+    Version: 0.5
+
+    Performs a single complete simulation step for two array_force objects,
+    following the same order as update_forces(): all units pick their 
+    targets, then the blue force moves and fires, then the red force moves
+    and fires, and finally all hit units are removed.
+
+    Arguments: two array_force objects, optionally a numpy random Generator
+    or rng_stream, the targeting method, either 'brute' or 'grid', a 
+    trajectory_recorder, a step_metrics object and whether to check the 
+    line of sight. Without a generator, one is seeded from the random 
+    module.
+
+    Test:
+    >>> blue_force = array_force(0, 'blue', strength=5, accuracy=1, range=100)
+    >>> red_force = array_force(1, 'red', strength=5, accuracy=0)
+    >>> blue_force.initialize_units()
+    >>> red_force.initialize_units()
+    >>> update_array_forces(blue_force, red_force)
+    >>> len(blue_force), len(red_force)
+    (5, 0)
+    '''
+    if targeting not in ('brute', 'grid'):
+        raise ValueError('Unknown targeting method: '+str(targeting)+
+            ', specify as either \'brute\' or \'grid\'')
+    if rng is None:
+        rng = np.random.default_rng(getrandbits(64))
+    if metrics is not None:
+        metrics.start()
+
+    # Identify targets
+    blue_searching = blue_force.find_targets(red_force, targeting)
+    red_searching = red_force.find_targets(blue_force, targeting)
+    if metrics is not None:
+        metrics.count('retargets', blue_searching + red_searching)
+        metrics.count('distance_evaluations', blue_force.evaluations + red_force.evaluations)
+    if check_targeting:
+        verify_targets(blue_force, red_force)
+        verify_targets(red_force, blue_force)
+    if metrics is not None:
+        metrics.lap('targeting')
+
+    # Move and fire
+    for own, enemy in [(blue_force, red_force), (red_force, blue_force)]:
+        own.move(enemy)
+        if metrics is not None:
+            metrics.lap('movement')
+        own.fire(enemy, rng)
+        if line_of_sight:
+            own.check_sight(enemy)
+        if metrics is not None:
+            metrics.lap('fire')
+            metrics.count('shots', int(np.count_nonzero((own.target_index >= 0) 
+                & (own.target_dist <= own.ranges))))
+            metrics.count('hits', int(np.count_nonzero(own.has_hit)))
+            metrics.lap()
+    if recorder is not None:
+        recorder.record(blue_force, red_force)
+        if metrics is not None:
+            metrics.lap()
+    blue_force.kill_hit_units()
+    red_force.kill_hit_units()
+    blue_force.remap_targets(red_force.index_map)
+    red_force.remap_targets(blue_force.index_map)
+    if metrics is not None:
+        metrics.lap('removal')
+        metrics.finish()
+
+
+def update_batch_forces(blue_force, red_force, rng):
+    '''
+    Version: 0.1
+
+    Performs a single complete simulation step for all replicates of two
+    batch_force objects, in the same order as update_forces().
+
+    Arguments: two batch_force objects, a numpy random Generator
+    '''
+    # Eliminated units at infinity produce invalid values that are masked
+    with np.errstate(invalid='ignore'):
+        blue_force.find_targets(red_force)
+        red_force.find_targets(blue_force)
+        blue_force.move(red_force)
+        blue_force.fire(red_force, rng)
+        red_force.move(blue_force)
+        red_force.fire(blue_force, rng)
+    blue_force.kill_hit_units()
+    red_force.kill_hit_units()
+
+
+def memory_estimate(strength=Strength, engine='python', targeting='brute', 
+    line_of_sight=False, compact=False):
+    '''
+    Version: 0.1
+
+    Estimates the peak memory a simulation needs, without allocating it,
+    so that jobs with large forces can be sized for the available memory.
+    The unit arrays of the numpy engine are counted exactly from their 
+    data types. Unit objects, the spatial grids built in every step and 
+    the temporary arrays of a step are counted with sizes per unit that 
+    were measured with tracemalloc on 64 bit CPython; the actual peak may 
+    deviate by some ten percent.
+
+    Arguments: the strengths of both forces, the engine, the targeting 
+    method, line_of_sight and compact, see run_simulation()
+    Returns: the estimated peak memory in bytes
+
+    Test:
+    >>> memory_estimate([10**6, 10**6], engine='numpy', targeting='grid') // 10**6
+    749
+    >>> memory_estimate([10**6, 10**6], engine='numpy', targeting='grid', compact=True) // 10**6
+    637
+    '''
+    if engine not in ('python', 'numpy'):
+        raise ValueError('Unknown engine: '+str(engine)+
+            ', specify as either \'python\' or \'numpy\'')
+    if compact and engine != 'numpy':
+        raise ValueError('Compact storage requires the numpy engine.')
+    largest = max(strength)
+    total = sum(strength)
+
+    if engine == 'numpy':
+        real = 4 if compact else 8
+        integer = 4 if compact else 8
+        # pos, ranges, speeds, accuracies, target_dist, target_bound, 
+        # step_length, target_index, numbers and three boolean flags
+        units = (8*real + 2*integer + 3)*total
+        # Index arrays, gathered positions and distances in find_targets() 
+        # and kill_hit_units()
+        step = (19 + 6*real + 2*integer)*largest
+        # Temporary arrays of formation_positions()
+        setup = 94*largest
+        if targeting == 'grid':
+            step += 500*largest
+        else:
+            step += 5*real*chunk_size
+    else:
+        units = 480*total
+        step = 300*largest if targeting == 'grid' else 0
+        setup = 0
+    if line_of_sight:
+        # Position lists and the sight_grid of both forces
+        step += 260*total
+    return units + max(setup, step)
+
+
+def canonical(max_steps=max_steps, strength=Strength, range=Range, speed=Speed,
+    accuracy=Accuracy, formation=Formation, engine='python', line_of_sight=False,
+    antithetic=False, compact=False, **options):
+    '''
+    Brings the parameters of a scenario into a canonical form, so that
+    equal scenarios compare equal however they were written, e.g. for the
+    keys of AttritionSimCache.py or to check a checkpoint. Options that do
+    not change the results, listed in run_options, are left out. Any other
+    keyword raises a ValueError, so that a misspelt parameter cannot fall
+    back to its default unnoticed.
+
+    Returns: a dict of the parameters
+
+    Test:
+    >>> canonical(strength=(10, 5), range=[70, 70.0], targeting='grid')['range']
+    [70.0, 70.0]
+    >>> canonical(strenght=[10, 5])
+    Traceback (most recent call last):
+    ...
+    ValueError: Unknown scenario parameter: strenght
+    '''
+    unknown = [name for name in options if name not in run_options]
+    if unknown:
+        raise ValueError('Unknown scenario parameter: '+', '.join(unknown))
+    return {
+        'max_steps': int(max_steps),
+        'strength': [int(value) for value in strength],
+        'range': [float(value) for value in range],
+        'speed': [float(value) for value in speed],
+        'accuracy': [float(value) for value in accuracy],
+        'formation': [str(value) for value in formation],
+        'engine': str(engine),
+        'line_of_sight': bool(line_of_sight),
+        'antithetic': bool(antithetic),
+        'compact': bool(compact),
+        }
+
+
+def restore(snapshot, metrics=None, writer=None):
+    '''
+    Version: 0.2
+
+    Recreates a simulation from a snapshot, see simulation.snapshot(). 
+    The restored simulation continues exactly like the original one. A 
+    history_writer given as writer receives the strengths of the steps 
+    after the snapshot.
+
+    Arguments: the snapshot as bytes or the path of a file it was written
+    to, optionally metrics like in run_simulation() and a history_writer
+    Returns: a simulation object
+    '''
+    if isinstance(snapshot, (str, os.PathLike)):
+        with open(snapshot, 'rb') as file:
+            snapshot = file.read()
+    format, battle = pickle.loads(zlib.decompress(snapshot))
+    if format != snapshot_format:
+        raise ValueError('Unknown snapshot format: '+str(format))
+    if metrics is True:
+        metrics = step_metrics()
+    battle.metrics = metrics
+    battle.results.metrics = metrics
+    battle.results.writer = writer
+    return battle
+
+
+def run_simulation(max_steps=max_steps, output='return', faction=Faction, name=Name,
+    color=Color, strength=Strength, range=Range, speed=Speed, accuracy=Accuracy,
+    formation=Formation, engine='python', targeting='brute', seed=None, replicate=0,
+    antithetic=False, fast_forward=False, record='full', trajectory=None, metrics=None,
+    line_of_sight=False, compact=False, checkpoint=None, writer=None):
+    '''
+    Version: 0.14
+    Authors: Steffen Pielström
+    
+    This is the main function calling all methods and functions in the
+    module and runnning an antire simulation from initialization to 
+    returning the final result. Each call works on its own simulation 
+    object, so calls are independent of each other.
+
+    The engine argument selects how units are stored and processed: 
+    'python' uses lists of unit objects, 'numpy' uses array_force objects 
+    and requires numpy. Both return the same kind of experiment object.
+    The targeting argument selects how units find their closest enemy, 
+    either 'brute' (distances to all enemy units) or 'grid' (spatial_grid
+    lookup, faster for large forces); see update_forces(). With 
+    line_of_sight=True, units cannot hit through other units, see 
+    force.check_sight().
+
+    Random numbers come from an rng_stream derived from seed and replicate,
+    so a run can be reproduced from these two values, which are stored in
+    the returned experiment. Without a seed, one is drawn from the random
+    module. Runs of different scenarios with the same seed and replicate 
+    use common random numbers; with antithetic=True, replicates 2k and 
+    2k+1 form antithetic pairs, see rng_stream.
+
+    With fast_forward=True, steps of the approach phase in which no unit 
+    can fire are skipped analytically where possible, and runs in which no
+    unit can ever get into range end early as a stalemate, see 
+    simulation.fast_forward(). Requires numpy.
+
+    With record='summary' or record=k, only the final strengths or those 
+    after every k-th step are kept in the results, see experiment; a 
+    history_writer given as writer receives the strengths after every 
+    step independent of record. If a file path is given as trajectory, the positions, targets and hits of 
+    all units in every step are recorded there, see trajectory_recorder.
+
+    With metrics=True, or a step_metrics object, e.g. with a callback to 
+    stream the values of each step, the time spent in the phases of each
+    step and counters of the work done are attached to the results as 
+    results.metrics, see step_metrics.
+
+    With compact=True, the numpy engine stores positions and distances as
+    float32 and indices as int32, which halves the memory needed for large
+    forces; see memory_estimate() for the expected memory use. A warning 
+    is printed if float32 rounding may have changed a unit's choice 
+    between two almost equally distant targets.
+
+    If a file path is given as checkpoint, a snapshot of the simulation is
+    written there every checkpoint_every steps (config.py), and deleted 
+    when the run has ended. If the file already exists, the simulation is
+    resumed from it instead of started, so a preempted run is continued by
+    simply calling run_simulation() again with the same arguments. The 
+    scenario stored in the checkpoint has to match the arguments, else a 
+    ValueError is raised; without a seed, any seed is accepted.
+
+    Test:
+    >>> results = run_simulation(strength=[10, 10], accuracy=[1, 0], range=[200, 200], 
+    ...     engine='numpy')
+    >>> results.steps, results.blue, results.red
+    (1, [10], [0])
+    >>> run_simulation(seed=7).blue == run_simulation(seed=7).blue
+    True
+    >>> steps = []
+    >>> results = run_simulation(seed=7, metrics=step_metrics(callback=steps.append))
+    >>> len(steps) == results.steps, results.metrics.totals['hits'] >= 10 - results.red[-1]
+    (True, True)
+    '''
+    if checkpoint is not None and os.path.exists(checkpoint):
+        battle = restore(checkpoint, metrics, writer)
+        scenario = canonical(max_steps, strength, range, speed, accuracy, formation, 
+            engine, line_of_sight, antithetic, compact)
+        if (battle.scenario != scenario or battle.results.replicate != replicate
+            or seed is not None and battle.results.seed != seed):
+            raise ValueError('The checkpoint '+str(checkpoint)+' belongs to a different '
+                'scenario: '+str(battle.scenario)+', seed '+str(battle.results.seed)+
+                ', replicate '+str(battle.results.replicate))
+    else:
+        battle = simulation(max_steps=max_steps, faction=faction, name=name, color=color, 
+            strength=strength, range=range, speed=speed, accuracy=accuracy, 
+            formation=formation, engine=engine, targeting=targeting, seed=seed, 
+            replicate=replicate, antithetic=antithetic, fast_forward=fast_forward, 
+            record=record, trajectory=trajectory, metrics=metrics, 
+            line_of_sight=line_of_sight, compact=compact, writer=writer)
+    results = battle.run(checkpoint)
+
+    # Handle results
+    if output == 'return':
+        return results
+    else:
+        results.print(output)
+
+def run_ensemble(n_replicates=1000, max_steps=max_steps, output='return', faction=Faction, 
+    name=Name, color=Color, strength=Strength, range=Range, speed=Speed, accuracy=Accuracy,
+    formation=Formation, seed=None):
+    '''
+    Version: 0.1
+
+    Runs many replicates of the same scenario and returns their aggregated
+    results as an ensemble object: victory probabilities, a histogram of 
+    battle durations and the mean and quantiles of both forces' strengths 
+    after each step. Replicates are advanced together in batches of 
+    batch_force objects, with the batch size limited so that one batch 
+    handles at most chunk_size unit pairs. Replicates that have finished 
+    are dropped from their batch. Each batch draws from its own rng_stream, 
+    derived from seed and the batch index. Requires numpy.
+
+    Test:
+    >>> results = run_ensemble(100, strength=[10, 10], accuracy=[1, 0], range=[200, 200])
+    >>> results.win_probability()
+    [1.0, 0.0]
+    >>> float(results.mean()[1][0])
+    0.0
+    '''
+    if np is None:
+        raise ImportError('Ensembles require numpy to be installed.')
+
+    results = ensemble(name=name, strength=strength, range=range, speed=speed, 
+        accuracy=accuracy, formation=formation, max_steps=max_steps)
+    if seed is None:
+        seed = getrandbits(64)
+    batch = max(1, chunk_size // max(1, strength[0]*strength[1]))
+
+    # Main loop over batches of replicates
+    remaining = n_replicates
+    batches = 0
+    while remaining > 0:
+        replicates = min(batch, remaining)
+        remaining -= replicates
+        rng = rng_stream(seed, batches)
+        batches += 1
+        blue_force = batch_force(faction[0], name[0], color[0], strength[0], range[0], 
+            speed[0], accuracy[0], formation[0], replicates=replicates)
+        blue_force.initialize_units(rng.derive_seed('blue formation'))
+        red_force = batch_force(faction[1], name[1], color[1], strength[1], range[1], 
+            speed[1], accuracy[1], formation[1], replicates=replicates)
+        red_force.initialize_units(rng.derive_seed('red formation'))
+
+        steps = 0
+        while blue_force.replicates > 0:
+            update_batch_forces(blue_force, red_force, rng)
+            steps += 1
+            running = results.update(blue_force, red_force, steps)
+            blue_force.select(running)
+            red_force.select(running)
+
+    # Handle results
+    if output == 'return':
+        return results
+    else:
+        results.print(output)
+
+
+def run_adaptive(precision=0.01, statistic='win', side=0, confidence=0.95, batch_size=100,
+    max_replicates=100000, output='return', seed=None, **kwargs):
+    '''
+    Version: 0.1
+
+    Estimates a force's victory probability (statistic='win') or its mean
+    final strength (statistic='strength') by running replicates of a 
+    scenario with run_simulation() in batches, until the half-width of the
+    confidence interval is at most precision, or max_replicates is reached.
+    Lopsided scenarios thus stop after few batches, while balanced ones get
+    as many replicates as they need. Replicate k uses the rng_stream given 
+    by seed and k. Further keyword arguments, e.g. strength or engine, are 
+    passed on to run_simulation().
+
+    Arguments: the targeted half-width, the statistic, the index of the 
+    force it refers to, the confidence level, the number of replicates per
+    batch, the maximum number of replicates, output and root seed
+    Returns: an estimate object
+
+    Test:
+    >>> result = run_adaptive(0.05, strength=[5, 5], accuracy=[1, 0], range=[200, 200])
+    >>> result.value, result.replicates, result.converged
+    (1.0, 100, True)
+    '''
+    if statistic not in ('win', 'strength'):
+        raise ValueError('Unknown statistic: '+str(statistic)+
+            ', specify as either \'win\' or \'strength\'')
+    if seed is None:
+        seed = getrandbits(64)
+    kwargs['output'] = 'return'
+    # Only the final strengths are needed
+    kwargs.setdefault('record', 'summary')
+
+    result = estimate(statistic, side, confidence, precision, seed)
+    while not result.converged and result.replicates < max_replicates:
+        values = []
+        for replicate in range(result.replicates, 
+            min(result.replicates + batch_size, max_replicates)):
+            outcome = run_simulation(seed=seed, replicate=replicate, **kwargs)
+            final = [outcome.blue[-1], outcome.red[-1]]
+            if statistic == 'win':
+                values.append(int(final[side] > 0 and final[1 - side] == 0))
+            else:
+                values.append(final[side])
+        result.update(values)
+
+    # Handle results
+    if output == 'return':
+        return result
+    else:
+        result.print(output)
+
+
+def run_sweep(strength=[Strength], range=[Range], speed=[Speed], accuracy=[Accuracy], 
+    replicates=1, max_workers=None, seed=None, common_random_numbers=True, **kwargs):
+    '''
+    Version: 0.2
+
+    Runs run_simulation() for every combination of the given strength, 
+    range, speed and accuracy pairs on a pool of worker processes. Further
+    keyword arguments, e.g. max_steps, formation, engine or antithetic, are 
+    passed on to all simulations. 
+
+    Every simulation gets its own rng_stream from the root seed and its 
+    replicate index. With common_random_numbers=True, replicate k of every
+    combination uses the same stream, which reduces the variance of 
+    differences between combinations; otherwise, all simulations use 
+    independent streams.
+
+    Arguments: lists of [blue, red] pairs for strength, range, speed and 
+    accuracy, the number of replicates per combination, the number of 
+    worker processes (defaults to the number of processors), the root seed
+    Returns: a generator of (scenario, results) tuples, where scenario is 
+    a dict of the parameters passed to run_simulation(), including seed and
+    replicate. Results are yielded as soon as each simulation has finished,
+    so not in order. At most two simulations per worker are queued at any 
+    time, so large sweeps are submitted as workers become free.
+
+    Test:
+    >>> sweep = run_sweep(strength=[[10, 10], [20, 10]], range=[[200, 200]], 
+    ...     accuracy=[[1, 1]], max_workers=2)
+    >>> sorted(scenario['strength'][0] for scenario, results in sweep)
+    [10, 20]
+    '''
+    if seed is None:
+        seed = getrandbits(64)
+    scenarios = [dict(kwargs, strength=values[0], range=values[1], speed=values[2], 
+        accuracy=values[3], output='return', seed=seed) 
+        for values in product(strength, range, speed, accuracy)]
+
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    workers = max_workers or os.cpu_count() or 1
+    try:
+        pending = {}
+        for number, scenario in enumerate(scenarios):
+            if common_random_numbers:
+                first = 0
+            else:
+                # Keep antithetic pairs within one combination
+                first = number*(replicates + replicates % 2)
+            for replicate, task in enumerate([scenario]*replicates, first):
+                task = dict(task, replicate=replicate)
+                pending[executor.submit(run_simulation, **task)] = task
+                if len(pending) >= 2*workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield pending.pop(future), future.result()
+        for future in as_completed(pending):
+            yield pending[future], future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def run_fork_batch(snapshot, seed, replicates):
+    '''
+    Runs forks of a snapshot to their end, see run_forks().
+
+    Arguments: the snapshot, the root seed or None, a list of replicate 
+    indices
+    Returns: a list of (replicate, results) tuples
+    '''
+    battle = restore(snapshot)
+    return [(replicate, battle.fork(replicate, seed).run()) for replicate in replicates]
+
+
+def run_forks(snapshot, n_replicates=1000, seed=None, max_workers=None, batch_size=100):
+    '''
+    Version: 0.1
+
+    Runs n_replicates forks of a simulation snapshot to their end on a 
+    pool of worker processes, see simulation.fork(). All forks share the
+    steps before the snapshot, e.g. a deterministic approach phase, which
+    is thus simulated only once. Fork k uses the rng_stream given by seed
+    and k; without a seed, one is derived from the snapshot, so the forks 
+    of a snapshot are reproducible.
+
+    Arguments: the snapshot as bytes or file path, the number of forks, 
+    optionally the root seed, the number of worker processes (defaults to
+    the number of processors) and the number of forks per task
+    Returns: a generator of (replicate, results) tuples, yielded as soon 
+    as each batch of forks has finished, so not in order. At most two 
+    batches per worker are queued at any time.
+
+    Test:
+    >>> battle = simulation(strength=[10, 10], range=[200, 200], seed=1)
+    >>> battle.step()
+    >>> forks = run_forks(battle.snapshot(), 4, max_workers=2, batch_size=2)
+    >>> sorted(replicate for replicate, results in forks)
+    [0, 1, 2, 3]
+    '''
+    if isinstance(snapshot, (str, os.PathLike)):
+        with open(snapshot, 'rb') as file:
+            snapshot = file.read()
+    batches = [list(range(start, min(start + batch_size, n_replicates)))
+        for start in range(0, n_replicates, batch_size)]
+
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    workers = max_workers or os.cpu_count() or 1
+    try:
+        pending = set()
+        for batch in batches:
+            pending.add(executor.submit(run_fork_batch, snapshot, seed, batch))
+            if len(pending) >= 2*workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        for future in as_completed(pending):
+            yield from future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def lanchester_step(blue, red, value, type='square'):
+    '''
+    Version: 0.1
+
+    A single step of the deterministic Lanchester difference equations. 
+    The blue force is reduced first, the red force then fires with the 
+    remaining blue strength. With type='square' (aimed fire), each side 
+    loses the enemy strength times the enemy coefficient, with 
+    type='linear' (unaimed fire), the product of both strengths times the
+    enemy coefficient. Works on numbers as well as on numpy arrays.
+
+    Arguments: blue and red strength, list of the coefficients of both 
+    forces, type of the model
+    Returns: the new blue and red strength, possibly below zero
+
+    Test:
+    >>> lanchester_step(10, 5, [0.1, 0.2])
+    (9.0, 4.1)
+    >>> lanchester_step(10, 5, [0.01, 0.02], type='linear')
+    (9.0, 4.55)
+    '''
+    if type == 'square':
+        blue = blue - red*value[1]
+        red = red - blue*value[0]
+    elif type == 'linear':
+        blue = blue - blue*red*value[1]
+        red = red - red*blue*value[0]
+    else:
+        raise ValueError('Unknown type of deterministic attrition model: '+str(type)+
+            ', specify as either \'square\' or \'linear\'')
+    return blue, red
+
+
+def lanchester_steps(max_steps=max_steps, strength=Strength, value=Accuracy, type='square'):
+    '''
+    Version: 0.1
+
+    Vectorized version of run_lanchester() for many scenarios at once. 
+    Strengths and coefficients may be numbers or numpy arrays of any 
+    broadcastable shape, each element being a scenario. All scenarios are
+    advanced together with lanchester_step(), until one of the forces is 
+    down or max_steps is reached; finished scenarios keep their final 
+    strengths, clipped at zero, in the following steps.
+
+    Arguments: max_steps, list of the initial strengths and list of the 
+    coefficients of both forces, type of the model, see lanchester_step()
+    Returns: an int array with the number of steps of each scenario, and 
+    two float arrays with the strength history of each force, with the 
+    step as first dimension and the initial strength in step 0
+
+    Test:
+    >>> steps, blue, red = lanchester_steps(strength=[10, np.array([5, 10])], 
+    ...     value=[0.05, 0.05])
+    >>> steps.tolist()
+    [12, 45]
+    >>> blue[-1].round(2).tolist(), red[-1].round(2).tolist()
+    ([8.51, 0.0], [0.0, 2.24])
+    '''
+    if np is None:
+        raise ImportError('Vectorized Lanchester models require numpy to be installed.')
+    blue, red, blue_value, red_value = [np.array(element, dtype=float) for element in 
+        np.broadcast_arrays(strength[0], strength[1], value[0], value[1])]
+    steps = np.zeros(blue.shape, dtype=np.int64)
+    blue_history = np.empty((max_steps + 1,) + blue.shape)
+    red_history = np.empty((max_steps + 1,) + red.shape)
+    blue_history[0] = blue
+    red_history[0] = red
+
+    running = (blue > 0) & (red > 0)
+    for step in range(1, max_steps + 1):
+        if not running.any():
+            blue_history[step:] = blue
+            red_history[step:] = red
+            break
+        new_blue, new_red = lanchester_step(blue, red, [blue_value, red_value], type)
+        blue = np.where(running, np.maximum(new_blue, 0), blue)
+        red = np.where(running, np.maximum(new_red, 0), red)
+        steps += running
+        running &= (blue > 0) & (red > 0)
+        blue_history[step] = blue
+        red_history[step] = red
+
+    return steps, blue_history, red_history
+
+
+def lanchester_solution(strength=Strength, value=Accuracy, type='square', remaining=0):
+    '''
+    Version: 0.1
+
+    Closed-form solution of the continuous Lanchester equations, with 
+    dB/dt = -b*R and dR/dt = -a*B for type='square', dB/dt = -b*B*R and
+    dR/dt = -a*B*R for type='linear', where B and R are the strengths and 
+    a and b the positive coefficients of the blue and red force. 
+    The force with the larger fighting strength, a*B**2 vs. b*R**2 under 
+    the square law and a*B vs. b*R under the linear law, wins. The 
+    solution ends when the losing force is reduced to the given remaining
+    strength. Under the linear law, and in a draw, forces never reach zero,
+    so the time to annihilation is inf. Strengths and coefficients may be 
+    numbers or numpy arrays of any broadcastable shape.
+
+    Arguments: list of the initial strengths and list of the coefficients 
+    of both forces, type of the model, remaining strength of the loser, 
+    smaller than both initial strengths
+    Returns: float arrays with the time until the loser is reduced to the
+    remaining strength, and the blue and red strength at that time
+
+    Test:
+    >>> time, blue, red = lanchester_solution([10, 5], [0.05, 0.05])
+    >>> round(float(time), 3), round(float(blue), 3), float(red)
+    (10.986, 8.66, 0.0)
+    >>> time, blue, red = lanchester_solution([10, 5], [0.01, 0.01], type='linear', remaining=1)
+    >>> round(float(time), 3), float(blue), float(red)
+    (21.972, 6.0, 1.0)
+    '''
+    if np is None:
+        raise ImportError('Vectorized Lanchester models require numpy to be installed.')
+    blue, red, a, b, remaining = [np.array(element, dtype=float) for element in 
+        np.broadcast_arrays(strength[0], strength[1], value[0], value[1], remaining)]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # In a draw, both forces shrink in proportion
+        fraction = remaining / np.minimum(blue, red)
+        if type == 'square':
+            advantage = a*blue**2 - b*red**2
+            blue_end = np.where(advantage > 0, np.sqrt((advantage + b*remaining**2) / a), 
+                np.where(advantage < 0, remaining, blue*fraction))
+            red_end = np.where(advantage < 0, np.sqrt((a*remaining**2 - advantage) / b), 
+                np.where(advantage > 0, remaining, red*fraction))
+            time = np.log((np.sqrt(a)*blue + np.sqrt(b)*red) / 
+                (np.sqrt(a)*blue_end + np.sqrt(b)*red_end)) / np.sqrt(a*b)
+        elif type == 'linear':
+            advantage = a*blue - b*red
+            blue_end = np.where(advantage > 0, (advantage + b*remaining) / a, 
+                np.where(advantage < 0, remaining, blue*fraction))
+            red_end = np.where(advantage < 0, (a*remaining - advantage) / b, 
+                np.where(advantage > 0, remaining, red*fraction))
+            time = np.where(advantage != 0, 
+                np.log(red*blue_end / (red_end*blue)) / advantage,
+                (1/np.minimum(blue, red)/fraction - 1/np.minimum(blue, red)) / 
+                    np.where(red <= blue, b, a))
+        else:
+            raise ValueError('Unknown type of deterministic attrition model: '+str(type)+
+                ', specify as either \'square\' or \'linear\'')
+
+    return time, blue_end, red_end
+
+
+def fit_lanchester(results, type='square'):
+    '''
+    Version: 0.1
+
+    Fits effective Lanchester coefficients to the output of the stochastic
+    simulation, so that lanchester_step() reproduces the mean strength 
+    history as closely as possible. The coefficients are least squares 
+    estimates of the losses per step, regressed on the enemy strength 
+    (square law) or the product of both strengths (linear law). Steps 
+    before the first casualty, i.e. the approach phase, and after one of 
+    the forces is down are left out. Experiments have to be recorded with
+    record='full', since the losses are taken per step.
+
+    Arguments: an experiment as returned by run_simulation(), a list of 
+    experiments of the same scenario, or an ensemble as returned by 
+    run_ensemble(), and the type of the model
+    Returns: a list with the coefficients of both forces, to be passed as
+    value to run_lanchester()
+
+    Test:
+    >>> steps, blue, red = lanchester_steps(strength=[50, 40], value=[0.02, 0.03])
+    >>> results = experiment(strength=[50, 40])
+    >>> results.blue, results.red = blue[1:].tolist(), red[1:].tolist()
+    >>> [round(value, 4) for value in fit_lanchester(results)]
+    [0.02, 0.03]
+    >>> fit_lanchester(run_simulation(seed=1, record=5))
+    Traceback (most recent call last):
+    ...
+    ValueError: Fitting Lanchester models requires the strengths after every step, recorded with record='full'.
+    '''
+    if np is None:
+        raise ImportError('Fitting Lanchester models requires numpy to be installed.')
+    if isinstance(results, experiment):
+        results = [results]
+    if isinstance(results, ensemble):
+        strength = results.strength
+        blue, red = results.mean()
+    else:
+        if any(element.every != 1 for element in results):
+            raise ValueError('Fitting Lanchester models requires the strengths after every '
+                'step, recorded with record=\'full\'.')
+        strength = results[0].strength
+        steps = max(len(element.blue) for element in results)
+        blue = np.mean([element.blue + element.blue[-1:]*(steps - len(element.blue)) 
+            for element in results], axis=0)
+        red = np.mean([element.red + element.red[-1:]*(steps - len(element.red)) 
+            for element in results], axis=0)
+    blue = np.concatenate([[strength[0]], blue])
+    red = np.concatenate([[strength[1]], red])
+
+    fighting = (blue[:-1] > 0) & (red[:-1] > 0)
+    losses = (blue[1:] < blue[:-1]) | (red[1:] < red[:-1])
+    if not losses.any():
+        raise ValueError('No casualties to fit the model to.')
+    fighting[:np.argmax(losses)] = False
+
+    blue_loss = (blue[:-1] - blue[1:])[fighting]
+    red_loss = (red[:-1] - red[1:])[fighting]
+    if type == 'square':
+        blue_factor = red[:-1][fighting]
+        red_factor = blue[1:][fighting]
+    elif type == 'linear':
+        blue_factor = (blue[:-1]*red[:-1])[fighting]
+        red_factor = (red[:-1]*blue[1:])[fighting]
+    else:
+        raise ValueError('Unknown type of deterministic attrition model: '+str(type)+
+            ', specify as either \'square\' or \'linear\'')
+
+    return [float(red_loss @ red_factor / (red_factor @ red_factor)), 
+        float(blue_loss @ blue_factor / (blue_factor @ blue_factor))]
+
+
+def run_lanchester(max_steps=max_steps, strength=Strength, value=Accuracy, 
+                type='square', output='return'):
+    '''
+    Version 0.2
+    Authors: Steffen Pielström
+
+    Returns results of a simple Lanchester-law calculation, stepping the 
+    difference equations of the square or linear law, see 
+    lanchester_step(). For many scenarios at once, see lanchester_steps(),
+    for the continuous solution lanchester_solution().
+
+    Test:
+    >>> results = run_lanchester(strength=[10, 5], value=[0.05, 0.05])
+    >>> results.steps, round(results.blue[-1], 2), results.red[-1]
+    (12, 8.51, 0.0)
+    '''
+    if type not in ('square', 'linear'):
+        raise ValueError('Unknown type of deterministic attrition model: '+str(type)+
+            ', specify as either \'square\' or \'linear\'')
+
     results = experiment()
 
     results.accuracy = value
     results.strength = strength
     results.range = ['infinite', 'infinite']
     results.speed =[0, 0]
-    results.blue = [strength[0]]
-    results.red = [strength[1]]
+    blue = [strength[0]]
+    red = [strength[1]]
 
     # Initialize loop conditions
     steps = 0
@@ -516,28 +4451,25 @@ def run_lanchester(max_steps=max_steps, strength=Strength, value=Accuracy,
     # Main loop
     while conditions == True:
 
-        if type == 'square':
-            results.blue.append(results.blue[-1]-results.red[-1]*value[1])
-            results.red.append(results.red[-1]-results.blue[-1]*value[0])
-        
-        elif type == 'linear':
-            print('Not yet implemented.')
-
-        else:
-            print('Unknown/unimplemented type of deterministic attrition model.')
+        blue_step, red_step = lanchester_step(blue[-1], red[-1], value, type)
+        blue.append(blue_step)
+        red.append(red_step)
                
         steps += 1
 
         conditions = (
-            results.blue[-1] > 0 
-            and results.red[-1] > 0 
+            blue[-1] > 0 
+            and red[-1] > 0 
             and steps < max_steps
             )
 
-    if results.blue[-1]<0:
-        results.blue[-1] = 0
-    if results.red[-1]<0:
-        results.red[-1] = 0
+    if blue[-1]<0:
+        blue[-1] = 0
+    if red[-1]<0:
+        red[-1] = 0
+    results.blue = blue
+    results.red = red
+    results.steps = steps
 
     # Handle results
     if output == 'return':
@@ -558,5 +4490,3 @@ python AttritionSim.py -v
 if __name__ == "__main__":#
     import doctest
     doctest.testmod()
-
-run_simulation()
\ No newline at end of file
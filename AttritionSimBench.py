@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+'''
+Version: 0.1
+Authors: Steffen Pielström
+Dependencies: AttritionSim.py v0.3, config.py v0.2, argparse, json, sys,
+platform, random, time, tracemalloc
+
+Benchmark suite for the hot paths of AttritionSim. It times
+unit.find_target(), unit.move(), force.kill_hit_units(), update_forces(),
+run_simulation() and run_lanchester() at a range of strengths per side,
+and update_forces() in contact with and without line of sight checks,
+with fixed seeds, and reports the best time per operation, the items
+(units, calls or steps) processed per second and the peak memory traced
+during one operation.
+
+Results are written as JSON to a baseline file:
+$ python AttritionSimBench.py run --output baseline.json
+A later run is compared against the baseline with
+$ python AttritionSimBench.py compare baseline.json current.json --tolerance 0.2
+which lists the changes and exits with status 1 if any benchmark got
+slower, or needed more memory, by more than the tolerance. Without a second
+file, compare runs the suite first.
+
+Searches use the 'grid' targeting method by default, as 'brute' grows
+with the square of the strength and is impractical at 100k units per side.
+'''
+
+# Imports
+# --------------------------------------------------------------------
+
+import argparse
+import json
+import sys
+import platform
+import tracemalloc
+from random import Random
+from random import seed as seed_random
+from time import perf_counter
+
+import AttritionSim as sim
+
+
+# Variables
+# --------------------------------------------------------------------
+
+# Strengths per side, calls of find_target() per operation, steps of
+# update_forces() and maximum steps of run_simulation() per operation
+strengths = [10, 100, 1000, 10000, 100000]
+sample_size: int = 100
+update_steps: int = 2
+simulation_steps: int = 20
+
+# Each operation is repeated until min_time seconds have passed in total,
+# at most max_repeats times
+min_time: float = 1.0
+max_repeats: int = 20
+
+
+# Benchmarks
+# --------------------------------------------------------------------
+# Each benchmark takes the strength per side, a seed and the options of the
+# run, and returns an operation: a function without arguments, which runs
+# the timed code and returns the number of items it processed. The setup
+# before is not timed.
+
+def forces(strength, seed, targets=False):
+    '''
+    Arguments: the strength per side, a seed, whether to aim every blue
+    unit at the red unit at the same index
+    Returns: two initialized forces of the python engine
+    '''
+    seed_random(seed)
+    blue_force = sim.force(0, 'blue', strength=strength)
+    red_force = sim.force(1, 'red', strength=strength)
+    blue_force.initialize_units()
+    red_force.initialize_units()
+    if targets:
+        for index, element in enumerate(blue_force.units):
+            target = red_force.units[index]
+            element.target_index = index
+            element.target_pos = target.pos
+            element.target_dist = element.calculate_distance(target)
+    return blue_force, red_force
+
+
+def bench_find_target(strength, seed, options):
+    '''
+    Times find_target() for a sample of blue units against the red force.
+    '''
+    blue_force, red_force = forces(strength, seed)
+    index = None
+    if options['targeting'] == 'grid':
+        index = sim.spatial_grid([element.pos for element in red_force.units])
+    sample = blue_force.units[:sample_size]
+    def operation():
+        for element in sample:
+            element.find_target(red_force.units, index)
+        return len(sample)
+    return operation
+
+
+def bench_move(strength, seed, options):
+    '''
+    Times one move() of all blue units.
+    '''
+    blue_force, red_force = forces(strength, seed, targets=True)
+    def operation():
+        for element in blue_force.units:
+            element.move()
+        return len(blue_force.units)
+    return operation
+
+
+def bench_kill_hit_units(strength, seed, options):
+    '''
+    Times kill_hit_units() with a tenth of the units hit.
+    '''
+    blue_force, red_force = forces(strength, seed)
+    generator = Random(seed)
+    for element in blue_force.units:
+        element.is_hit = generator.random() < 0.1
+    def operation():
+        count = len(blue_force.units)
+        blue_force.kill_hit_units()
+        return count
+    return operation
+
+
+def bench_update_forces(strength, seed, options):
+    '''
+    Times the first update_steps steps of a battle.
+    '''
+    blue_force, red_force = forces(strength, seed)
+    rng = sim.rng_stream(seed)
+    def operation():
+        for _ in range(update_steps):
+            sim.update_forces(blue_force, red_force, targeting=options['targeting'], rng=rng)
+        return update_steps
+    return operation
+
+
+def bench_update_contact(strength, seed, options, line_of_sight=False):
+    '''
+    Times update_steps steps of two forces in two lines each, all units in
+    range of each other from the start.
+    '''
+    seed_random(seed)
+    blue_force = sim.force(0, 'blue', strength=strength, range=200, formation='two lines')
+    red_force = sim.force(1, 'red', strength=strength, range=200, formation='two lines')
+    blue_force.initialize_units()
+    red_force.initialize_units()
+    rng = sim.rng_stream(seed)
+    def operation():
+        for _ in range(update_steps):
+            sim.update_forces(blue_force, red_force, targeting=options['targeting'], rng=rng,
+                line_of_sight=line_of_sight)
+        return update_steps
+    return operation
+
+
+def bench_update_contact_sight(strength, seed, options):
+    '''
+    Times the steps of bench_update_contact() with line of sight checked.
+    '''
+    return bench_update_contact(strength, seed, options, line_of_sight=True)
+
+
+def bench_run_simulation(strength, seed, options):
+    '''
+    Times a battle of at most simulation_steps steps.
+    '''
+    def operation():
+        results = sim.run_simulation(max_steps=simulation_steps,
+            strength=[strength, strength], engine=options['engine'],
+            targeting=options['targeting'], seed=seed)
+        return results.steps
+    return operation
+
+
+def bench_run_lanchester(strength, seed, options):
+    '''
+    Times a Lanchester calculation until one side is eliminated.
+    '''
+    def operation():
+        return sim.run_lanchester(strength=[strength, strength*0.9]).steps
+    return operation
+
+
+benchmarks = {
+    'find_target': bench_find_target,
+    'move': bench_move,
+    'kill_hit_units': bench_kill_hit_units,
+    'update_forces': bench_update_forces,
+    'update_contact': bench_update_contact,
+    'update_contact_sight': bench_update_contact_sight,
+    'run_simulation': bench_run_simulation,
+    'run_lanchester': bench_run_lanchester,
+    }
+
+
+# Functions
+# --------------------------------------------------------------------
+
+def measure(benchmark, strength, seed=1, options=None, memory=True):
+    '''
+    Times a benchmark at one strength. Every repetition gets a fresh setup
+    with the same seed, the best time counts. The peak memory is traced in
+    an extra, untimed repetition.
+
+    Arguments: the name of a benchmark, the strength per side, the seed,
+    a dict with 'engine' and 'targeting', whether to trace memory
+    Returns: a dict with the benchmark, strength, best seconds per
+    operation, items per operation, items per second, repetitions and
+    peak memory in bytes (None if not traced)
+
+    Test:
+    >>> result = measure('run_lanchester', 10, memory=False)
+    >>> result['benchmark'], result['strength'], result['items']
+    ('run_lanchester', 10, 32)
+    '''
+    if options is None:
+        options = {'engine': 'python', 'targeting': 'grid'}
+    setup = benchmarks[benchmark]
+    times = []
+    while not times or (sum(times) < min_time and len(times) < max_repeats):
+        operation = setup(strength, seed, options)
+        start = perf_counter()
+        items = operation()
+        times.append(perf_counter() - start)
+
+    peak = None
+    if memory:
+        operation = setup(strength, seed, options)
+        tracemalloc.start()
+        operation()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    seconds = min(times)
+    return {
+        'benchmark': benchmark,
+        'strength': strength,
+        'seconds': seconds,
+        'items': items,
+        'per_second': items/seconds if seconds > 0 else None,
+        'repeats': len(times),
+        'peak_memory': peak,
+        }
+
+
+def run_suite(names=None, strengths=strengths, seed=1, engine='python', targeting='grid',
+    memory=True, log=sys.stderr):
+    '''
+    Runs benchmarks at all strengths.
+
+    Arguments: the names of the benchmarks, default all, the strengths per
+    side, the seed, engine and targeting method, whether to trace memory,
+    a file to report progress to, or None
+    Returns: a dict with the settings under 'meta' and a list of the
+    results of measure() under 'results'
+    '''
+    if names is None:
+        names = list(benchmarks)
+    unknown = [name for name in names if name not in benchmarks]
+    if unknown:
+        raise ValueError('Unknown benchmark: '+', '.join(unknown))
+
+    options = {'engine': engine, 'targeting': targeting}
+    suite = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': sim.np.__version__ if sim.np is not None else None,
+            'seed': seed,
+            'engine': engine,
+            'targeting': targeting,
+            },
+        'results': [],
+        }
+    for name in names:
+        for strength in strengths:
+            result = measure(name, strength, seed, options, memory)
+            suite['results'].append(result)
+            if log is not None:
+                log.write(format_result(result)+'\n')
+                log.flush()
+    return suite
+
+
+def format_result(result):
+    '''
+    Returns: a line of text for the result of a benchmark
+
+    Test:
+    >>> format_result({'benchmark': 'move', 'strength': 10, 'seconds': 0.002,
+    ...     'items': 10, 'per_second': 5000.0, 'repeats': 3, 'peak_memory': 2048})
+    'move                  10     2.000 ms        5000.0/s       2.0 KiB'
+    '''
+    line = '{:<16}{:>8}{:>10.3f} ms{:>14.1f}/s'.format(result['benchmark'],
+        result['strength'], result['seconds']*1000, result['per_second'] or 0)
+    if result['peak_memory'] is not None:
+        line += '{:>10.1f} KiB'.format(result['peak_memory']/1024)
+    return line
+
+
+def compare(baseline, current, tolerance=0.1):
+    '''
+    Compares two benchmark runs. A benchmark regressed if its time per
+    item, or its peak memory, grew by more than the tolerance, a fraction
+    of the baseline value. Benchmarks missing in either run are skipped.
+
+    Arguments: the baseline and the current run as returned by run_suite(),
+    the tolerance
+    Returns: a list of (benchmark, strength, time ratio, memory ratio,
+    regressed) tuples, ratios are current/baseline, memory ratio None if
+    memory was not traced in both runs
+
+    Test:
+    >>> baseline = {'results': [{'benchmark': 'move', 'strength': 10,
+    ...     'seconds': 1.0, 'items': 10, 'peak_memory': None}]}
+    >>> current = {'results': [{'benchmark': 'move', 'strength': 10,
+    ...     'seconds': 1.5, 'items': 10, 'peak_memory': None}]}
+    >>> compare(baseline, current, tolerance=0.2)
+    [('move', 10, 1.5, None, True)]
+    >>> compare(baseline, current, tolerance=0.6)[0][-1]
+    False
+    '''
+    reference = {(result['benchmark'], result['strength']): result
+        for result in baseline['results']}
+    changes = []
+    for result in current['results']:
+        key = (result['benchmark'], result['strength'])
+        if key not in reference:
+            continue
+        old = reference[key]
+        time_ratio = result['seconds']*old['items']/(old['seconds']*result['items'])
+        memory_ratio = None
+        if result['peak_memory'] is not None and old['peak_memory']:
+            memory_ratio = result['peak_memory']/old['peak_memory']
+        regressed = (time_ratio > 1 + tolerance
+            or (memory_ratio is not None and memory_ratio > 1 + tolerance))
+        changes.append((result['benchmark'], result['strength'], time_ratio,
+            memory_ratio, regressed))
+    return changes
+
+
+# Parse arguments
+# --------------------------------------------------------------------
+
+description = 'Benchmarks for the hot paths of AttritionSim.'
+
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('command', choices=['run', 'compare'],
+    help='\'run\' runs the suite, \'compare\' compares a run with a baseline')
+parser.add_argument('files', nargs='*',
+    help='With compare: the baseline file and optionally the file of the current run, '
+    'which is otherwise run first')
+parser.add_argument('--output', default=None,
+    help='File to write the results of a run to as JSON. Default: stdout')
+parser.add_argument('--benchmarks', nargs='+', default=list(benchmarks),
+    help='Benchmarks to run. Default: all')
+parser.add_argument('--strengths', nargs='+', type=int, default=strengths,
+    help='Strengths per side. Default: 10 100 1000 10000 100000')
+parser.add_argument('--seed', type=int, default=1,
+    help='Seed of all random numbers. Default: 1')
+parser.add_argument('--engine', default='python',
+    help='Engine of run_simulation, either \'python\' or \'numpy\'. Default: python')
+parser.add_argument('--targeting', default='grid',
+    help='Targeting method, either \'brute\' or \'grid\'. Default: grid')
+parser.add_argument('--tolerance', type=float, default=0.1,
+    help='Allowed relative slowdown before compare reports a regression. Default: 0.1')
+parser.add_argument('--no_memory', action='store_true',
+    help='Do not trace the peak memory, which saves a repetition per benchmark')
+
+
+def main(argv=None):
+    '''
+    Runs the benchmark CLI with the given command line arguments, or those
+    of the current process.
+    Returns: the exit status, 1 if compare found a regression
+    '''
+    args = parser.parse_args(argv)
+
+    current = None
+    if args.command == 'compare':
+        if len(args.files) not in (1, 2):
+            parser.error('compare takes a baseline file and optionally a current file')
+        with open(args.files[0]) as file:
+            baseline = json.load(file)
+        if len(args.files) == 2:
+            with open(args.files[1]) as file:
+                current = json.load(file)
+
+    if current is None:
+        current = run_suite(args.benchmarks, args.strengths, args.seed, args.engine,
+            args.targeting, not args.no_memory)
+        if args.output is not None:
+            with open(args.output, 'w') as file:
+                json.dump(current, file, indent=1)
+        elif args.command == 'run':
+            json.dump(current, sys.stdout, indent=1)
+            sys.stdout.write('\n')
+
+    if args.command == 'run':
+        return 0
+
+    regressions = 0
+    for name, strength, time_ratio, memory_ratio, regressed in compare(baseline, current,
+        args.tolerance):
+        line = '{:<16}{:>8}  time {:>6.2f}x'.format(name, strength, time_ratio)
+        if memory_ratio is not None:
+            line += '  memory {:>6.2f}x'.format(memory_ratio)
+        if regressed:
+            line += '  REGRESSION'
+            regressions += 1
+        print(line)
+    print(str(regressions)+' regression(s) beyond a tolerance of '+str(args.tolerance))
+    return 1 if regressions else 0
+
+
+# Main
+# --------------------------------------------------------------------
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,31 @@
 #!/usr/bin/env python3
 '''
-Version: 0.1
+Version: 0.2
 Authors: Steffen Pielström
-Dependencies: AttritionSim.py v0.3, config.py v0.2, argparse
+Dependencies: AttritionSim.py v0.3, config.py v0.2, argparse, json, sys,
+concurrent.futures
 
-This is the code base for turning AttritionSim into a CLI application 
+This is the code base for turning AttritionSim into a CLI application
 based on pyinstaller.
+
+Besides running a single simulation with parameters from the command line,
+the CLI has a batch mode for pipelines: with --batch, it reads one scenario
+per line as a JSON object from a file or stdin, runs all of them in one
+process (or a pool of --workers processes) and writes one JSON result per
+line as soon as each simulation has finished.
 '''
 
 # Imports
 # --------------------------------------------------------------------
 
 import argparse
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+from concurrent.futures import as_completed
+from multiprocessing import freeze_support
 
 from config import max_steps
 
@@ -33,23 +47,23 @@ description = ' '
 
 parser = argparse.ArgumentParser(description=description)
 
-parser.add_argument('--max_steps', default=max_steps, 
+parser.add_argument('--max_steps', default=max_steps,
     help='Maximum number of simulation steps. Default: 100')
-parser.add_argument('--output', default='result', 
+parser.add_argument('--output', default='result',
     help='Output format, either \'result\' or \'full\'')
-parser.add_argument('--name_blue', default=Name[0], 
+parser.add_argument('--name_blue', default=Name[0],
     help='Displayed name og the first force.')
-parser.add_argument('--name_red', default=Name[1], 
+parser.add_argument('--name_red', default=Name[1],
     help='Displayed name of the second foce.')
-parser.add_argument('--strength_blue', default=Strength[0], 
+parser.add_argument('--strength_blue', default=Strength[0],
     help='Numerical strength of the first force. Default: 10')
 parser.add_argument('--strength_red', default=Strength[1],
      help='Numerical strength of the second force. Default: 10')
-parser.add_argument('--range_blue', default=Range[0], 
+parser.add_argument('--range_blue', default=Range[0],
     help='Firing range of the first force. Default: 50')
-parser.add_argument('--range_red', default=Range[1], 
+parser.add_argument('--range_red', default=Range[1],
     help='Firing range of the second force. Default: 50')
-parser.add_argument('--speed_blue', default=Speed[0], 
+parser.add_argument('--speed_blue', default=Speed[0],
     help='Speed of the first force in distance units per simulation step. Default: 1')
 parser.add_argument('--speed_red', default=Speed[1],
     help='Speed of the second force in distance units per simulation step. Default: 1')
@@ -58,22 +72,257 @@ parser.add_argument('--accuracy_blue', default=Accuracy[0],
 parser.add_argument('--accuracy_red', default=Accuracy[1],
     help='Red unit\'s probability to kill an enemy unit per simulation step, number between 0 and 1. Default: 0.05')
 parser.add_argument('--formation_blue', default=Formation[0],
-    help='Formation of the first force, currently only \'one line\' is implemented.')
+    help='Formation of the first force, \'one line\', \'two lines\', \'scattered\', '
+    '\'grid\' or \'column\'. Default: one line')
 parser.add_argument('--formation_red', default=Formation[1],
-    help='Formation of the second force, currently only \'one line\' is implemented.')
+    help='Formation of the second force, \'one line\', \'two lines\', \'scattered\', '
+    '\'grid\' or \'column\'. Default: one line')
+parser.add_argument('--engine', default='python',
+    help='Simulation engine, either \'python\' or \'numpy\' (requires numpy). Default: python')
+parser.add_argument('--targeting', default='brute',
+    help='Targeting method, either \'brute\' or \'grid\' (faster for large forces). Default: brute')
+parser.add_argument('--line_of_sight', action='store_true',
+    help='Units cannot hit enemy units behind other units. Default: off')
+parser.add_argument('--compact', action='store_true',
+    help='Store units as float32 and int32 arrays to halve their memory (numpy engine only). '
+    'Default: off')
+parser.add_argument('--seed', default=None,
+    help='Root seed of the random number stream. Default: random')
+parser.add_argument('--replicate', default=0,
+    help='Replicate index, selects the random number stream for the seed. Default: 0')
+parser.add_argument('--trajectory', default=None,
+    help='File to record the positions, targets and hits of all units in every step to, '
+    'for replay in the GUI (requires numpy). Default: no recording')
+parser.add_argument('--checkpoint', default=None,
+    help='File to write a snapshot of the simulation to every checkpoint_every steps '
+    '(config.py), deleted at the end. If the file exists, the simulation is resumed from '
+    'it. Default: none')
+parser.add_argument('--batch', nargs='?', const='-', default=None,
+    help='Batch mode: read one scenario per line as a JSON object with the options above '
+    'as fields (without the leading dashes; an \'id\' field is passed through) from the '
+    'given file, or from stdin if no file is given, and write one JSON result per line.')
+parser.add_argument('--workers', default=1,
+    help='Number of worker processes in batch mode. Default: 1')
+parser.add_argument('--memory', action='store_true',
+    help='Print the estimated peak memory of the simulation and exit without running it.')
+
+# Fields of a batch scenario record, i.e. all options except the batch options
+fields = [name for name in vars(parser.parse_args([]))
+    if name not in ('batch', 'workers', 'memory')]
+
+
+# Functions
+# --------------------------------------------------------------------
+
+def arguments(options):
+    '''
+    Converts a dict of option values, as strings or numbers, into the
+    keyword arguments of run_simulation().
+
+    Test:
+    >>> arguments(defaults(strength_red=5))['strength']
+    [10, 5]
+    '''
+    if options['seed'] is None:
+        seed = None
+    else:
+        seed = int(options['seed'])
+    return dict(
+        max_steps=int(options['max_steps']),
+        output=options['output'],
+        name=[options['name_blue'], options['name_red']],
+        strength=[int(options['strength_blue']), int(options['strength_red'])],
+        range=[float(options['range_blue']), float(options['range_red'])],
+        speed=[float(options['speed_blue']), float(options['speed_red'])],
+        accuracy=[float(options['accuracy_blue']), float(options['accuracy_red'])],
+        formation=[options['formation_blue'], options['formation_red']],
+        engine=options['engine'],
+        targeting=options['targeting'],
+        line_of_sight=options['line_of_sight'] in (True, 'true', 'True', '1', 1),
+        compact=options['compact'] in (True, 'true', 'True', '1', 1),
+        seed=seed,
+        replicate=int(options['replicate']),
+        trajectory=options['trajectory'],
+        checkpoint=options['checkpoint']
+        )
+
+
+def defaults(**options):
+    '''
+    Returns: a dict of the default values of all scenario fields, updated
+    with the given options
+    '''
+    values = {name: parser.get_default(name) for name in fields}
+    values.update(options)
+    return values
+
+
+def run_record(record):
+    '''
+    Runs the simulation for a single batch scenario record.
+
+    Arguments: a dict with scenario fields and optionally an 'id'
+    Returns: a dict with the id, the outcome, number of steps and final
+    strengths, seed and replicate; with output 'full' also the strength
+    of both forces in each step; in case of an invalid record or a failed
+    simulation an 'error'
+
+    Test:
+    >>> result = run_record({'id': 1, 'strength_red': 1, 'accuracy_blue': 1,
+    ...     'range_blue': 200, 'seed': 3})
+    >>> result['result'], result['steps'], result['blue'], result['red']
+    ('Blue victory', 1, 10, 0)
+    >>> run_record({'strenght_red': 5})['error']
+    'unknown field: strenght_red'
+    >>> run_record({'id': 2, 'trajectory': '/nonexistent/dir/x.trj'})['error'].split(':')[0]
+    'FileNotFoundError'
+    '''
+    record = dict(record)
+    result = {'id': record.pop('id', None)}
+    try:
+        unknown = [name for name in record if name not in fields]
+        if unknown:
+            raise ValueError('unknown field: '+', '.join(unknown))
+        options = arguments(defaults(**record))
+        full = options['output'] == 'full'
+        options['output'] = 'return'
+        results = sim.run_simulation(**options)
+    except (ValueError, TypeError, KeyError) as error:
+        result['error'] = str(error)
+        return result
+    except Exception as error:
+        # Any other failure, e.g. an unwritable file, only ends this record
+        result['error'] = type(error).__name__+': '+str(error)
+        return result
+
+    result.update(result_fields(results, full))
+    return result
+
+
+def result_fields(results, full=False):
+    '''
+    Arguments: an experiment object, optionally full
+    Returns: a dict with the outcome, number of steps and final strengths,
+    seed and replicate; with full=True also the strength of both forces 
+    in each step
+    '''
+    result = {}
+    result['result'] = results.outcome()
+    result['steps'] = results.steps
+    result['blue'] = results.blue[-1]
+    result['red'] = results.red[-1]
+    result['seed'] = results.seed
+    result['replicate'] = results.replicate
+    if full:
+        result['blue_history'] = list(results.blue)
+        result['red_history'] = list(results.red)
+    return result
+
+
+def parse_line(line):
+    '''
+    Returns: the scenario record in a line of JSON
+
+    Test:
+    >>> parse_line('[1, 2]')
+    Traceback (most recent call last):
+    ...
+    ValueError: not a JSON object
+    '''
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError('not a JSON object')
+    return record
+
+
+def write(out, result):
+    '''
+    Writes a result as one line of JSON.
+    '''
+    out.write(json.dumps(result)+'\n')
+    out.flush()
+
+
+def run_batch(lines, out=sys.stdout, workers=1):
+    '''
+    Runs the scenarios of a batch and writes the results as lines of JSON.
+    Empty lines are skipped, lines that are no JSON object produce an error
+    result. With more than one worker, scenarios run on a pool of 
+    processes, at most two per worker are queued at any time, and results 
+    are written in the order they finish.
+
+    Arguments: an iterable of lines, a file to write to, number of workers
+
+    Test: warnings of the simulation go to stderr, stdout only has results
+    >>> import io, contextlib
+    >>> scenario = {'engine': 'numpy', 'compact': True, 'strength_blue': 60,
+    ...     'strength_red': 60, 'formation_blue': 'two lines', 'formation_red': 'two lines'}
+    >>> lines = [json.dumps(dict(scenario, id=i, seed=i)) for i in range(12)]
+    >>> stdout, stderr = io.StringIO(), io.StringIO()
+    >>> with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+    ...     run_batch(lines, sys.stdout)
+    >>> results = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    >>> [result['id'] for result in results] == list(range(12))
+    True
+    >>> stderr.getvalue().startswith('Warning')
+    True
+    '''
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    pending = set()
+
+    try:
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = parse_line(line)
+            except ValueError as error:
+                write(out, {'id': None, 'error': 'invalid record: '+str(error)})
+                continue
+
+            if executor is None:
+                write(out, run_record(record))
+                continue
+
+            pending.add(executor.submit(run_record, record))
+            if len(pending) >= 2*workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(out, future.result())
+
+        for future in as_completed(pending):
+            write(out, future.result())
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def main(argv=None):
+    '''
+    Runs the CLI with the given command line arguments, or those of the
+    current process.
+    '''
+    args = parser.parse_args(argv)
+
+    if args.memory:
+        options = arguments(vars(args))
+        estimate = sim.memory_estimate(options['strength'], options['engine'], 
+            options['targeting'], options['line_of_sight'], options['compact'])
+        print('estimated peak memory: '+str(round(estimate/2**20, 1))+' MiB')
+    elif args.batch is None:
+        sim.run_simulation(**arguments(vars(args)))
+    elif args.batch == '-':
+        run_batch(sys.stdin, sys.stdout, int(args.workers))
+    else:
+        with open(args.batch) as lines:
+            run_batch(lines, sys.stdout, int(args.workers))
 
-args = parser.parse_args()
 
 # Main
 # --------------------------------------------------------------------
 
-sim.run_simulation(
-    max_steps=int(args.max_steps),
-    output=args.output, 
-    name=[args.name_blue, args.name_red],
-    strength=[int(args.strength_blue), int(args.strength_red)], 
-    range=[float(args.range_blue), float(args.range_red)],
-    speed=[float(args.speed_blue), float(args.speed_red)], 
-    accuracy=[float(args.accuracy_blue), float(args.accuracy_red)],
-    formation=[args.formation_blue, args.formation_red]
-    )
+if __name__ == "__main__":
+    freeze_support()
+    main()
@@ -0,0 +1,416 @@
+'''
+Version: 0.1
+Authors: Steffen Pielström
+Dependencies: AttritionSim.py v0.3, config.py v0.2, sqlite3, json, hashlib,
+time, itertools, concurrent.futures
+
+Persistent cache for the results of AttritionSim. Results are stored in a
+local SQLite database under a content address: a hash of the parameters
+that determine the outcome of a simulation (strengths, ranges, speeds,
+accuracies, formations, max_steps, engine, line of sight, antithetic
+pairs, compact storage), the configuration values they depend on and the
+version of the simulation code. For every replicate, i.e. every run_simulation() call
+with a seed and a replicate index, the final strengths and the number of
+steps are kept, so running an ensemble of n replicates of a scenario
+computes only the replicates that are not in the cache yet, and extending
+an ensemble from 1000 to 5000 replicates computes the 4000 new ones. The
+aggregates of each ensemble are stored as well.
+
+The database uses write-ahead logging, and replicates are inserted in
+short transactions that ignore rows already present, so several processes
+can fill the same cache at once. If the cache holds more than max_entries
+replicates, those of the scenarios and seeds used least recently are
+removed.
+
+Usage:
+    cache = result_cache('cache.sqlite', workers=4)
+    summary = cache.ensemble(1000, seed=1, strength=[40, 55], accuracy=[0.07, 0.05])
+'''
+
+# Imports
+# --------------------------------------------------------------------
+
+import json
+import sqlite3
+from hashlib import sha256
+from time import time
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+import AttritionSim as sim
+from AttritionSim import canonical
+
+from config import Strength
+from config import Range
+from config import Speed
+from config import Accuracy
+
+
+# Variables
+# --------------------------------------------------------------------
+
+cache_file = 'attritionsim_cache.sqlite'
+
+# Number of replicates kept in the cache before those of the least recently
+# used scenarios and seeds are removed
+max_entries: int = 10**6
+
+# Number of replicates computed between two writes to the database
+write_batch: int = 200
+
+# Configuration values that change the results of a simulation
+config_fields = ['field_size', 'dist_border_init', 'firing_distance', 'unit_radius',
+    'sight_candidates']
+
+schema = [
+    '''CREATE TABLE IF NOT EXISTS scenarios (
+        key TEXT PRIMARY KEY, parameters TEXT NOT NULL, last_used REAL NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS replicates (
+        key TEXT NOT NULL, seed TEXT NOT NULL, replicate INTEGER NOT NULL,
+        steps INTEGER NOT NULL, blue INTEGER NOT NULL, red INTEGER NOT NULL,
+        stalemate INTEGER NOT NULL, PRIMARY KEY (key, seed, replicate)) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS seeds (
+        key TEXT NOT NULL, seed TEXT NOT NULL, last_used REAL NOT NULL,
+        PRIMARY KEY (key, seed)) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS ensembles (
+        key TEXT NOT NULL, seed TEXT NOT NULL, replicates INTEGER NOT NULL,
+        summary TEXT NOT NULL, PRIMARY KEY (key, seed, replicates))''',
+    ]
+
+
+# Functions
+# --------------------------------------------------------------------
+
+def engine_version():
+    '''
+    Returns: a hash of the source code of the simulation module, so that
+    any change of the code starts a new set of cached results; in a
+    packaged build without source code, the module's version line
+    '''
+    try:
+        with open(sim.__file__, 'rb') as file:
+            return sha256(file.read()).hexdigest()
+    except (OSError, TypeError):
+        return sim.__doc__.strip().splitlines()[0]
+
+
+def scenario_key(parameters, version=None):
+    '''
+    Arguments: the canonical parameters of a scenario, optionally the
+    engine version, see engine_version()
+    Returns: the content address of the scenario, a hex string
+
+    Test:
+    >>> scenario_key(canonical(strength=[10, 5])) == scenario_key(canonical(strength=(10.0, 5)))
+    True
+    '''
+    content = {
+        'parameters': parameters,
+        'config': {name: getattr(config, name) for name in config_fields},
+        'version': engine_version() if version is None else version,
+        }
+    return sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def run_replicate(parameters, seed, replicate):
+    '''
+    Runs one replicate of a scenario, in a worker process if needed.
+
+    Arguments: the canonical parameters, the seed and the replicate index
+    Returns: a tuple of the replicate index, the number of steps, the final
+    strengths of both forces and whether the run ended in a stalemate
+    '''
+    results = sim.run_simulation(seed=seed, replicate=replicate, record='summary',
+        targeting='grid', **parameters)
+    return (replicate, results.steps, results.blue[-1], results.red[-1],
+        int(results.stalemate))
+
+
+def summarize(rows):
+    '''
+    Aggregates replicates of a scenario.
+
+    Arguments: a list of (steps, blue, red) tuples
+    Returns: a dict with the number of replicates, the number of wins and
+    the win probability of each force, the number of runs in which both
+    forces were eliminated or none was, the mean number of steps, and the
+    mean and standard deviation of each force's final strength
+
+    Test:
+    >>> summary = summarize([(10, 5, 0), (12, 0, 3), (20, 4, 0), (100, 2, 2)])
+    >>> summary['wins'], summary['win_probability'], summary['undecided']
+    ([2, 1], [0.5, 0.25], 1)
+    '''
+    n = len(rows)
+    summary = {'replicates': n, 'wins': [0, 0], 'win_probability': [0.0, 0.0],
+        'both_down': 0, 'undecided': 0, 'mean_steps': None, 'mean_strength': [None, None],
+        'sd_strength': [None, None]}
+    if n == 0:
+        return summary
+    for steps, blue, red in rows:
+        if blue > 0 and red == 0:
+            summary['wins'][0] += 1
+        elif red > 0 and blue == 0:
+            summary['wins'][1] += 1
+        elif blue == 0 and red == 0:
+            summary['both_down'] += 1
+        else:
+            summary['undecided'] += 1
+    summary['win_probability'] = [wins/n for wins in summary['wins']]
+    summary['mean_steps'] = sum(row[0] for row in rows)/n
+    for side in (0, 1):
+        values = [row[1 + side] for row in rows]
+        mean = sum(values)/n
+        summary['mean_strength'][side] = mean
+        if n > 1:
+            summary['sd_strength'][side] = (sum((value - mean)**2 for value in values)
+                /(n - 1))**0.5
+    return summary
+
+
+# Classes
+# --------------------------------------------------------------------
+
+class result_cache():
+    '''
+    Version: 0.1
+
+    A cache of simulation results in an SQLite database file. Scenarios
+    are given as keyword arguments of run_simulation(), seeds are required
+    since only reproducible runs can be cached.
+    - path: the database file
+    - max_entries: int, the number of replicates kept before those of the
+      least recently used scenarios and seeds are removed
+    - workers: int, number of worker processes for missing replicates
+    - version: the engine version the keys are computed with
+    - connection: the sqlite3 connection
+    '''
+
+    def __init__(self, path=cache_file, max_entries=max_entries, workers=1):
+        '''
+        Test:
+        >>> cache = result_cache(':memory:')
+        >>> cache.simulation(seed=3, strength=[5, 5], accuracy=[1, 0], range=[200, 200])
+        {'replicate': 0, 'steps': 1, 'blue': 5, 'red': 0, 'stalemate': False}
+        >>> summary = cache.ensemble(20, seed=3, strength=[5, 5], accuracy=[1, 0],
+        ...     range=[200, 200])
+        >>> summary['win_probability'], len(cache)
+        ([1.0, 0.0], 20)
+        '''
+        self.path = path
+        self.max_entries = max_entries
+        self.workers = workers
+        self.version = engine_version()
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        for statement in schema:
+            self.connection.execute(statement)
+        self.computed = 0
+
+
+    def key(self, **scenario):
+        '''
+        Returns: the canonical parameters and the key of a scenario
+        '''
+        parameters = canonical(**scenario)
+        return parameters, scenario_key(parameters, self.version)
+
+
+    def touch(self, key, parameters, seed):
+        '''
+        Registers a scenario and marks it and the seed as just used.
+        '''
+        now = time()
+        self.connection.execute('INSERT INTO scenarios VALUES (?, ?, ?) ON CONFLICT(key) '
+            'DO UPDATE SET last_used = excluded.last_used',
+            (key, json.dumps(parameters, sort_keys=True), now))
+        self.connection.execute('INSERT INTO seeds VALUES (?, ?, ?) ON CONFLICT(key, seed) '
+            'DO UPDATE SET last_used = excluded.last_used', (key, str(seed), now))
+
+
+    def fill(self, key, parameters, seed, replicates):
+        '''
+        Computes the replicates with the given indices that are not in the
+        cache and stores them, write_batch at a time. Replicates written
+        meanwhile by another process are kept as they are.
+        '''
+        present = {row[0] for row in self.connection.execute('SELECT replicate FROM '
+            'replicates WHERE key = ? AND seed = ?', (key, str(seed)))}
+        missing = [replicate for replicate in replicates if replicate not in present]
+        if not missing:
+            return
+
+        if self.workers > 1:
+            executor = ProcessPoolExecutor(max_workers=self.workers)
+            rows = executor.map(run_replicate, [parameters]*len(missing),
+                [seed]*len(missing), missing, chunksize=max(1, write_batch//self.workers))
+        else:
+            executor = None
+            rows = (run_replicate(parameters, seed, replicate) for replicate in missing)
+        try:
+            batch = []
+            for row in rows:
+                batch.append((key, str(seed)) + row)
+                if len(batch) >= write_batch:
+                    self.store(batch)
+                    batch = []
+            self.store(batch)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        self.evict((key, str(seed)))
+
+
+    def store(self, rows):
+        '''
+        Inserts rows of replicates in one transaction.
+        '''
+        if not rows:
+            return
+        with self.connection:
+            self.connection.execute('BEGIN')
+            self.connection.executemany('INSERT OR IGNORE INTO replicates VALUES '
+                '(?, ?, ?, ?, ?, ?, ?)', rows)
+        self.computed += len(rows)
+
+
+    def simulation(self, seed, replicate=0, **scenario):
+        '''
+        Returns: the result of one replicate of a scenario as a dict with
+        its number of steps, final strengths and whether it ended in a
+        stalemate, from the cache or computed
+        '''
+        if seed is None:
+            raise ValueError('Only runs with a seed can be cached.')
+        parameters, key = self.key(**scenario)
+        self.touch(key, parameters, seed)
+        self.fill(key, parameters, seed, [replicate])
+        steps, blue, red, stalemate = self.connection.execute('SELECT steps, blue, red, '
+            'stalemate FROM replicates WHERE key = ? AND seed = ? AND replicate = ?',
+            (key, str(seed), replicate)).fetchone()
+        return {'replicate': replicate, 'steps': steps, 'blue': blue, 'red': red,
+            'stalemate': bool(stalemate)}
+
+
+    def ensemble(self, n_replicates, seed, **scenario):
+        '''
+        Returns: the aggregated results of replicates 0 to n_replicates - 1
+        of a scenario, see summarize(); replicates not in the cache are
+        computed first. The aggregate is stored with the replicates.
+        '''
+        if seed is None:
+            raise ValueError('Only runs with a seed can be cached.')
+        parameters, key = self.key(**scenario)
+        self.touch(key, parameters, seed)
+        stored = self.connection.execute('SELECT summary FROM ensembles WHERE key = ? AND '
+            'seed = ? AND replicates = ?', (key, str(seed), n_replicates)).fetchone()
+        if stored is not None:
+            return json.loads(stored[0])
+
+        summary = summarize(self.rows(key, parameters, seed, n_replicates))
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO ensembles VALUES (?, ?, ?, ?)',
+                (key, str(seed), n_replicates, json.dumps(summary)))
+        return summary
+
+
+    def replicates(self, n_replicates, seed, **scenario):
+        '''
+        Returns: a list of (steps, blue, red) tuples of replicates 0 to
+        n_replicates - 1 of a scenario, computed first if not in the cache
+        '''
+        if seed is None:
+            raise ValueError('Only runs with a seed can be cached.')
+        parameters, key = self.key(**scenario)
+        self.touch(key, parameters, seed)
+        return self.rows(key, parameters, seed, n_replicates)
+
+
+    def rows(self, key, parameters, seed, n_replicates):
+        '''
+        Returns: the (steps, blue, red) tuples of the first n_replicates
+        replicates of a scenario, ordered by replicate
+        '''
+        self.fill(key, parameters, seed, range(n_replicates))
+        return self.connection.execute('SELECT steps, blue, red FROM replicates WHERE '
+            'key = ? AND seed = ? AND replicate < ? ORDER BY replicate',
+            (key, str(seed), n_replicates)).fetchall()
+
+
+    def sweep(self, n_replicates, seed, strength=[Strength], range=[Range], speed=[Speed],
+        accuracy=[Accuracy], **scenario):
+        '''
+        Runs ensemble() for every combination of the given strength, range,
+        speed and accuracy pairs, like run_sweep(). All combinations use
+        the same replicate streams, i.e. common random numbers.
+
+        Returns: a generator of (parameters, summary) tuples, in order
+        '''
+        for values in product(strength, range, speed, accuracy):
+            combination = dict(scenario, strength=values[0], range=values[1],
+                speed=values[2], accuracy=values[3])
+            yield canonical(**combination), self.ensemble(n_replicates, seed, **combination)
+
+
+    def ensembles(self):
+        '''
+        Returns: a list of (parameters, seed, summary) tuples of all stored
+        ensembles, e.g. to fit a model to them
+        '''
+        rows = self.connection.execute('SELECT parameters, seed, summary FROM ensembles '
+            'JOIN scenarios USING (key)')
+        return [(json.loads(parameters), int(seed), json.loads(summary))
+            for parameters, seed, summary in rows]
+
+
+    def evict(self, current=None):
+        '''
+        Removes the replicates and ensembles of the least recently used
+        combinations of scenario and seed, except the current one, until at
+        most max_entries replicates are left. Scenarios without any seed
+        left are removed as well.
+
+        Arguments: optionally the current (key, seed) tuple
+
+        Test:
+        >>> cache = result_cache(':memory:', max_entries=50)
+        >>> for seed in (1, 2, 3):
+        ...     _ = cache.ensemble(40, seed=seed, strength=[2, 2])
+        >>> len(cache), [seed for _, seed, _ in cache.ensembles()]
+        (40, [3])
+        '''
+        total = self.connection.execute('SELECT COUNT(*) FROM replicates').fetchone()[0]
+        if total <= self.max_entries:
+            return
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            groups = self.connection.execute('SELECT key, seed, COUNT(*) FROM replicates '
+                'LEFT JOIN seeds USING (key, seed) GROUP BY key, seed '
+                'ORDER BY MIN(last_used)').fetchall()
+            for key, seed, count in groups:
+                if total <= self.max_entries:
+                    break
+                if (key, seed) == current:
+                    continue
+                for table in ('replicates', 'ensembles', 'seeds'):
+                    self.connection.execute('DELETE FROM '+table+' WHERE key = ? AND '
+                        'seed = ?', (key, seed))
+                total -= count
+            self.connection.execute('DELETE FROM scenarios WHERE key NOT IN '
+                '(SELECT key FROM seeds)')
+
+
+    def __len__(self):
+        '''
+        Returns the number of replicates in the cache.
+        '''
+        return self.connection.execute('SELECT COUNT(*) FROM replicates').fetchone()[0]
+
+
+    def close(self):
+        '''
+        Closes the database connection.
+        '''
+        self.connection.close()
@@ -1,9 +1,19 @@
 '''
-Version: 0.3
+Version: 0.6
 Authors: Steffen Pielström
-Dependencies: AttritionSim.py v0.3, config.py v0.2, PySimpleGui, time, typing
+Dependencies: AttritionSim.py v0.3, config.py v0.2, PySimpleGui, time, threading, 
+typing
 
 GUI application based on the AttritionSim module. To be deplyed with pyinstaller.
+Besides running simulations, it replays trajectory files recorded with 
+AttritionSim, step by step in both directions, without simulating again.
+
+Simulations run in a background thread, which paces the steps and posts 
+snapshots of the unit positions and shots to the event loop of the window,
+at most frames_per_second times per second. The window stays responsive 
+while a simulation is running, and the units' figures are moved or deleted 
+rather than redrawn in each frame. Forces with more than detail_threshold 
+units in total are shown as a density raster instead of single units.
 '''
 
 # Imports
@@ -11,9 +21,13 @@ GUI application based on the AttritionSim module. To be deplyed with pyinstaller
 
 import PySimpleGUI as sg
 from time import sleep
+from time import monotonic
+from threading import Thread
+from threading import Event
 
 import AttritionSim as sim
 
+from config import field_size
 from config import Faction
 from config import Name
 from config import Color
@@ -28,23 +42,56 @@ from config import Formation
 
 unit_size: float = 1
 frame_size = (600, 500)
+background_color = 'grey'
 input_dimension = (7, 1)
 
 # Second per time step in the gui and fraction of a time step a shooting 
-# line remains visible. This is not yet implemented. -> TODO
+# line remains visible
 sec_per_step: float = 0.1 
 time_fraction_per_shot: float = 0.5
 
+# Maximum number of screen updates per second
+frames_per_second: float = 30
+
 step_sum: int = 0
 
 initialized: bool = False
 max_steps: int = 1
 
+# Trajectory being replayed, if any
+recording = None
+
+# Simulation thread, the flag to stop it and the number of the current run,
+# to ignore events posted by earlier runs
+worker = None
+stop_request = Event()
+run_id: int = 0
+
+# Seconds to wait for a stopped simulation thread to end; a thread still in
+# a step afterwards ends on its own
+stop_timeout: float = 0.05
+
+# Figures on the graph: unit circles by force index and unit number, with 
+# their current position, and the shot lines with the time to remove them
+figures = [{}, {}]
+shot_lines = []
+shots_expire: float = 0
+
+# Level of detail: above detail_threshold units in both forces together, 
+# the forces are rendered as a density raster of density_cells x 
+# density_cells cells and the shots as hit counts per cell, so the cost of
+# a frame depends on the raster and not on the number of units. Raster 
+# cells on the graph by (column, row), with their color
+detail_threshold: int = 2000
+density_cells: int = 50
+cells = {}
+color_values = {}
+
 
 # Layout
 # --------------------------------------------------------------------
 
-graph = sg.Graph(frame_size, (0, 0), (100, 100), key='-GRAPH-', background_color='grey')
+graph = sg.Graph(frame_size, (0, 0), (field_size, field_size), key='-GRAPH-', background_color=background_color)
 
 input_blue = [
     sg.Text('Blue Force:', text_color=Color[0], font='bold'),
@@ -81,7 +128,18 @@ buttons = [
     sg.Button('Place new forces', key='-BUTTON1-'),
     sg.Button('Run simulation for', key='-BUTTON2-'), 
     sg.Input(default_text=max_steps, key='-MAX_STEPS-', size=input_dimension),
-    sg.Text('steps')
+    sg.Text('steps at'),
+    sg.Input(default_text=sec_per_step, key='-SEC_PER_STEP-', size=input_dimension),
+    sg.Text('seconds per step')
+    ]
+replay = [
+    sg.Input(key='-TRAJECTORY-', size=(30, 1)),
+    sg.FileBrowse('Browse'),
+    sg.Button('Replay recording', key='-BUTTON3-'),
+    sg.Button('<', key='-BACK-'),
+    sg.Slider(range=(0, 0), orientation='h', key='-FRAME-', enable_events=True, 
+        size=(20, 15)),
+    sg.Button('>', key='-FORWARD-'),
     ]
 
 layout = [
@@ -90,6 +148,8 @@ layout = [
     input_blue,
     input_red,
     buttons,
+    [sg.Text('Replay', font='bold')],
+    replay,
     [sg.Text('Current state', font='bold')],
     screen_counter
     ]
@@ -98,44 +158,211 @@ layout = [
 # Functions
 # --------------------------------------------------------------------
 
-def draw_units(force):
-  '''
-  Draws units on the graph.
-  Arguments: a force object
-  '''
-  for element in force.units:
-    graph.draw_circle(
-      (element.pos[0], element.pos[1]), 
-      unit_size, fill_color=force.color, line_color=force.color
-      )
-
-def draw_attacks():
-    '''
-    Function for drawing lines between units if killing each other.
-    '''   
-    for element in blue_force.units:
-        if element.has_hit == True:
-            graph.draw_line(element.pos, element.target_pos)
-        else:
-            pass
+def force_snapshot(force):
+    '''
+    Arguments: a force object
+    Returns: a list of (number, x, y) tuples of its units
+    '''
+    return [(element.number, element.pos[0], element.pos[1]) for element in force.units]
 
-    for element in red_force.units:
-        if element.has_hit == True:
-            graph.draw_line(element.pos, element.target_pos)
-        else:
-            pass
 
-    
-def reset_has_hit():
+def force_shots(force):
     '''
-    This function is necessary to reset the has_hit attribute in all units after drawing
-    the shooting lines in each simulation step. It is probably not the most elegant of
-    sulutions and you are invited to come up with a better one. 
+    Arguments: a force object
+    Returns: a list of (x, y, target x, target y) tuples of the shots that
+    hit in the last step
     '''
-    for element in blue_force.units:
-        element.has_hit = False
-    for element in red_force.units:
-        element.has_hit = False
+    return [(element.pos[0], element.pos[1], element.target_pos[0], element.target_pos[1]) 
+        for element in force.units if element.has_hit]
+
+
+def frame_snapshot(frame):
+    '''
+    Arguments: a frame of a recorded trajectory
+    Returns: a snapshot like the simulation thread posts it, see 
+    simulation_worker()
+    '''
+    positions = []
+    shots = []
+    for side, enemy in [('blue', 'red'), ('red', 'blue')]:
+        pos = frame[side+'_pos']
+        positions.append([(number, x, y) for number, ((x, y), alive) 
+            in enumerate(zip(pos.tolist(), frame[side+'_alive'])) if alive])
+        for (x, y), target, hit in zip(pos.tolist(), frame[side+'_target'], frame[side+'_hit']):
+            if hit:
+                target_x, target_y = frame[enemy+'_pos'][target].tolist()
+                shots.append((x, y, target_x, target_y))
+    return positions, shots
+
+
+def render(positions, shots):
+    '''
+    Updates the graph to a snapshot, unit by unit or, for more than 
+    detail_threshold units, as a density raster. Shots are removed again 
+    after time_fraction_per_shot of a step, see remove_shots().
+    Arguments: a list with a list of (number, x, y) tuples for each force,
+    a list of (x, y, target x, target y) tuples
+    '''
+    global shots_expire
+    remove_shots()
+    if sum(len(units) for units in positions) > detail_threshold:
+        render_density(positions, shots)
+    else:
+        render_units(positions, shots)
+    shots_expire = monotonic() + time_fraction_per_shot*max(sec_per_step, 1/frames_per_second)
+
+
+def render_units(positions, shots):
+    '''
+    Moves the circles of units that are still there, deletes those of 
+    eliminated units, draws circles for new units and draws the shot lines.
+    Arguments: see render()
+    '''
+    clear_cells()
+    for index, (units, color) in enumerate(zip(positions, Color)):
+        current = figures[index]
+        present = set()
+        for number, x, y in units:
+            present.add(number)
+            if number in current:
+                figure, old_x, old_y = current[number]
+                if x != old_x or y != old_y:
+                    graph.move_figure(figure, x - old_x, y - old_y)
+                    current[number] = (figure, x, y)
+            else:
+                figure = graph.draw_circle((x, y), unit_size, fill_color=color, 
+                    line_color=color)
+                current[number] = (figure, x, y)
+        for number in [number for number in current if number not in present]:
+            graph.delete_figure(current.pop(number)[0])
+
+    for x, y, target_x, target_y in shots:
+        shot_lines.append(graph.draw_line((x, y), (target_x, target_y)))
+
+
+def render_density(positions, shots):
+    '''
+    Counts the units of both forces in each cell of the raster and draws
+    a square for each occupied cell, its color mixed from the force colors
+    by their share of the units and fading into the background for few 
+    units. Only cells whose color changed are redrawn. Shots are shown as
+    the number of hits in the cell of the targets.
+    Arguments: see render()
+    '''
+    clear_units()
+    size = field_size/density_cells
+    counts = {}
+    for index, units in enumerate(positions):
+        for number, x, y in units:
+            cell = (cell_index(x), cell_index(y))
+            if cell not in counts:
+                counts[cell] = [0, 0]
+            counts[cell][index] += 1
+
+    for cell in [cell for cell in cells if cell not in counts]:
+        graph.delete_figure(cells.pop(cell)[0])
+    for cell, (blue, red) in counts.items():
+        color = cell_color(blue, red)
+        if cell in cells:
+            if cells[cell][1] == color:
+                continue
+            graph.delete_figure(cells[cell][0])
+        column, row = cell
+        figure = graph.draw_rectangle((column*size, (row + 1)*size), 
+            ((column + 1)*size, row*size), fill_color=color, line_color=color)
+        cells[cell] = (figure, color)
+
+    hits = {}
+    for x, y, target_x, target_y in shots:
+        cell = (cell_index(target_x), cell_index(target_y))
+        hits[cell] = hits.get(cell, 0) + 1
+    for (column, row), count in hits.items():
+        shot_lines.append(graph.draw_text(str(count), ((column + 0.5)*size, 
+            (row + 0.5)*size), color='white', font=('Helvetica', 7)))
+
+
+def cell_index(coordinate):
+    '''
+    Returns: the column or row of the raster cell of a coordinate on the
+    graph, coordinates outside the graph count to the border cells
+    '''
+    return min(max(int(coordinate*density_cells/field_size), 0), density_cells - 1)
+
+
+def cell_color(blue, red):
+    '''
+    Mixes the color of a raster cell. The share of blue units is rounded
+    to quarters and the intensity grows with the binary logarithm of the 
+    number of units, up to 64 or more, so that similar cells get the same
+    color and do not need to be redrawn.
+    Arguments: the number of blue and red units in the cell
+    Returns: the color as a '#rrggbb' string
+    '''
+    share = round(4*blue/(blue + red))/4
+    intensity = min((blue + red).bit_length(), 7)/7
+    background, first, second = [color_value(color) 
+        for color in (background_color, Color[0], Color[1])]
+    mixed = [round(back + intensity*(share*one + (1 - share)*two - back)) 
+        for back, one, two in zip(background, first, second)]
+    return '#{:02x}{:02x}{:02x}'.format(*mixed)
+
+
+def color_value(color):
+    '''
+    Returns: the red, green and blue values of a color name, from 0 to 255
+    '''
+    if color not in color_values:
+        color_values[color] = [value//256 for value in graph.TKCanvas.winfo_rgb(color)]
+    return color_values[color]
+
+
+def clear_units():
+    '''
+    Deletes the circles of all units from the graph.
+    '''
+    for current in figures:
+        for figure, x, y in current.values():
+            graph.delete_figure(figure)
+        current.clear()
+
+
+def clear_cells():
+    '''
+    Deletes the squares of the density raster from the graph.
+    '''
+    for figure, color in cells.values():
+        graph.delete_figure(figure)
+    cells.clear()
+
+
+def remove_shots():
+    '''
+    Deletes the shot lines from the graph.
+    '''
+    for figure in shot_lines:
+        graph.delete_figure(figure)
+    shot_lines.clear()
+
+
+def clear_graph():
+    '''
+    Removes all figures from the graph.
+    '''
+    graph.erase()
+    for current in figures:
+        current.clear()
+    cells.clear()
+    shot_lines.clear()
+
+
+def update_counters(step, blue, red):
+    '''
+    Shows the step and the strength of both forces.
+    '''
+    window['-STEPS_SIMULATED-'].update(step)
+    window['-BLUE_STRENGTH-'].update(blue)
+    window['-RED_STRENGTH-'].update(red)
+
 
 def current_state(blue_force, red_force):
     '''
@@ -154,10 +381,10 @@ def current_state(blue_force, red_force):
 
 def initialize_gui():
     '''
-    
+    Places new forces with the values from the input fields.
     '''
 
-    graph.erase()
+    clear_graph()
 
     # Read values from input fields
     Strength[0] = int(values['-STRENGTH_B-'])
@@ -175,70 +402,121 @@ def initialize_gui():
     blue_force = sim.force(Faction[0], Name[0], Color[0], Strength[0], Range[0], Speed[0], 
     Accuracy[0], Formation[0])
     blue_force.initialize_units()
-    draw_units(blue_force)
 
     global red_force
     red_force = sim.force(Faction[1], Name[1], Color[1], Strength[1], Range[1], Speed[1], 
     Accuracy[1], Formation[1])
     red_force.initialize_units()
-    draw_units(red_force)
+
+    render([force_snapshot(blue_force), force_snapshot(red_force)], [])
 
     # Update screen output
-    window['-BLUE_STRENGTH-'].update(len(blue_force.units))
-    window['-RED_STRENGTH-'].update(len(red_force.units))
-    window['-STEPS_SIMULATED-'].update(step_sum)
+    update_counters(step_sum, len(blue_force.units), len(red_force.units))
 
-    # Variables for output generation
-    global blue
-    blue = []
-    global red
-    red = []
+
+def simulation_worker(blue_force, red_force, max_steps, first_step, run, stop):
+    '''
+    Runs the simulation in a background thread. Steps are paced to last 
+    sec_per_step seconds each. After a step, a snapshot is posted to the 
+    window as a '-STEP-' event, unless the last one was posted less than 
+    1/frames_per_second seconds before; the snapshot of the last step is 
+    always posted, followed by a '-DONE-' event. Positions are only 
+    collected for the steps that are posted. Events carry the number of 
+    the run. The run ends early if its stop flag is set.
+
+    Arguments: the two forces, the maximum number of steps, the number of 
+    steps simulated before, the number of the run, the Event to stop it
+    '''
+    steps = 0
+    next_step = monotonic()
+    last_frame = -1.0
+    shots = []
+    while (len(blue_force.units) > 0 and len(red_force.units) > 0 
+        and steps < max_steps and not stop.is_set()):
+
+        # Wait for the time of the step
+        next_step += sec_per_step
+        delay = next_step - monotonic()
+        if delay > 0:
+            sleep(delay)
+        else:
+            next_step -= delay
+
+        # Simulate step, keep the shots of skipped frames for the next one
+        sim.update_forces(blue_force, red_force, targeting='grid')
+        steps += 1
+        shots += force_shots(blue_force) + force_shots(red_force)
+
+        now = monotonic()
+        finished = (len(blue_force.units) == 0 or len(red_force.units) == 0 
+            or steps == max_steps)
+        if finished or now - last_frame >= 1/frames_per_second:
+            positions = [force_snapshot(blue_force), force_snapshot(red_force)]
+            window.write_event_value('-STEP-', (run, first_step + steps, positions, shots))
+            last_frame = now
+            shots = []
+
+    window.write_event_value('-DONE-', (run, steps))
 
 
 def run_simulation_gui(blue_force, red_force, max_steps=max_steps):    
     '''
+    Starts the simulation thread, see simulation_worker(), with a stop 
+    flag of its own.
     '''
-    # Initialize loop conditions
-    steps = 0
-    if len(blue_force.units) > 0 and len(red_force.units) > 0:
-        conditions = True
-    else:
-        conditions = False
-
-    # Initialize lists for output tracking
-    blue = []
-    red = []
-
-    # Main loop
-    while conditions == True:        
-
-        # Simulate step
-        sim.update_forces(blue_force, red_force)    
-
-        # Update screen
-        global step_sum
-        step_sum += 1
-        graph.erase()
-        draw_attacks()
-        draw_units(blue_force)
-        draw_units(red_force)
-        reset_has_hit()
-        window['-STEPS_SIMULATED-'].update(step_sum)
-        window['-BLUE_STRENGTH-'].update(len(blue_force.units))
-        window['-RED_STRENGTH-'].update(len(red_force.units))
-
-        # Update loop conditions
-        steps += 1   
-        conditions = (
-            len(blue_force.units) > 0 
-            and len(red_force.units) > 0 
-            and steps < max_steps
-            )
-
-        # Update stored outputs
-        blue.append(len(blue_force.units)) # For a future output functionality
-        red.append(len(red_force.units))     
-        #sleep(sec_per_step)
+    global worker
+    global stop_request
+    stop_request = Event()
+    worker = Thread(target=simulation_worker, args=(blue_force, red_force, max_steps, 
+        step_sum, run_id, stop_request), daemon=True)
+    worker.start()
+
+
+def stop_simulation():
+    '''
+    Stops a running simulation thread. It is waited for at most 
+    stop_timeout seconds, so the window does not freeze while a large step
+    finishes; the thread works on its own forces and ends after that step.
+    Events it posted are ignored from now on.
+    '''
+    global run_id
+    run_id += 1
+    if worker is not None and worker.is_alive():
+        stop_request.set()
+        worker.join(stop_timeout)
+
+
+def open_recording():
+    '''
+    Opens the trajectory file given in the input field and shows its 
+    first step.
+    '''
+    global recording
+    recording = sim.trajectory(values['-TRAJECTORY-'])
+    window['-FRAME-'].update(value=0, range=(0, recording.steps))
+    clear_graph()
+    draw_frame(0)
+
+
+def draw_frame(step):
+    '''
+    Shows a step of the trajectory being replayed: the units alive after
+    that step and lines from units that hit in that step to their target.
+    Arguments: the step number
+    '''
+    positions, shots = frame_snapshot(recording[step])
+    render(positions, shots)
+    update_counters(step, len(positions[0]), len(positions[1]))
+
+
+def seek(step):
+    '''
+    Shows another step of the trajectory being replayed.
+    Arguments: the step number, clipped to the recorded steps
+    '''
+    step = min(max(step, 0), recording.steps)
+    window['-FRAME-'].update(value=step)
+    draw_frame(step)
 
 
 # Main
@@ -247,21 +525,57 @@ def run_simulation_gui(blue_force, red_force, max_steps=max_steps):
 window = sg.Window('Attrition Simulator', layout)
 
 while True:
-    event, values = window.read()
+    # Wake up in time to remove shot lines
+    timeout = None
+    if shot_lines:
+        timeout = max(0, int(1000*(shots_expire - monotonic())))
+    event, values = window.read(timeout=timeout)
 
     if event == sg.WIN_CLOSED:
+        stop_simulation()
         break
+
+    if shot_lines and monotonic() >= shots_expire:
+        remove_shots()
     
     # Update values according to inputs and initialize
     if event == '-BUTTON1-': 
+        stop_simulation()
         step_sum = 0
+        recording = None
         initialize_gui()
         initialized = True
 
     # Run simulation
-    if event == '-BUTTON2-' and initialized == True:
-        max_steps = int(values['-MAX_STEPS-'])
-        run_simulation_gui(blue_force, red_force, max_steps)
+    if event == '-BUTTON2-' and initialized == True and recording is None:
+        if worker is None or not worker.is_alive() or stop_request.is_set():
+            max_steps = int(values['-MAX_STEPS-'])
+            sec_per_step = float(values['-SEC_PER_STEP-'])
+            run_simulation_gui(blue_force, red_force, max_steps)
+
+    # Snapshots from the simulation thread
+    if event == '-STEP-' and values['-STEP-'][0] == run_id:
+        run, step, positions, shots = values['-STEP-']
+        render(positions, shots)
+        update_counters(step, len(positions[0]), len(positions[1]))
+    if event == '-DONE-' and values['-DONE-'][0] == run_id:
+        step_sum += values['-DONE-'][1]
+
+    # Replay a recorded trajectory
+    if event == '-BUTTON3-':
+        stop_simulation()
+        initialized = False
+        try:
+            open_recording()
+        except (OSError, ValueError) as error:
+            sg.popup_error('Cannot open recording: '+str(error))
+
+    if event == '-FRAME-' and recording is not None:
+        seek(int(values['-FRAME-']))
+    if event == '-BACK-' and recording is not None:
+        seek(int(values['-FRAME-']) - 1)
+    if event == '-FORWARD-' and recording is not None:
+        seek(int(values['-FRAME-']) + 1)
     
 
 window.close()
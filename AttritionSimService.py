@@ -0,0 +1,673 @@
+#!/usr/bin/env python3
+'''
+Version: 0.1
+Authors: Steffen Pielström
+Dependencies: AttritionSim.py v0.3, AttritionSimCLI.py v0.2, asyncio,
+argparse, json, heapq, itertools, hashlib, multiprocessing, urllib,
+concurrent.futures
+
+A local simulation service: one long-running process that runs
+simulations for other tools over a small HTTP/JSON API, so they do not
+have to start a Python process per simulation. Jobs are queued with a
+priority and run on a pool of worker processes. Their progress and result
+can be polled or streamed, and they can be cancelled.
+
+API (all bodies are JSON):
+- POST /jobs with {"kind": "simulation" or "lanchester", "scenario":
+  {...}, "priority": 0}: submits a job and returns its state with its
+  id. Simulation scenarios have the fields of the CLI's batch mode (see
+  AttritionSimCLI.py), e.g. {"strength_blue": 40, "seed": 1}; Lanchester
+  scenarios the fields max_steps, strength_blue, strength_red,
+  value_blue, value_red, type and output. Lower priorities run first,
+  equal ones in order of submission. If max_queued computations are
+  waiting, the service answers 429 and the client should retry later.
+- GET /jobs/<id>: the state of a job: status ('queued', 'running',
+  'done', 'failed' or 'cancelled'), progress (steps and strengths of a
+  running simulation), result or error.
+- GET /jobs/<id>/events: streams the state as one JSON line whenever it
+  changes, until the job has ended.
+- DELETE /jobs/<id>: cancels a job. A running simulation stops at its
+  next progress report.
+- GET /status: numbers of queued and running computations and of jobs.
+
+Requests for the same scenario that arrive while a computation for it is
+queued or running are collapsed into that computation. This applies to
+simulations with a seed and to Lanchester models; simulations without a
+seed get a random one each and are always computed separately.
+
+Start the service with:
+
+python AttritionSimService.py --port 8765 --workers 4
+'''
+
+# Imports
+# --------------------------------------------------------------------
+
+import argparse
+import asyncio
+import json
+import os
+from heapq import heappush
+from heapq import heappop
+from itertools import count
+from hashlib import sha256
+from random import getrandbits
+from time import monotonic
+from multiprocessing import Manager
+from multiprocessing import freeze_support
+from concurrent.futures import ProcessPoolExecutor
+from urllib.request import Request
+from urllib.request import urlopen
+from urllib.error import HTTPError
+
+from config import max_steps
+from config import Strength
+from config import Accuracy
+
+import AttritionSim as sim
+import AttritionSimCLI as cli
+
+
+# Variables
+# --------------------------------------------------------------------
+
+host = '127.0.0.1'
+port: int = 8765
+
+# Number of worker processes, defaults to the number of processors
+workers = None
+
+# Number of computations that may wait in the queue before new jobs are
+# refused
+max_queued: int = 100
+
+# Seconds between two progress reports of a running simulation
+progress_interval: float = 0.5
+
+# Number of ended jobs whose state is kept for polling
+keep_ended: int = 1000
+
+# Largest accepted request body in bytes
+max_body: int = 2**20
+
+# Scenario fields that are not available in the service
+blocked_fields = ['trajectory', 'checkpoint']
+
+lanchester_fields = ['max_steps', 'strength_blue', 'strength_red', 'value_blue',
+    'value_red', 'type', 'output']
+
+reasons = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found',
+    405: 'Method Not Allowed', 429: 'Too Many Requests', 500: 'Internal Server Error'}
+
+ended = ('done', 'failed', 'cancelled')
+
+
+# Functions
+# --------------------------------------------------------------------
+
+def scenario_options(kind, scenario):
+    '''
+    Checks the fields of a scenario and converts them into the keyword
+    arguments of run_simulation() or run_lanchester().
+
+    Arguments: the kind of job, a dict of scenario fields
+    Returns: a dict of keyword arguments
+
+    Test:
+    >>> scenario_options('lanchester', {'strength_red': 5, 'value_blue': 0.1})['value']
+    [0.1, 0.05]
+    >>> scenario_options('simulation', {'trajectory': 'file.trj'})
+    Traceback (most recent call last):
+    ...
+    ValueError: unknown field: trajectory
+    '''
+    if not isinstance(scenario, dict):
+        raise ValueError('scenario is not a JSON object')
+    if kind == 'lanchester':
+        unknown = [name for name in scenario if name not in lanchester_fields]
+        if unknown:
+            raise ValueError('unknown field: '+', '.join(unknown))
+        return dict(
+            max_steps=int(scenario.get('max_steps', max_steps)),
+            strength=[float(scenario.get('strength_blue', Strength[0])),
+                float(scenario.get('strength_red', Strength[1]))],
+            value=[float(scenario.get('value_blue', Accuracy[0])),
+                float(scenario.get('value_red', Accuracy[1]))],
+            type=str(scenario.get('type', 'square')),
+            output=str(scenario.get('output', 'result'))
+            )
+    if kind == 'simulation':
+        unknown = [name for name in scenario
+            if name not in cli.fields or name in blocked_fields]
+        if unknown:
+            raise ValueError('unknown field: '+', '.join(unknown))
+        options = cli.arguments(cli.defaults(**scenario))
+        # run_job() steps the simulation object itself
+        del options['checkpoint']
+        return options
+    raise ValueError('unknown kind of job: '+str(kind)+
+        ', specify as either \'simulation\' or \'lanchester\'')
+
+
+def run_job(number, kind, options, progress, cancelled):
+    '''
+    Runs a computation in a worker process. A simulation is advanced step
+    by step; every progress_interval seconds, its number of steps and the
+    strengths of both forces are put into the progress queue, and it stops
+    if its number was added to the cancelled dict.
+
+    Arguments: the number of the computation, the kind of job, the keyword
+    arguments, a queue for progress reports and a dict of cancelled
+    computations, both shared with the service process
+    Returns: a dict with the result, see AttritionSimCLI.result_fields(),
+    or None if the computation was cancelled
+    '''
+    options = dict(options)
+    full = options.pop('output') == 'full'
+    if kind == 'lanchester':
+        results = sim.run_lanchester(**options)
+        return cli.result_fields(results, full)
+
+    battle = sim.simulation(**options)
+    reported = monotonic()
+    conditions = True
+    while conditions:
+        battle.step()
+        conditions = battle.running()
+        if conditions and monotonic() - reported >= progress_interval:
+            if number in cancelled:
+                return None
+            progress.put((number, {'steps': battle.results.steps,
+                'blue': len(battle.blue_force), 'red': len(battle.red_force)}))
+            reported = monotonic()
+    return cli.result_fields(battle.results, full)
+
+
+def call(url, method='GET', payload=None):
+    '''
+    Client helper: sends a request to the service.
+
+    Arguments: the URL, the HTTP method, optionally a JSON payload
+    Returns: the decoded JSON response, with the HTTP status as 'http'
+    for error responses
+    '''
+    data = None if payload is None else json.dumps(payload).encode()
+    request = Request(url, data=data, method=method,
+        headers={'Content-Type': 'application/json'})
+    try:
+        with urlopen(request) as response:
+            return json.loads(response.read())
+    except HTTPError as error:
+        answer = json.loads(error.read())
+        answer['http'] = error.code
+        return answer
+
+
+def stream(url):
+    '''
+    Client helper: follows an event stream of the service.
+
+    Arguments: the URL of the events of a job
+    Returns: a generator of the decoded JSON lines
+    '''
+    with urlopen(url) as response:
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+
+
+# Classes
+# --------------------------------------------------------------------
+
+class computation():
+    '''
+    Version: 0.1
+
+    A run of a scenario on the worker pool, shared by all jobs submitted
+    for the same scenario while it is queued or running.
+    - number: int, unique number, also the order of submission
+    - key: string, hash of the kind and options, None if not shared
+    - kind: string, 'simulation' or 'lanchester'
+    - options: dict, the keyword arguments of the run
+    - priority: int, the lowest priority of its jobs
+    - status: string, 'queued', 'running', 'done', 'failed' or 'cancelled'
+    - progress: dict of the last progress report, or None
+    - result, error: the result dict or the error message, if ended
+    - jobs: set of the job objects attached to it
+    '''
+    def __init__(self, number, key, kind, options, priority):
+        self.number = number
+        self.key = key
+        self.kind = kind
+        self.options = options
+        self.priority = priority
+        self.status = 'queued'
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.jobs = set()
+
+
+class job():
+    '''
+    Version: 0.1
+
+    A job submitted to the service, i.e. one request for a computation.
+    - id: string, the job id used in the API
+    - computation: the computation that produces its result
+    - priority: int, the priority given at submission
+    - cancelled: boolean, True if the job was cancelled
+    - listeners: set of asyncio queues of the event streams following it
+    '''
+    def __init__(self, id, computation, priority):
+        self.id = id
+        self.computation = computation
+        self.priority = priority
+        self.cancelled = False
+        self.listeners = set()
+
+
+    def state(self):
+        '''
+        Returns: the state of the job as a dict for the API
+        '''
+        work = self.computation
+        state = {'id': self.id, 'kind': work.kind, 'priority': self.priority,
+            'status': 'cancelled' if self.cancelled else work.status,
+            'shared': len(work.jobs) > 1}
+        if work.progress is not None:
+            state['progress'] = work.progress
+        if work.result is not None and not self.cancelled:
+            state['result'] = work.result
+        if work.error is not None:
+            state['error'] = work.error
+        return state
+
+
+    def publish(self):
+        '''
+        Sends the current state to all event streams of the job.
+        '''
+        state = self.state()
+        for listener in self.listeners:
+            listener.put_nowait(state)
+
+
+class service():
+    '''
+    Version: 0.1
+
+    The job queue, worker pool and HTTP server of the service.
+    - workers: int, number of worker processes
+    - max_queued: int, number of queued computations before new jobs
+      are refused
+    - jobs: dict mapping job ids to job objects, in order of submission
+    - inflight: dict mapping keys to shared computations that are queued
+      or running
+    - running: dict mapping numbers to running computations
+    - queued: int, number of queued computations
+    - queue: heap of (priority, number, computation) entries; entries that
+      no longer match their computation are skipped
+    '''
+    def __init__(self, workers=workers, max_queued=max_queued):
+        '''
+        Test:
+        >>> async def demo():
+        ...     jobs = service(workers=1)
+        ...     server = await jobs.start('127.0.0.1', 0)
+        ...     url = 'http://127.0.0.1:'+str(server.sockets[0].getsockname()[1])
+        ...     loop = asyncio.get_running_loop()
+        ...     scenario = {'seed': 3, 'strength_red': 1, 'accuracy_blue': 1, 'range_blue': 200}
+        ...     first = await loop.run_in_executor(None, call, url+'/jobs', 'POST',
+        ...         {'scenario': scenario})
+        ...     events = await loop.run_in_executor(None, lambda: list(stream(
+        ...         url+'/jobs/'+first['id']+'/events')))
+        ...     missing = await loop.run_in_executor(None, call, url+'/jobs/x')
+        ...     await jobs.stop(server)
+        ...     return events[-1]['status'], events[-1]['result']['result'], missing['http']
+        >>> asyncio.run(demo())
+        ('done', 'Blue victory', 404)
+        '''
+        self.workers = workers or os.cpu_count()
+        self.max_queued = max_queued
+        self.jobs = {}
+        self.inflight = {}
+        self.running = {}
+        self.queued = 0
+        self.queue = []
+        self.numbers = count()
+
+
+    async def start(self, host=host, port=port):
+        '''
+        Starts the worker pool, the dispatchers and the HTTP server.
+
+        Returns: the asyncio server
+        '''
+        self.loop = asyncio.get_running_loop()
+        self.ready = asyncio.Condition()
+        self.manager = Manager()
+        self.progress = self.manager.Queue()
+        self.cancelled = self.manager.dict()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.tasks = [asyncio.create_task(self.dispatch()) for i in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self.report()))
+        return await asyncio.start_server(self.handle, host, port)
+
+
+    async def stop(self, server):
+        '''
+        Stops the HTTP server, the dispatchers and the worker pool.
+        '''
+        server.close()
+        await server.wait_closed()
+        for task in self.tasks:
+            task.cancel()
+        self.progress.put(None)
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown(cancel_futures=True)
+        self.manager.shutdown()
+
+
+    async def serve(self, host=host, port=port):
+        '''
+        Runs the service until it is interrupted.
+        '''
+        server = await self.start(host, port)
+        print('AttritionSim service listening on http://'+host+':'+str(port))
+        try:
+            await server.serve_forever()
+        finally:
+            await self.stop(server)
+
+
+    async def submit(self, kind, scenario, priority=0):
+        '''
+        Creates a job for a scenario and queues a computation for it, or
+        attaches it to a queued or running computation of the same
+        scenario.
+
+        Arguments: the kind of job, a dict of scenario fields, the priority
+        Returns: the job object, or None if the queue is full
+        '''
+        priority = int(priority)
+        options = scenario_options(kind, scenario)
+        key = None
+        if kind == 'lanchester' or options['seed'] is not None:
+            key = sha256(json.dumps([kind, options], sort_keys=True).encode()).hexdigest()
+        else:
+            options['seed'] = getrandbits(64)
+
+        async with self.ready:
+            work = self.inflight.get(key) if key is not None else None
+            if work is None:
+                if self.queued >= self.max_queued:
+                    return None
+                work = computation(next(self.numbers), key, kind, options, priority)
+                heappush(self.queue, (priority, work.number, work))
+                self.queued += 1
+                if key is not None:
+                    self.inflight[key] = work
+                self.ready.notify()
+            elif work.status == 'queued' and priority < work.priority:
+                # Moves the computation up; its old entry is skipped
+                work.priority = priority
+                heappush(self.queue, (priority, work.number, work))
+
+        new = job(format(getrandbits(48), '012x'), work, priority)
+        work.jobs.add(new)
+        self.jobs[new.id] = new
+        for old in [name for name, element in self.jobs.items()
+            if element.state()['status'] in ended][:-keep_ended]:
+            del self.jobs[old]
+        for element in work.jobs:
+            element.publish()
+        return new
+
+
+    async def cancel(self, id):
+        '''
+        Cancels a job. Its computation is cancelled as well if no other
+        job is attached to it.
+
+        Returns: the job object
+        '''
+        cancelled = self.jobs[id]
+        work = cancelled.computation
+        if cancelled.cancelled or work.status in ended:
+            return cancelled
+        cancelled.cancelled = True
+        work.jobs.discard(cancelled)
+        if not work.jobs:
+            if work.key is not None and self.inflight.get(work.key) is work:
+                del self.inflight[work.key]
+            if work.status == 'queued':
+                work.status = 'cancelled'
+                self.queued -= 1
+            else:
+                self.cancelled[work.number] = True
+        cancelled.publish()
+        for element in work.jobs:
+            element.publish()
+        return cancelled
+
+
+    async def dispatch(self):
+        '''
+        Takes computations from the queue in order of priority and runs
+        them on the worker pool, one at a time.
+        '''
+        while True:
+            async with self.ready:
+                await self.ready.wait_for(lambda: self.queued > 0)
+                while True:
+                    priority, number, work = heappop(self.queue)
+                    if work.status == 'queued' and priority == work.priority:
+                        break
+                work.status = 'running'
+                self.queued -= 1
+            self.running[work.number] = work
+            self.finish(work, None)
+
+            try:
+                result = await self.loop.run_in_executor(self.executor, run_job,
+                    work.number, work.kind, work.options, self.progress, self.cancelled)
+            except Exception as error:
+                self.finish(work, 'failed', error=str(error))
+            else:
+                if result is None:
+                    self.finish(work, 'cancelled')
+                else:
+                    self.finish(work, 'done', result)
+
+
+    def finish(self, work, status, result=None, error=None):
+        '''
+        Updates the status of a computation that started (status None) or
+        ended, and publishes it to its jobs.
+        '''
+        if status is not None:
+            work.status = status
+            work.result = result
+            work.error = error
+            self.running.pop(work.number, None)
+            self.cancelled.pop(work.number, None)
+            if work.key is not None and self.inflight.get(work.key) is work:
+                del self.inflight[work.key]
+        for element in work.jobs:
+            element.publish()
+
+
+    async def report(self):
+        '''
+        Forwards the progress reports of the workers to the jobs.
+        '''
+        while True:
+            report = await self.loop.run_in_executor(None, self.progress.get)
+            if report is None:
+                return
+            number, progress = report
+            work = self.running.get(number)
+            if work is not None:
+                work.progress = progress
+                for element in work.jobs:
+                    element.publish()
+
+
+    def status(self):
+        '''
+        Returns: a dict with the numbers of queued and running computations
+        and of jobs, and the size of the worker pool and the queue
+        '''
+        return {'queued': self.queued, 'running': len(self.running),
+            'jobs': len(self.jobs), 'workers': self.workers, 'max_queued': self.max_queued}
+
+
+    async def handle(self, reader, writer):
+        '''
+        Handles one HTTP connection with a single request. Invalid requests,
+        including fields of the wrong type, are answered with 400, other 
+        failures with 500.
+        '''
+        try:
+            method, path, body = await self.read_request(reader)
+            await self.route(method, path, body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except (ValueError, TypeError, KeyError) as error:
+            await self.respond(writer, 400, {'error': str(error)})
+        except Exception as error:
+            await self.respond(writer, 500, {'error': type(error).__name__+': '+str(error)})
+        finally:
+            writer.close()
+
+
+    async def read_request(self, reader):
+        '''
+        Returns: the method, path and decoded JSON body of a request
+        '''
+        line = (await reader.readline()).decode('latin-1').split()
+        if len(line) != 3:
+            raise ValueError('invalid request line')
+        method, path = line[0], line[1].split('?')[0]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > max_body:
+            raise ValueError('request body too large')
+        body = None
+        if length > 0:
+            body = json.loads(await reader.readexactly(length))
+        return method, path, body
+
+
+    async def route(self, method, path, body, writer):
+        '''
+        Answers a request.
+        '''
+        parts = [part for part in path.split('/') if part]
+        if parts == ['status'] and method == 'GET':
+            await self.respond(writer, 200, self.status())
+        elif parts == ['jobs'] and method == 'GET':
+            await self.respond(writer, 200, [element.state() for element in self.jobs.values()])
+        elif parts == ['jobs'] and method == 'POST':
+            if not isinstance(body, dict):
+                raise ValueError('request body is not a JSON object')
+            submitted = await self.submit(body.get('kind', 'simulation'),
+                body.get('scenario', {}), body.get('priority', 0))
+            if submitted is None:
+                await self.respond(writer, 429, {'error': 'queue full'},
+                    {'Retry-After': str(max(1, round(progress_interval)))})
+            else:
+                await self.respond(writer, 202, submitted.state())
+        elif len(parts) in (2, 3) and parts[0] == 'jobs' and parts[1] not in self.jobs:
+            await self.respond(writer, 404, {'error': 'unknown job: '+parts[1]})
+        elif len(parts) == 2 and parts[0] == 'jobs' and method == 'GET':
+            await self.respond(writer, 200, self.jobs[parts[1]].state())
+        elif len(parts) == 2 and parts[0] == 'jobs' and method == 'DELETE':
+            await self.respond(writer, 200, (await self.cancel(parts[1])).state())
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events' and method == 'GET':
+            await self.follow(self.jobs[parts[1]], writer)
+        elif parts in (['status'], ['jobs']) or parts[:1] == ['jobs'] and len(parts) <= 3:
+            await self.respond(writer, 405, {'error': 'method not allowed: '+method})
+        else:
+            await self.respond(writer, 404, {'error': 'unknown path: '+path})
+
+
+    async def follow(self, followed, writer):
+        '''
+        Streams the state of a job as JSON lines until it has ended. The
+        stream waits for the client to read each line, so a slow client
+        only slows down its own stream.
+        '''
+        listener = asyncio.Queue()
+        followed.listeners.add(listener)
+        try:
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n'
+                b'Cache-Control: no-cache\r\nConnection: close\r\n\r\n')
+            state = followed.state()
+            while True:
+                writer.write(json.dumps(state).encode()+b'\n')
+                await writer.drain()
+                if state['status'] in ended:
+                    return
+                state = await listener.get()
+                # Skip to the latest state if the client fell behind
+                while not listener.empty():
+                    state = listener.get_nowait()
+        finally:
+            followed.listeners.discard(listener)
+
+
+    async def respond(self, writer, code, payload, headers={}):
+        '''
+        Writes a JSON response.
+        '''
+        body = json.dumps(payload).encode()
+        lines = ['HTTP/1.1 '+str(code)+' '+reasons[code],
+            'Content-Type: application/json', 'Content-Length: '+str(len(body)),
+            'Connection: close']
+        lines += [name+': '+value for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines)+'\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+
+# Argument parser
+# --------------------------------------------------------------------
+
+parser = argparse.ArgumentParser(description='Runs AttritionSim as a local HTTP/JSON '
+    'service with a job queue and a pool of worker processes.')
+parser.add_argument('--host', default=host,
+    help='Address to listen on. Default: '+host)
+parser.add_argument('--port', default=port, type=int,
+    help='Port to listen on. Default: '+str(port))
+parser.add_argument('--workers', default=workers, type=int,
+    help='Number of worker processes. Default: number of processors')
+parser.add_argument('--max_queued', default=max_queued, type=int,
+    help='Number of queued computations before new jobs are refused. Default: '
+    +str(max_queued))
+
+
+def main(argv=None):
+    '''
+    Runs the service with the given command line arguments, or those of
+    the current process.
+    '''
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(service(args.workers, args.max_queued).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+# Main
+# --------------------------------------------------------------------
+
+if __name__ == "__main__":
+    freeze_support()
+    main()
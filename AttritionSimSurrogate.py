@@ -0,0 +1,316 @@
+'''
+Version: 0.1
+Authors: Steffen Pielström
+Dependencies: AttritionSim.py v0.3, AttritionSimCache.py v0.1, numpy, json,
+math, statistics
+
+Surrogate model for instant what-if queries. Running an ensemble of
+simulations takes seconds to minutes, which is too slow for exploring the
+parameter space interactively. The surrogate is a Gaussian process
+regression fitted to the ensembles stored in a result cache (see
+AttritionSimCache.py): it predicts a force's win probability or mean final
+strength for any combination of strengths, ranges, speeds and accuracies
+in milliseconds, together with the uncertainty of the prediction. Where
+the uncertainty is too high, i.e. far from any stored ensemble or where
+they disagree, the query falls back to running the ensemble, which is
+then stored in the cache and used for the next fit.
+
+Inputs are the logarithms of the eight numeric parameters, scaled to unit
+variance over the training data; the noise of each training point is the
+sampling variance of its ensemble. The other parameters (max_steps,
+formations, engine, line of sight) are not interpolated: each combination
+of them gets its own model.
+
+Usage:
+    model = surrogate(result_cache('cache.sqlite'), tolerance=0.05)
+    model.train(strength=[[40, 40], [40, 55], [55, 40]], accuracy=[[0.07, 0.05], [0.05, 0.07]])
+    model.query(strength=[40, 50], accuracy=[0.07, 0.05]).value
+'''
+
+# Imports
+# --------------------------------------------------------------------
+
+import json
+from math import log
+from math import inf
+from statistics import NormalDist
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import AttritionSim as sim
+from AttritionSimCache import canonical
+
+
+# Variables
+# --------------------------------------------------------------------
+
+# Numeric parameters interpolated by the model, each for both forces
+numeric_fields = ['strength', 'range', 'speed', 'accuracy']
+
+# Length scales tried when fitting, in units of the inputs' standard deviation
+length_scales = [0.25, 0.5, 1.0, 2.0, 4.0]
+
+# Scale of inputs that do not vary in the training data: a query that
+# differs from them is far from every training point
+fixed_scale: float = 0.1
+
+
+# Functions
+# --------------------------------------------------------------------
+
+def context(parameters):
+    '''
+    Returns: the parameters of a scenario that are not interpolated, as a
+    string to group scenarios by
+    '''
+    return json.dumps({name: value for name, value in parameters.items()
+        if name not in numeric_fields}, sort_keys=True)
+
+
+def features(parameters):
+    '''
+    Returns: the logarithms of the numeric parameters of both forces
+
+    Test:
+    >>> features(canonical(strength=[10, 10], range=[70, 70], speed=[1, 1], accuracy=[1, 1]))[:4]
+    [2.302585092994046, 2.302585092994046, 4.248495242049359, 4.248495242049359]
+    '''
+    return [log(max(value, 1e-6)) for name in numeric_fields for value in parameters[name]]
+
+
+def target(summary, statistic='win', side=0):
+    '''
+    Arguments: an ensemble summary, see AttritionSimCache.summarize(), the
+    statistic and the index of the force it refers to
+    Returns: the value of the statistic and its sampling variance
+
+    Test:
+    >>> target({'replicates': 8, 'wins': [6, 2]})
+    (0.75, 0.021)
+    '''
+    n = summary['replicates']
+    if statistic == 'win':
+        # Shrunk towards 0.5, so that unanimous ensembles keep some noise
+        shrunk = (summary['wins'][side] + 1)/(n + 2)
+        return summary['wins'][side]/n, shrunk*(1 - shrunk)/(n + 2)
+    sd = summary['sd_strength'][side]
+    return summary['mean_strength'][side], (sd**2 if sd is not None else 1.0)/n
+
+
+# Classes
+# --------------------------------------------------------------------
+
+class gaussian_process():
+    '''
+    Version: 0.1
+
+    Gaussian process regression with a squared exponential kernel, a
+    constant mean and a known noise variance per training point.
+    - offset, scale: arrays, centering and scaling of the inputs
+    - mean: float, the prior mean, i.e. the mean of the targets
+    - variance: float, the prior variance of the statistic
+    - length: float, the length scale, chosen by leave-one-out likelihood
+    - inputs: array of the scaled training inputs
+    - weights: array, the inverse kernel matrix times the targets
+    - inverse: array, the inverse kernel matrix
+    '''
+    def __init__(self, inputs, values, noise, variance):
+        '''
+        Arguments: lists of training inputs, values and their noise
+        variances, and the prior variance
+
+        Test:
+        >>> model = gaussian_process([[0.0], [1.0], [2.0]], [0.2, 0.4, 0.6], [1e-4]*3, 0.25)
+        >>> value, sd = model.predict([[1.5]])
+        >>> round(float(value[0]), 2), bool(sd[0] < 0.05)
+        (0.5, True)
+        >>> bool(model.predict([[20.0]])[1][0] > 0.4)
+        True
+        '''
+        if np is None:
+            raise ImportError('The surrogate model requires numpy to be installed.')
+        inputs = np.asarray(inputs, dtype=float)
+        values = np.asarray(values, dtype=float)
+        self.offset = inputs.mean(axis=0)
+        spread = inputs.std(axis=0)
+        self.scale = np.where(spread > 0, spread, fixed_scale)
+        self.inputs = (inputs - self.offset)/self.scale
+        self.mean = float(values.mean())
+        self.variance = variance
+
+        distances = ((self.inputs[:, None, :] - self.inputs[None, :, :])**2).sum(axis=2)
+        residuals = values - self.mean
+        best = -inf
+        for length in length_scales:
+            matrix = variance*np.exp(-distances/(2*length**2)) + np.diag(noise)
+            inverse = np.linalg.inv(matrix)
+            weights = inverse @ residuals
+            # Leave-one-out predictive log-likelihood, Rasmussen & Williams eq. 5.10
+            loo_variance = 1/np.diag(inverse)
+            loo_error = weights*loo_variance
+            score = -(np.log(loo_variance) + loo_error**2/loo_variance).sum()
+            if score > best:
+                best = score
+                self.length, self.inverse, self.weights = length, inverse, weights
+
+
+    def predict(self, inputs):
+        '''
+        Arguments: a list of inputs
+        Returns: arrays of the predicted means and standard deviations
+        '''
+        inputs = (np.asarray(inputs, dtype=float) - self.offset)/self.scale
+        distances = ((inputs[:, None, :] - self.inputs[None, :, :])**2).sum(axis=2)
+        covariance = self.variance*np.exp(-distances/(2*self.length**2))
+        means = self.mean + covariance @ self.weights
+        variances = self.variance - np.einsum('ij,jk,ik->i', covariance, self.inverse, covariance)
+        return means, np.sqrt(np.maximum(variances, 0))
+
+
+class surrogate():
+    '''
+    Version: 0.1
+
+    Answers queries for a statistic of a scenario from a model fitted to
+    the ensembles in a result cache, or by running the ensemble if the
+    model's confidence interval is wider than the tolerance.
+    - cache: the result_cache the model is trained from
+    - statistic: string, either 'win' or 'strength', like in run_adaptive()
+    - side: int, the index of the force the statistic refers to
+    - tolerance: float, the largest half-width of the confidence interval
+      that is answered by the model
+    - confidence: float, the confidence level of the interval
+    - n_replicates: int, replicates per ensemble run on a fallback
+    - seed: int, root seed of the ensembles run on a fallback
+    - models: dict of a gaussian_process per context, see context()
+    - stale: boolean, True if the cache has new ensembles to fit
+    - fallbacks: int, the number of queries answered by simulation
+    '''
+    def __init__(self, cache, statistic='win', side=0, tolerance=0.05, confidence=0.95,
+        n_replicates=1000, seed=1):
+        '''
+        Test:
+        >>> from AttritionSimCache import result_cache
+        >>> model = surrogate(result_cache(':memory:'), tolerance=0.1, n_replicates=50)
+        >>> model.train(strength=[[5, 5], [5, 10], [10, 5]], accuracy=[[1, 0]], range=[[200, 200]])
+        >>> answer = model.query(strength=[6, 6], accuracy=[1, 0], range=[200, 200])
+        >>> answer.source, answer.value
+        ('surrogate', 1.0)
+        >>> answer = model.query(strength=[6, 6], accuracy=[0, 1], range=[200, 200])
+        >>> answer.source, answer.value, model.fallbacks
+        ('simulation', 0.0, 1)
+        >>> model.query(strength=[6, 6], acuracy=[0, 1])
+        Traceback (most recent call last):
+        ...
+        ValueError: Unknown scenario parameter: acuracy
+        '''
+        if statistic not in ('win', 'strength'):
+            raise ValueError('Unknown statistic: '+str(statistic)+
+                ', specify as either \'win\' or \'strength\'')
+        self.cache = cache
+        self.statistic = statistic
+        self.side = side
+        self.tolerance = tolerance
+        self.confidence = confidence
+        self.n_replicates = n_replicates
+        self.seed = seed
+        self.models = {}
+        self.stale = True
+        self.fallbacks = 0
+
+
+    def train(self, **lists):
+        '''
+        Runs the ensembles of all combinations of the given lists of
+        strength, range, speed and accuracy pairs, see result_cache.sweep(),
+        to train the model on. Further keyword arguments are passed on.
+        '''
+        for _ in self.cache.sweep(self.n_replicates, self.seed, **lists):
+            pass
+        self.stale = True
+
+
+    def fit(self):
+        '''
+        Fits one model per context to the ensembles in the cache. Of nested
+        ensembles, i.e. the same scenario and seed with different numbers
+        of replicates, only the largest one is used.
+        '''
+        largest = {}
+        for parameters, seed, summary in self.cache.ensembles():
+            name = (json.dumps(parameters, sort_keys=True), seed)
+            if name not in largest or summary['replicates'] > largest[name][1]['replicates']:
+                largest[name] = (parameters, summary)
+
+        data = {}
+        for parameters, summary in largest.values():
+            if summary['replicates'] == 0:
+                continue
+            value, noise = target(summary, self.statistic, self.side)
+            inputs, values, noises = data.setdefault(context(parameters), ([], [], []))
+            inputs.append(features(parameters))
+            values.append(value)
+            noises.append(noise)
+
+        self.models = {}
+        for name, (inputs, values, noises) in data.items():
+            if self.statistic == 'win':
+                variance = 0.25
+            else:
+                variance = max(float(np.var(values)), max(values)**2/4, 1.0)
+            self.models[name] = gaussian_process(inputs, values, noises, variance)
+        self.stale = False
+
+
+    def predict(self, **scenario):
+        '''
+        Returns: the model's prediction for a scenario and its standard
+        deviation, or None and inf if there is no model for its context
+        '''
+        if self.stale:
+            self.fit()
+        parameters = canonical(**scenario)
+        model = self.models.get(context(parameters))
+        if model is None:
+            return None, inf
+        means, sds = model.predict([features(parameters)])
+        value = float(means[0])
+        if self.statistic == 'win':
+            value = min(max(value, 0.0), 1.0)
+        return value, float(sds[0])
+
+
+    def query(self, **scenario):
+        '''
+        Arguments: the scenario as keyword arguments of run_simulation()
+        Returns: an estimate object, see AttritionSim.estimate, with the
+        additional attribute source: 'surrogate' if the value is the
+        model's prediction, 'simulation' if it was computed from an ensemble
+        '''
+        value, sd = self.predict(**scenario)
+        z = NormalDist().inv_cdf(0.5 + self.confidence/2)
+        result = sim.estimate(self.statistic, self.side, self.confidence, self.tolerance,
+            self.seed)
+        if z*sd <= self.tolerance:
+            result.value = value
+            result.halfwidth = z*sd
+            result.interval = [value - z*sd, value + z*sd]
+            result.converged = True
+            result.source = 'surrogate'
+            return result
+
+        rows = self.cache.replicates(self.n_replicates, self.seed, **scenario)
+        if self.statistic == 'win':
+            result.update([int(row[1 + self.side] > 0 and row[2 - self.side] == 0)
+                for row in rows])
+        else:
+            result.update([row[1 + self.side] for row in rows])
+        # Stores the ensemble's aggregate for the next fit
+        self.cache.ensemble(self.n_replicates, self.seed, **scenario)
+        result.source = 'simulation'
+        self.fallbacks += 1
+        self.stale = True
+        return result
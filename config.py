@@ -19,7 +19,7 @@ Strength: List[int] = [10, 10]
 Range: List[float] = [70, 70]
 Speed: List[float] = [1,1]
 Accuracy: List[float] = [0.05, 0.05] # a probabilty between 0 and 1
-Formation: List[str] = ['one line', 'one line'] # more options not yet implemented
+Formation: List[str] = ['one line', 'one line'] # 'two lines', 'scattered', 'grid', 'column'
 
 # Default for the max of simulation steps
 max_steps: int = 100
@@ -33,6 +33,10 @@ dist_border_init: float = 10
 # Proportion of range at wich units stop to close in to the enemy
 firing_distance: float = 0.5 # a proportion between 0 and 1
 
+# Radius around a unit in which it blocks shots of other units, if line 
+# of sight is checked
+unit_radius: float = 0.25
+
 
 # System variables
 # ----------------------------------------------------------------------------------
@@ -41,3 +45,27 @@ firing_distance: float = 0.5 # a proportion between 0 and 1
 Faction: List[int] = [0, 1]
 Name: List[str] = ['Blue', 'Red']
 Color: List[str] = ['blue', 'darkred']
+
+# Maximum number of unit pairs processed in one vectorized block by the
+# numpy engine; limits the memory used for distance matrices
+chunk_size: int = 2**20
+
+# Number of bins of the strength histograms an ensemble keeps for each
+# step; strengths below it are counted exactly, larger forces in bins of
+# equal width, which bounds the memory of run_ensemble()
+ensemble_bins: int = 1024
+
+# Use step kernels compiled with numba in the numpy engine, if numba is
+# installed; results are the same either way
+jit_kernels: bool = True
+
+# Number of steps between two snapshots written to a checkpoint file
+checkpoint_every: int = 100
+
+# Number of closest enemy units in range a unit tries as new target when
+# its line of sight is blocked
+sight_candidates: int = 8
+
+# Verify in every step that incremental targeting picks the closest enemy
+# unit, like a search of the whole enemy force; slow, for debugging only
+check_targeting: bool = False